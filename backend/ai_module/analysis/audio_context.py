@@ -0,0 +1,46 @@
+import librosa
+
+# === Configuration ===
+# Highest rate needed by any analyzer (mood runs at 44.1 kHz, genre and BPM at 22.05 kHz)
+ANALYSIS_SR = 44100
+
+
+class AudioContext:
+    """
+    Audio of one upload, decoded once and shared by the genre, mood, BPM and
+    duration analyzers. Lower-rate views are resampled from the decoded buffer
+    on first use and cached, so the file itself is never decoded twice.
+    """
+
+    def __init__(self, y, sr):
+        self.y = y
+        self.sr = sr
+        self._views = {sr: y}
+
+    @classmethod
+    def from_file(cls, audio_path, sr=ANALYSIS_SR):
+        """Decode a path, or a file-like object such as an in-memory io.BytesIO buffer."""
+        y, sr = librosa.load(audio_path, sr=sr, mono=True)
+        print(f"Audio decoded once: {len(y) / sr:.2f} seconds at {sr} Hz")
+        return cls(y, sr)
+
+    @property
+    def duration(self):
+        return len(self.y) / self.sr
+
+    def signal(self, sr):
+        """Return the mono signal at `sr`, resampling from the decoded buffer if needed."""
+        if sr not in self._views:
+            self._views[sr] = librosa.resample(self.y, orig_sr=self.sr, target_sr=sr)
+        return self._views[sr]
+
+    def segment(self, start, duration, sr):
+        """
+        Mono signal of [start, start + duration) seconds at `sr`. Cut from a
+        cached view when there is one, otherwise only the segment is resampled.
+        """
+        if sr in self._views:
+            view = self._views[sr]
+            return view[int(start * sr):int((start + duration) * sr)]
+        piece = self.y[int(start * self.sr):int((start + duration) * self.sr)]
+        return librosa.resample(piece, orig_sr=self.sr, target_sr=sr)
@@ -0,0 +1,99 @@
+import hashlib
+import os
+import tempfile
+
+import httpx
+
+# === Configuration ===
+DOWNLOAD_TIMEOUT_SECONDS = 60
+DOWNLOAD_CHUNK_SIZE = 256 * 1024
+MAX_DOWNLOAD_BYTES = int(os.getenv("AI_MAX_DOWNLOAD_MB", "200")) * 1024 * 1024
+
+
+class DownloadTooLarge(Exception):
+    """Raised when an upload exceeds MAX_DOWNLOAD_BYTES."""
+
+
+class _TempWriter:
+    """
+    Writes a download to a temp file chunk by chunk, enforcing the size limit
+    and hashing the content on the way, so the response is never held in
+    memory and the file never has to be read again just to hash it.
+    """
+
+    def __init__(self, suffix, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.digest = hashlib.sha256()
+        self.file = tempfile.NamedTemporaryFile(delete=False, suffix=suffix)
+
+    def check_length(self, response):
+        length = response.headers.get("content-length")
+        if length is not None and int(length) > self.max_bytes:
+            raise DownloadTooLarge(f"File is {length} bytes, limit is {self.max_bytes}")
+
+    def write(self, chunk):
+        self.size += len(chunk)
+        if self.size > self.max_bytes:
+            raise DownloadTooLarge(f"File exceeds the {self.max_bytes} byte limit")
+        self.digest.update(chunk)
+        self.file.write(chunk)
+
+    def finish(self):
+        self.file.close()
+        print(f"Saved {self.size} bytes to temp path:", self.file.name)
+        return self.file.name, self.digest.hexdigest()
+
+    def discard(self):
+        self.file.close()
+        try:
+            os.remove(self.file.name)
+        except OSError:
+            pass
+
+
+async def download_to_temp(file_url, suffix=".mp3", max_bytes=MAX_DOWNLOAD_BYTES):
+    """
+    Stream file_url to a temp file without blocking the event loop.
+    Returns (temp file path, SHA-256 of the content), or (None, None) on failure.
+    """
+    writer = _TempWriter(suffix, max_bytes)
+    try:
+        print("Downloading file from URL...")
+        async with httpx.AsyncClient(timeout=DOWNLOAD_TIMEOUT_SECONDS) as client:
+            async with client.stream("GET", file_url) as response:
+                if response.status_code != 200:
+                    print("Failed to download file. Status code:", response.status_code)
+                    writer.discard()
+                    return None, None
+                writer.check_length(response)
+                async for chunk in response.aiter_bytes(DOWNLOAD_CHUNK_SIZE):
+                    writer.write(chunk)
+        print("File downloaded successfully.")
+        return writer.finish()
+    except Exception as e:
+        print("Exception while downloading file:", e)
+        writer.discard()
+        return None, None
+
+
+def download_to_temp_blocking(file_url, suffix=".mp3", max_bytes=MAX_DOWNLOAD_BYTES):
+    """Same as download_to_temp, for worker threads that have no event loop."""
+    writer = _TempWriter(suffix, max_bytes)
+    try:
+        print("Downloading file from URL...")
+        with httpx.Client(timeout=DOWNLOAD_TIMEOUT_SECONDS) as client:
+            with client.stream("GET", file_url) as response:
+                if response.status_code != 200:
+                    print("Failed to download file. Status code:", response.status_code)
+                    writer.discard()
+                    return None, None
+                writer.check_length(response)
+                for chunk in response.iter_bytes(DOWNLOAD_CHUNK_SIZE):
+                    writer.write(chunk)
+        print("File downloaded successfully.")
+        return writer.finish()
+    except Exception as e:
+        print("Exception while downloading file:", e)
+        writer.discard()
+        return None, None
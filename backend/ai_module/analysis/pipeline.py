@@ -0,0 +1,321 @@
+import os
+from contextlib import contextmanager
+from functools import partial
+
+from genre import genre_ai
+from mood import mood_ai
+from bpm import bpm as bpm_ai
+from analysis.audio_context import AudioContext
+from analysis import sampling, streaming
+from analysis.download import download_to_temp_blocking
+from cache.feature_cache import FeatureCache, hash_file
+
+# Decoded features and predictions of previously analysed audio
+FEATURE_CACHE = FeatureCache()
+# Tracks longer than this are analysed in streaming mode, in bounded memory
+STREAMING_MIN_SECONDS = float(os.getenv("AI_STREAMING_MIN_SECONDS", "900"))
+
+
+def unknown_result():
+    return {
+        "genre": {"prediction": "Unknown", "confidence": 0},
+        "mood": {"prediction": "Unknown", "confidence": 0},
+        "bpm": 0,
+        "valence": 0,
+        "arousal": 0
+    }
+
+
+@contextmanager
+def pinned_models():
+    """
+    Acquire the genre and mood model versions once for a whole analysis and
+    yield them as (genre_version, mood_version); either is None when no
+    model exists. Every chunk and segment of the track is scored on these
+    versions, even if a new model is uploaded meanwhile.
+    """
+    with genre_ai.MODEL_REGISTRY.acquire() as genre_version, mood_ai.MODEL_REGISTRY.acquire() as mood_version:
+        yield genre_version, mood_version
+
+
+def current_model_version(models=None):
+    """
+    Versions of the genre and mood models and of the BPM detection, or None
+    while a model is missing. The pinned `models` if given, else the resident ones.
+    """
+    if models is not None:
+        genre_version, mood_version = (version.name if version else None for version in models)
+    else:
+        genre_version = genre_ai.MODEL_REGISTRY.status()["active_version"]
+        mood_version = mood_ai.MODEL_REGISTRY.status()["active_version"]
+    if genre_version is None or mood_version is None:
+        return None
+    return f"{genre_version}|{mood_version}|{bpm_ai.FEATURE_VERSION}"
+
+
+def prediction_version(exhaustive=False, models=None):
+    """Cache key of predictions: the model versions, and whether every segment was scored or a sample."""
+    model_version = current_model_version(models)
+    if model_version is None:
+        return None
+    return f"{model_version}|{'exhaustive' if is_exhaustive(exhaustive) else sampling.SAMPLING_VERSION}"
+
+
+def is_exhaustive(exhaustive=False):
+    """Whether to score every chunk and segment: on request, or when adaptive sampling is turned off."""
+    return exhaustive or not sampling.ADAPTIVE_SAMPLING
+
+
+def should_stream(audio_path):
+    """Whether a track is long enough for streaming analysis (and soundfile can read it in blocks)."""
+    try:
+        duration = bpm_ai.read_metadata(audio_path)["duration_seconds"]
+    except Exception:
+        return False
+    return duration is not None and duration > STREAMING_MIN_SECONDS and streaming.can_stream(audio_path)
+
+
+def extract_features(audio_path, audio_hash=None):
+    """
+    Feature stage: genre chunk images, mood mel segments, BPM and duration.
+    Cached features are reused; the file is decoded once, and only if
+    something is missing.
+    """
+    features = {}
+    if audio_hash:
+        features["genre_images"] = FEATURE_CACHE.get_array(audio_hash, "genre_images", genre_ai.FEATURE_VERSION)
+        features["mood_segments"] = FEATURE_CACHE.get_array(audio_hash, "mood_segments", mood_ai.FEATURE_VERSION)
+        features["track_stats"] = FEATURE_CACHE.get_json(audio_hash, "track_stats", bpm_ai.FEATURE_VERSION)
+        if all(value is not None for value in features.values()):
+            print("Using cached features for", audio_hash)
+            return features
+
+    # Decode once and share the audio across all analyzers
+    try:
+        print("Decoding audio...")
+        context = AudioContext.from_file(audio_path)
+    except Exception as e:
+        print("Error decoding audio, analyzers will load the file themselves:", e)
+        context = None
+
+    if features.get("genre_images") is None:
+        try:
+            print("Extracting genre features...")
+            features["genre_images"] = genre_ai.extract_chunk_images(audio_path, context=context)
+            if audio_hash and features["genre_images"] is not None:
+                FEATURE_CACHE.put_array(audio_hash, "genre_images", genre_ai.FEATURE_VERSION, features["genre_images"])
+        except Exception as e:
+            print("Error in extract_chunk_images:", e)
+            features["genre_images"] = None
+
+    if features.get("mood_segments") is None:
+        try:
+            print("Extracting mood features...")
+            features["mood_segments"] = mood_ai.preprocess_song(audio_path, context=context)
+            if audio_hash and features["mood_segments"] is not None:
+                FEATURE_CACHE.put_array(audio_hash, "mood_segments", mood_ai.FEATURE_VERSION, features["mood_segments"])
+        except Exception as e:
+            print("Error in preprocess_song:", e)
+            features["mood_segments"] = None
+
+    if features.get("track_stats") is None:
+        try:
+            print("Detecting BPM...")
+            tempo = bpm_ai.estimate_tempo(audio_path, context=context)
+            bpm = float(tempo["bpm"] or 0)
+            print("Detected BPM:", bpm, "confidence:", tempo["confidence"])
+        except Exception as e:
+            print("Error in estimate_tempo:", e)
+            tempo, bpm = {}, None
+
+        try:
+            duration = context.duration if context is not None else bpm_ai.probe_duration(audio_path)
+        except Exception as e:
+            print("Error in probe_duration:", e)
+            duration = None
+        features["track_stats"] = {
+            "bpm": bpm,
+            "bpm_confidence": tempo.get("confidence"),
+            "tempo_curve": tempo.get("tempo_curve"),
+            "duration_seconds": duration
+        }
+        if audio_hash and bpm is not None and duration is not None:
+            FEATURE_CACHE.put_json(audio_hash, "track_stats", bpm_ai.FEATURE_VERSION, features["track_stats"])
+
+    return features
+
+
+def score_genre(images, version, exhaustive=False):
+    """Genre result and the number of chunks scored on `version`; all of them, or an adaptive sample."""
+    if images is None or not len(images) or version is None:
+        return None, 0
+    predict = partial(genre_ai.predict_chunk_images, version=version)
+    if is_exhaustive(exhaustive):
+        probs = predict(images)
+    else:
+        probs = sampling.sample_genre(images, predict)
+        print(f"Scored {len(probs)} of {len(images)} genre chunks")
+    return genre_ai.summarize_genre(probs), len(probs)
+
+
+def score_mood(segments, song_name, version, exhaustive=False):
+    """(mood result, valence, arousal) and the number of segments scored on `version`; all of them, or an adaptive sample."""
+    if segments is None or not len(segments) or version is None:
+        return None, 0
+    predict = partial(mood_ai.BATCHER.predict, version=version)
+    if is_exhaustive(exhaustive):
+        predictions = predict(segments)
+    else:
+        predictions = sampling.sample_mood(segments, predict)
+        print(f"Scored {len(predictions)} of {len(segments)} mood segments")
+    return mood_ai.summarize_mood(predictions, song_name), len(predictions)
+
+
+def segment_counts(features, genre_used, mood_used, exhaustive=False):
+    """The "segments" field of a result: how many chunks and segments were scored, out of how many."""
+    def total(key):
+        return 0 if features.get(key) is None else len(features[key])
+
+    return {
+        "mode": "exhaustive" if is_exhaustive(exhaustive) else "adaptive",
+        "genre": {"used": genre_used, "total": total("genre_images")},
+        "mood": {"used": mood_used, "total": total("mood_segments")},
+    }
+
+
+def run_inference(features, audio_path, exhaustive=False, models=None):
+    """
+    Inference stage: genre and mood from extracted features, each failing
+    independently to "Unknown". Unless `exhaustive`, only as many chunks and
+    segments are scored as the predictions need (see analysis/sampling.py).
+    Scored on the pinned `models`, or on versions pinned for this call.
+    """
+    if models is None:
+        with pinned_models() as models:
+            return run_inference(features, audio_path, exhaustive, models)
+    genre_version, mood_version = models
+
+    genre_used = mood_used = 0
+    try:
+        print("Predicting genre...")
+        genre_results, genre_used = score_genre(features["genre_images"], genre_version, exhaustive)
+        if genre_results is None:
+            genre_results = {"prediction": "Unknown", "confidence": 0}
+        print("Genre results:", genre_results)
+    except Exception as e:
+        print("Error in predict_genre:", e)
+        genre_results = {"prediction": "Unknown", "confidence": 0}
+
+    try:
+        print("Predicting mood...")
+        mood_data, mood_used = score_mood(features["mood_segments"], os.path.basename(audio_path), mood_version,
+                                          exhaustive)
+        if mood_data is None:
+            mood_results, avg_valence_predicted, avg_arousal_predicted = {"prediction": "Unknown", "confidence": 0}, 0, 0
+        else:
+            mood_results, avg_valence_predicted, avg_arousal_predicted = mood_data
+        print("Mood results:", mood_results)
+    except Exception as e:
+        print("Error in predict_mood:", e)
+        mood_results, avg_valence_predicted, avg_arousal_predicted = {"prediction": "Unknown", "confidence": 0}, 0, 0
+
+    stats = features["track_stats"]
+    duration = stats["duration_seconds"]
+    if duration is None:
+        duration_text = bpm_ai.get_duration(audio_path)
+    else:
+        duration_text = bpm_ai.format_duration(duration)
+
+    return {
+        "genre": genre_results,
+        "mood": mood_results,
+        "bpm": round(stats["bpm"] or 0),
+        "bpm_confidence": stats.get("bpm_confidence"),
+        "tempo_curve": stats.get("tempo_curve"),
+        "valence": round(avg_valence_predicted, 2),
+        "arousal": round(avg_arousal_predicted, 2),
+        "duration": duration_text,
+        "segments": segment_counts(features, genre_used, mood_used, exhaustive)
+    }
+
+
+def analyze_file(audio_path, audio_hash=None, exhaustive=False):
+    """
+    Run the full analysis of one downloaded track. Blocking and CPU-bound;
+    the API runs it in the analysis worker pool. Pass the audio_hash computed
+    while downloading to avoid reading the file again.
+
+    Results are cached by audio content and model versions: a re-upload of
+    the same audio is answered from the cache, and after a model upload only
+    inference runs again on the cached features. With `exhaustive`, every
+    chunk and segment is scored instead of an adaptive sample.
+    """
+    # 1. Answer from the cache when this audio was already scored by these models
+    if audio_hash is None:
+        try:
+            audio_hash = hash_file(audio_path)
+        except Exception as e:
+            print("Error hashing audio, cache disabled for this file:", e)
+
+    # The whole analysis runs on the model versions pinned here, so its cache key stays valid
+    with pinned_models() as models:
+        model_version = prediction_version(exhaustive, models)
+        if audio_hash and model_version:
+            # An exhaustive result answers a sampled request as well
+            for version in dict.fromkeys([model_version, prediction_version(True, models)]):
+                cached = FEATURE_CACHE.get_json(audio_hash, "prediction", version)
+                if cached is not None:
+                    print("Using cached prediction for", audio_hash)
+                    return cached
+
+        if should_stream(audio_path):
+            # 2-3. Long track: features are scored as they are computed, never held (or cached) whole.
+            # Every segment is scored, as they arrive in track order, so the result is an exhaustive one
+            result = streaming.analyze_streaming(audio_path, models)
+            model_version = prediction_version(True, models)
+        else:
+            # 2. Features, reusing cached ones
+            features = extract_features(audio_path, audio_hash)
+
+            # 3. Inference on the pinned models
+            result = run_inference(features, audio_path, exhaustive, models)
+
+    # 4. Cache complete results
+    complete = result["genre"]["prediction"] != "Unknown" and result["mood"]["prediction"] != "Unknown"
+    if audio_hash and model_version and complete:
+        FEATURE_CACHE.put_json(audio_hash, "prediction", model_version, result)
+
+    return result
+
+
+def fetch_source(source):
+    """
+    Resolve a local audio file or a URL to (path, audio_hash, is_temp).
+    URLs are streamed to a temp file that the caller must remove.
+    """
+    if os.path.isfile(source):
+        return source, hash_file(source), False
+
+    tmp_path, audio_hash = download_to_temp_blocking(source)
+    if tmp_path is None:
+        raise RuntimeError(f"Failed to download {source}")
+    return tmp_path, audio_hash, True
+
+
+def remove_temp(tmp_path):
+    try:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+            print("Temp file removed:", tmp_path)
+    except Exception as e:
+        print("Error deleting temp file:", e)
+
+
+def analyze_source(source, exhaustive=False):
+    """Analyze one local file or URL; used by background jobs. Raises if the download fails."""
+    path, audio_hash, is_temp = fetch_source(source)
+    try:
+        return analyze_file(path, audio_hash, exhaustive)
+    finally:
+        if is_temp:
+            remove_temp(path)
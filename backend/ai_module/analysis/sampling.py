@@ -0,0 +1,109 @@
+"""
+Adaptive sampling of the genre chunks and mood segments a track is scored on.
+
+Most tracks are consistent enough that a few chunks give the same answer as
+all of them. Chunks are scored in stratified order (start, middle, end, then
+the midpoints of the gaps) and scoring stops once the running averages are
+known tightly enough, or when the per-track budget is used up:
+
+    genre  the top class' average probability is known to within
+           GENRE_CI_HALF_WIDTH and leads the runner-up with confidence
+    mood   average valence and arousal are known to within MOOD_CI_HALF_WIDTH
+
+Intervals are Student-t intervals with a finite population correction, so
+they shrink to nothing as the sample approaches the whole track.
+"""
+import os
+
+import numpy as np
+from scipy import stats
+
+# === Configuration ===
+# Set to 0 to score every chunk and segment of every track
+ADAPTIVE_SAMPLING = os.getenv("AI_ADAPTIVE_SAMPLING", "1") == "1"
+CONFIDENCE_LEVEL = 0.95
+GENRE_CI_HALF_WIDTH = float(os.getenv("AI_SAMPLING_GENRE_CI", "0.08"))
+GENRE_MIN_CHUNKS = 3
+GENRE_ROUND_CHUNKS = 3
+# Budgets are at least one item: an empty first round would score an empty batch
+GENRE_BUDGET_CHUNKS = max(1, int(os.getenv("AI_SAMPLING_GENRE_BUDGET", "9")))
+# Valence and arousal are on the 1-9 scale
+MOOD_CI_HALF_WIDTH = float(os.getenv("AI_SAMPLING_MOOD_CI", "0.35"))
+MOOD_MIN_SEGMENTS = 6
+MOOD_ROUND_SEGMENTS = 6
+MOOD_BUDGET_SEGMENTS = max(1, int(os.getenv("AI_SAMPLING_MOOD_BUDGET", "24")))
+# Part of the prediction cache key, so results are not reused across settings
+SAMPLING_VERSION = (f"adaptive-g{GENRE_CI_HALF_WIDTH}x{GENRE_BUDGET_CHUNKS}"
+                    f"-m{MOOD_CI_HALF_WIDTH}x{MOOD_BUDGET_SEGMENTS}")
+
+
+def stratified_order(n):
+    """Indices 0..n-1 as start, middle, end, then the midpoints of each gap, breadth first."""
+    if n <= 2:
+        return list(range(n))
+    middle = (n - 1) // 2
+    order = [0, middle, n - 1]
+    gaps = [(0, middle), (middle, n - 1)]
+    while gaps:
+        next_gaps = []
+        for low, high in gaps:
+            if high - low > 1:
+                point = (low + high) // 2
+                order.append(point)
+                next_gaps += [(low, point), (point, high)]
+        gaps = next_gaps
+    return order
+
+
+def half_widths(values, population):
+    """Confidence interval half-widths of the column means of `values`, a sample of `population` rows."""
+    n = len(values)
+    if n >= population:
+        return np.zeros(values.shape[1:])
+    if n < 2:
+        return np.full(values.shape[1:], np.inf)
+    correction = np.sqrt((population - n) / (population - 1))
+    t = stats.t.ppf((1 + CONFIDENCE_LEVEL) / 2, n - 1)
+    return t * values.std(axis=0, ddof=1) / np.sqrt(n) * correction
+
+
+def genre_converged(probs, population):
+    mean = probs.mean(axis=0)
+    top, runner_up = np.argsort(mean)[::-1][:2]
+    lead = probs[:, top] - probs[:, runner_up]
+    return (half_widths(probs[:, [top]], population)[0] <= GENRE_CI_HALF_WIDTH
+            and lead.mean() - half_widths(lead[:, np.newaxis], population)[0] > 0)
+
+
+def mood_converged(predictions, population):
+    return bool(np.all(half_widths(predictions, population) <= MOOD_CI_HALF_WIDTH))
+
+
+def sample_scores(items, predict, converged, min_count, round_count, budget):
+    """
+    Score `items` in stratified order, a round at a time, until `converged`
+    or the budget runs out. Returns the scores of the sampled items in track
+    order.
+    """
+    order = stratified_order(len(items))
+    scores, sampled, used = [], [], 0
+    while used < len(order):
+        count = min_count if used == 0 else round_count
+        batch = np.sort(order[used:min(used + count, budget, len(order))])
+        scores.append(predict(items[batch]))
+        sampled.append(batch)
+        used += len(batch)
+        if used >= budget or converged(np.concatenate(scores), len(items)):
+            break
+    return np.concatenate(scores)[np.argsort(np.concatenate(sampled))]
+
+
+def sample_genre(images, predict):
+    """(n_sampled, n_classes) probabilities of the chunk images sampled for the genre vote."""
+    return sample_scores(images, predict, genre_converged, GENRE_MIN_CHUNKS, GENRE_ROUND_CHUNKS, GENRE_BUDGET_CHUNKS)
+
+
+def sample_mood(segments, predict):
+    """(n_sampled, 2) valence and arousal of the mel segments sampled for the mood average."""
+    return sample_scores(segments, predict, mood_converged, MOOD_MIN_SEGMENTS, MOOD_ROUND_SEGMENTS,
+                         MOOD_BUDGET_SEGMENTS)
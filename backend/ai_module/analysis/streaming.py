@@ -0,0 +1,293 @@
+"""
+Streaming analysis of long uploads with bounded memory.
+
+The regular pipeline decodes the whole track into memory (an hour at 44.1 kHz
+is over 600 MB as float32, before any analyzer makes its own copies). Here the
+file is read block by block with soundfile, each block is resampled with
+streaming resamplers, and three analyzers consume the blocks as they arrive:
+
+    MoodSegments   yields mel batches of every full 5 s segment
+    GenreWindows   yields genre images of the 30 s windows, cut from mel frames
+                   computed incrementally over the track
+    TempoWindows   keeps only the samples of the tempo windows
+
+Their outputs are scored right away and only the per-segment predictions are
+kept, so peak memory does not grow with the track length. The windows,
+segments and model inputs are the same as in the regular pipeline (up to
+resampling noise, see streaming_check.py).
+"""
+import os
+from functools import partial
+
+import numpy as np
+import soundfile as sf
+import soxr
+
+from genre import genre_ai
+from mood import mood_ai
+from bpm import bpm as bpm_ai
+from genre.melspec_render import render_melspec_pixels
+
+# === Configuration ===
+# Seconds of audio read and resampled at a time
+STREAM_BLOCK_SECONDS = 10
+MOOD_SR = 44100
+GENRE_SR = 22050
+
+
+def can_stream(audio_path):
+    """Whether soundfile can read the file block by block."""
+    try:
+        sf.info(audio_path)
+        return True
+    except Exception:
+        return False
+
+
+def read_blocks(audio_path, rates, block_seconds=STREAM_BLOCK_SECONDS):
+    """
+    Mono float32 blocks of the file resampled to each rate in `rates`, as
+    {sr: block} dicts. The last dict flushes the resamplers.
+    """
+    with sf.SoundFile(audio_path) as f:
+        resamplers = {
+            sr: soxr.ResampleStream(f.samplerate, sr, 1, dtype="float32", quality="HQ")
+            for sr in rates if sr != f.samplerate
+        }
+        for block in f.blocks(int(block_seconds * f.samplerate), dtype="float32", always_2d=True):
+            mono = block.mean(axis=1)
+            yield {sr: resamplers[sr].resample_chunk(mono) if sr in resamplers else mono for sr in rates}
+        empty = np.zeros(0, dtype=np.float32)
+        yield {sr: resamplers[sr].resample_chunk(empty, last=True) if sr in resamplers else empty for sr in rates}
+
+
+class MoodSegments:
+    """Mood model inputs of every full segment, as preprocess_song computes them."""
+
+    def __init__(self, sr=MOOD_SR, segment_length=5):
+        self.sr = sr
+        self.segment_samples = segment_length * sr
+        self._buffer = np.zeros(0, dtype=np.float32)
+
+    def feed(self, y):
+        """Yields (n, n_mels, frames, 1) batches of the segments completed by this block."""
+        self._buffer = np.concatenate([self._buffer, y])
+        n_segments = len(self._buffer) // self.segment_samples
+        if n_segments:
+            segments = self._buffer[:n_segments * self.segment_samples].reshape(n_segments, self.segment_samples)
+            yield mood_ai.segments_to_mel(segments, self.sr)
+            self._buffer = self._buffer[n_segments * self.segment_samples:].copy()
+
+    def finish(self):
+        # A trailing partial segment is dropped, as in preprocess_song
+        return iter(())
+
+
+class GenreWindows:
+    """
+    Genre images of the same windows as genre_ai.extract_chunk_images. Mel
+    frames are computed as samples arrive; only the frames and samples from
+    the latest window start onwards are kept, as the tail window may reach
+    back to it. The samples are needed for the window edge frames, which are
+    recomputed with each window's own padding as in the regular pipeline.
+    """
+
+    def __init__(self, sr=GENRE_SR, chunk_duration=30, overlap_duration=15):
+        self.sr = sr
+        self.chunk_len = int(chunk_duration * sr)
+        self.window_frames = 1 + self.chunk_len // genre_ai.HOP_LENGTH
+        self.step_frames = genre_ai.chunk_step(sr, chunk_duration, overlap_duration) // genre_ai.HOP_LENGTH
+        self.n_samples = 0
+        # Samples not yet fully framed, starting at frame self._next_frame (with the centering pad)
+        self._samples = np.zeros(genre_ai.N_FFT // 2, dtype=np.float32)
+        self._next_frame = 0
+        self._frames = np.zeros((genre_ai.N_MELS, 0), dtype=np.float32)
+        self._frames_start = 0
+        # Samples from sample self._audio_start on, for genre_ai.window_edge_frames
+        self._audio = np.zeros(0, dtype=np.float32)
+        self._audio_start = 0
+        self._next_window = 0
+        self._last_window = None
+
+    def _compute_frames(self, limit=None):
+        count = (len(self._samples) - genre_ai.N_FFT) // genre_ai.HOP_LENGTH + 1
+        if limit is not None:
+            count = min(count, limit - self._next_frame)
+        if count <= 0:
+            return
+        block = self._samples[:(count - 1) * genre_ai.HOP_LENGTH + genre_ai.N_FFT]
+        self._frames = np.concatenate([self._frames, genre_ai.mel_db_frames(block, self.sr)], axis=1)
+        self._next_frame += count
+        self._samples = self._samples[count * genre_ai.HOP_LENGTH:]
+
+    def _render(self, starts):
+        offsets = [start - self._frames_start for start in starts]
+        windows = np.stack([self._frames[:, offset:offset + self.window_frames] for offset in offsets])
+        for window, start in zip(windows, starts):
+            edge, edge_frames = genre_ai.window_edge_frames(
+                self._audio, start * genre_ai.HOP_LENGTH - self._audio_start, self.chunk_len, self.sr)
+            window[:, edge] = edge_frames
+        self._last_window = starts[-1]
+        # Frames and samples before the latest window start are no longer needed
+        drop = self._last_window - self._frames_start
+        self._frames = self._frames[:, drop:]
+        self._frames_start = self._last_window
+        drop = self._last_window * genre_ai.HOP_LENGTH - self._audio_start
+        self._audio = self._audio[drop:]
+        self._audio_start += drop
+        return render_melspec_pixels(genre_ai.normalize_windows_db(windows), genre_ai.TARGET_SHAPE)
+
+    def _ready_windows(self):
+        starts = []
+        while (self._next_window + self.window_frames <= self._next_frame
+               and self._next_window * genre_ai.HOP_LENGTH + self.chunk_len <= self.n_samples):
+            starts.append(self._next_window)
+            self._next_window += self.step_frames
+        return starts
+
+    def feed(self, y):
+        """Yields uint8 images of the windows completed by this block."""
+        self.n_samples += len(y)
+        self._samples = np.concatenate([self._samples, y])
+        self._audio = np.concatenate([self._audio, y])
+        self._compute_frames()
+        starts = self._ready_windows()
+        if starts:
+            yield self._render(starts)
+
+    def finish(self):
+        """Yields the images of the last regular windows and of the tail window."""
+        self._samples = np.concatenate([self._samples, np.zeros(genre_ai.N_FFT // 2, dtype=np.float32)])
+        self._compute_frames(limit=1 + self.n_samples // genre_ai.HOP_LENGTH)
+        starts = self._ready_windows()
+        if self.n_samples > self.chunk_len:
+            tail = (self.n_samples - self.chunk_len) // genre_ai.HOP_LENGTH
+            last = starts[-1] if starts else self._last_window
+            if tail != last:
+                starts.append(tail)
+        if starts:
+            yield self._render(starts)
+
+
+class TempoWindows:
+    """Tempo curve points of the windows bpm.estimate_tempo would analyse, given the expected duration."""
+
+    def __init__(self, duration, sr=bpm_ai.TEMPO_SR):
+        self.sr = sr
+        self.length = int(min(bpm_ai.TEMPO_WINDOW_SECONDS, duration) * sr)
+        self._starts = [int(start * sr) for start in bpm_ai.tempo_window_starts(duration)]
+        self._position = 0
+        self._pieces = []
+        self.curve = []
+
+    def _complete(self):
+        start = self._starts.pop(0)
+        self.curve.append(bpm_ai.tempo_point(np.concatenate(self._pieces), start / self.sr, self.sr))
+        self._pieces = []
+
+    def feed(self, y):
+        block_start = self._position
+        self._position += len(y)
+        while self._starts:
+            start = self._starts[0]
+            end = start + self.length
+            if start < self._position:
+                self._pieces.append(y[max(start - block_start, 0):max(end - block_start, 0)])
+            if self._position < end:
+                break
+            self._complete()
+
+    def finish(self):
+        """estimate_tempo result; a window cut short by a shorter-than-announced track still counts if over 2 s."""
+        if self._starts and sum(len(piece) for piece in self._pieces) > 2 * self.sr:
+            self._complete()
+        if not self.curve:
+            return {"bpm": None, "confidence": None, "tempo_curve": None}
+        return bpm_ai.consensus_tempo(self.curve)
+
+
+def _drain(batches, predict, results, label):
+    """Score every batch an analyzer yields; False (with results discarded) if it failed."""
+    try:
+        for batch in batches:
+            results.append(predict(batch))
+        return True
+    except Exception as e:
+        print(f"Error in streaming {label} analysis:", e)
+        results.clear()
+        return False
+
+
+def analyze_streaming(audio_path, models):
+    """
+    Full analysis of one track in bounded memory, on the (genre, mood) model
+    versions pinned by the caller; same result format as
+    pipeline.run_inference. Each analyzer fails independently to "Unknown".
+    """
+    print(f"Streaming analysis of {audio_path}")
+    with sf.SoundFile(audio_path) as f:
+        expected_duration = f.frames / f.samplerate
+
+    genre_version, mood_version = models
+    predict_genre = partial(genre_ai.predict_chunk_images, version=genre_version)
+    predict_mood = partial(mood_ai.BATCHER.predict, version=mood_version)
+    genre_windows = GenreWindows() if genre_version is not None else None
+    mood_segments = MoodSegments() if mood_version is not None else None
+    tempo_windows = TempoWindows(expected_duration)
+    genre_probs, mood_predictions = [], []
+    tempo = {"bpm": None, "confidence": None, "tempo_curve": None}
+    n_samples = 0
+
+    for block in read_blocks(audio_path, (MOOD_SR, GENRE_SR)):
+        n_samples += len(block[MOOD_SR])
+        if genre_windows is not None and not _drain(
+                genre_windows.feed(block[GENRE_SR]), predict_genre, genre_probs, "genre"):
+            genre_windows = None
+        if mood_segments is not None and not _drain(
+                mood_segments.feed(block[MOOD_SR]), predict_mood, mood_predictions, "mood"):
+            mood_segments = None
+        if tempo_windows is not None:
+            try:
+                tempo_windows.feed(block[GENRE_SR])
+            except Exception as e:
+                print("Error in streaming tempo analysis:", e)
+                tempo_windows = None
+
+    if genre_windows is not None:
+        _drain(genre_windows.finish(), predict_genre, genre_probs, "genre")
+    if mood_segments is not None:
+        _drain(mood_segments.finish(), predict_mood, mood_predictions, "mood")
+    if tempo_windows is not None:
+        try:
+            tempo = tempo_windows.finish()
+        except Exception as e:
+            print("Error in streaming tempo analysis:", e)
+
+    # Every segment is scored as it arrives, so there is no adaptive sampling here
+    n_genre = sum(len(probs) for probs in genre_probs)
+    n_mood = sum(len(predictions) for predictions in mood_predictions)
+
+    genre_results = {"prediction": "Unknown", "confidence": 0}
+    if genre_probs:
+        genre_results = genre_ai.summarize_genre(np.concatenate(genre_probs))
+
+    mood_results, valence, arousal = {"prediction": "Unknown", "confidence": 0}, 0, 0
+    if mood_predictions:
+        mood_results, valence, arousal = mood_ai.summarize_mood(
+            np.concatenate(mood_predictions), os.path.basename(audio_path))
+
+    return {
+        "genre": genre_results,
+        "mood": mood_results,
+        "bpm": round(tempo["bpm"] or 0),
+        "bpm_confidence": tempo["confidence"],
+        "tempo_curve": tempo["tempo_curve"],
+        "valence": round(valence, 2),
+        "arousal": round(arousal, 2),
+        "duration": bpm_ai.format_duration(n_samples / MOOD_SR),
+        "segments": {
+            "mode": "exhaustive",
+            "genre": {"used": n_genre, "total": n_genre},
+            "mood": {"used": n_mood, "total": n_mood},
+        }
+    }
@@ -0,0 +1,70 @@
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# === Configuration ===
+ANALYSIS_WORKERS = int(os.getenv("AI_ANALYSIS_WORKERS", "2"))
+ANALYSIS_QUEUE = int(os.getenv("AI_ANALYSIS_QUEUE", "4"))
+RETRY_AFTER_SECONDS = int(os.getenv("AI_RETRY_AFTER_SECONDS", "10"))
+
+
+class PoolSaturated(Exception):
+    """Raised when every worker is busy and the waiting queue is full."""
+
+
+class AnalysisPool:
+    """
+    Bounded pool for blocking analysis work (decoding, feature extraction,
+    inference) so it never runs on the event loop. At most `max_workers` jobs
+    run at once and `max_queued` more may wait; past that, callers are turned
+    away instead of piling up.
+
+    Background jobs share the same workers through run_blocking(); they wait
+    for an idle worker instead of being turned away, so they never take the
+    queue slots of API requests.
+
+    Threads rather than processes: the resident models and inference batchers
+    live in this process, and librosa/NumPy/TensorFlow release the GIL for
+    their heavy lifting.
+    """
+
+    def __init__(self, max_workers=ANALYSIS_WORKERS, max_queued=ANALYSIS_QUEUE):
+        self.max_workers = max_workers
+        self.capacity = max_workers + max_queued
+        self.active = 0
+        self._slots = threading.Condition()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="analysis")
+
+    def reserve(self):
+        """Claim a slot; call from the event loop and pair with release()."""
+        with self._slots:
+            if self.active >= self.capacity:
+                raise PoolSaturated(f"{self.active} analyses already running or queued")
+            self.active += 1
+
+    def release(self):
+        with self._slots:
+            self.active -= 1
+            self._slots.notify_all()
+
+    async def run(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, fn, *args)
+
+    def run_blocking(self, fn, *args):
+        """Run fn in the pool from a background thread, once a worker is idle; blocks until it is done."""
+        with self._slots:
+            self._slots.wait_for(lambda: self.active < self.max_workers)
+            self.active += 1
+        try:
+            return self._executor.submit(fn, *args).result()
+        finally:
+            self.release()
+
+    def status(self):
+        return {
+            "workers": self.max_workers,
+            "capacity": self.capacity,
+            "active": self.active,
+        }
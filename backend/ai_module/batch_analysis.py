@@ -0,0 +1,288 @@
+"""
+Bulk catalogue analysis.
+
+Analyses many tracks at once (local files, directories or URLs) and writes
+one JSON line per track to the output file as soon as it is done:
+
+    python backend/ai_module/batch_analysis.py backend/file_server/public/songs --output analysis.jsonl
+
+Decoding and feature extraction run in a pool of worker processes; inference
+runs in this process on the resident models, so chunks of several tracks
+share model.predict batches. Tracks already in the output file are skipped,
+so an interrupted run resumes where it stopped. With --db, the results are
+also written to the songs table for files named after their song ID, along
+with their song_features vector; POST /recommendations/reload then makes a
+running API's song index pick up the new vectors.
+
+The API's job queue runs batches of queued jobs (e.g. from /batch-jobs)
+through the same pipeline, analyse_sources.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+import numpy as np
+
+# === Configuration ===
+AUDIO_EXTENSIONS = (".mp3", ".wav", ".flac", ".ogg", ".m4a")
+DEFAULT_WORKERS = max(1, (os.cpu_count() or 2) - 1)
+INFERENCE_THREADS = 4
+
+
+def list_audio_files(directory):
+    """Audio files directly inside directory, sorted, as absolute paths."""
+    return sorted(
+        os.path.abspath(os.path.join(directory, name))
+        for name in os.listdir(directory)
+        if name.lower().endswith(AUDIO_EXTENSIONS)
+    )
+
+
+def expand_sources(inputs):
+    """Directories become their audio files; '@list.txt' reads one source per line; anything else is kept."""
+    sources = []
+    for item in inputs:
+        if item.startswith("@"):
+            with open(item[1:]) as f:
+                sources.extend(expand_sources([line.strip() for line in f if line.strip()]))
+        elif os.path.isdir(item):
+            sources.extend(list_audio_files(item))
+        elif os.path.isfile(item):
+            sources.append(os.path.abspath(item))
+        else:
+            sources.append(item)
+    return list(dict.fromkeys(sources))
+
+
+def load_finished(output_path):
+    """Sources that already have a result in the output file."""
+    finished = set()
+    if not os.path.exists(output_path):
+        return finished
+    with open(output_path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # partial line from a crash
+            if record.get("result") is not None:
+                finished.add(record["source"])
+    return finished
+
+
+# === Stage 1 + 2: decode and features (worker processes) ===
+def feature_stage(source, model_version):
+    from analysis import pipeline
+
+    path, audio_hash, is_temp = pipeline.fetch_source(source)
+    try:
+        if model_version:
+            cached = pipeline.FEATURE_CACHE.get_json(audio_hash, "prediction", model_version)
+            if cached is not None:
+                return {"source": source, "audio_hash": audio_hash, "result": cached}
+
+        if pipeline.should_stream(path):
+            # Too long to hold its features; analysed with inference in the parent, in bounded memory
+            return {"source": source, "audio_hash": audio_hash, "streaming": True}
+
+        features = pipeline.extract_features(path, audio_hash)
+        return {
+            "source": source,
+            "audio_hash": audio_hash,
+            # Plain arrays, not memory maps of cache files, to send back to the parent
+            "features": {key: np.array(value) if isinstance(value, np.ndarray) else value
+                         for key, value in features.items()},
+        }
+    finally:
+        if is_temp:
+            pipeline.remove_temp(path)
+
+
+# === Stage 3: inference (this process) ===
+def inference_stage(item, exhaustive=False):
+    from analysis import pipeline
+
+    if "result" in item:
+        return item["result"]
+    if item.get("streaming"):
+        return pipeline.analyze_source(item["source"], exhaustive)
+
+    with pipeline.pinned_models() as models:
+        model_version = pipeline.prediction_version(exhaustive, models)
+        result = pipeline.run_inference(item["features"], item["source"], exhaustive, models)
+    complete = result["genre"]["prediction"] != "Unknown" and result["mood"]["prediction"] != "Unknown"
+    if model_version and complete:
+        pipeline.FEATURE_CACHE.put_json(item["audio_hash"], "prediction", model_version, result)
+    return result
+
+
+# === Output ===
+class ResultWriter:
+    """Appends JSON lines (flushed per track) and optionally updates the songs table."""
+
+    def __init__(self, output_path, write_db=False):
+        self._file = open(output_path, "a")
+        self._lock = threading.Lock()
+        self._db = write_db
+
+    def write(self, source, audio_hash, result=None, error=None):
+        record = {"source": source, "audio_hash": audio_hash, "result": result, "error": error}
+        with self._lock:
+            self._file.write(json.dumps(record) + "\n")
+            self._file.flush()
+            if self._db and result is not None:
+                update_song(source, result)
+
+    def close(self):
+        self._file.close()
+
+
+def update_song(source, result):
+    """
+    Store the analysis on the song whose ID is the file name, as the upload
+    flow names files, and its recommendation vector in song_features.
+    """
+    from db.pool import DB_POOL
+    from playlist_generation import encode_song_vector
+
+    song_id = os.path.splitext(os.path.basename(source))[0]
+    vector = None
+    # As index_song in main.py: an unknown genre or mood would give a meaningless vector
+    if result["genre"]["prediction"] != "Unknown" and result["mood"]["prediction"] != "Unknown":
+        vector = encode_song_vector(result["bpm"], result["valence"], result["arousal"],
+                                    result["genre"]["prediction"], result["mood"]["prediction"])
+    try:
+        DB_POOL.run(_update_song_row, song_id, result, vector)
+    except Exception as e:
+        print(f"Error updating song {song_id}: {e}")
+
+
+def _update_song_row(conn, song_id, result, vector=None):
+    """Update the songs row, and its song_features vector in place (inserting it if missing)."""
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            UPDATE songs
+            SET bpm = %s, valence = %s, arousal = %s, genre = %s, mood = %s, duration = %s::interval
+            WHERE id::text = %s
+            """,
+            (result["bpm"], result["valence"], result["arousal"], result["genre"]["prediction"],
+             result["mood"]["prediction"], result["duration"], song_id),
+        )
+        if cur.rowcount == 0:
+            print(f"No song with ID {song_id}, database not updated.")
+            return
+        if vector is None:
+            return
+
+        # Readers expect one row per song, so existing rows are updated rather than appended to
+        vector = [float(x) for x in vector]
+        cur.execute(
+            "UPDATE song_features SET vector = %s::real[], created_at = now() WHERE song_id::text = %s",
+            (vector, song_id),
+        )
+        if cur.rowcount == 0:
+            cur.execute("INSERT INTO song_features (song_id, vector) VALUES (%s::uuid, %s::real[])", (song_id, vector))
+
+
+# === Driver ===
+def analyse_sources(sources, on_result, workers=DEFAULT_WORKERS, exhaustive=False):
+    """
+    The batch pipeline: decoding and feature extraction in `workers` processes
+    feeding inference in this process, on models that are already loaded.
+    Calls on_result(source, audio_hash, result=..., error=...) as each track
+    finishes. Returns the number of tracks analysed and failed.
+    """
+    from analysis import pipeline
+
+    model_version = pipeline.prediction_version(exhaustive)
+    analysed = failed = 0
+    started = time.time()
+
+    # Spawned workers so none inherits this process' models or open SQLite handles
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(workers, mp_context=context) as features_pool, \
+            ThreadPoolExecutor(INFERENCE_THREADS) as inference_pool:
+        queue = iter(sources)
+        extracting, inferring = {}, {}
+
+        def refill():
+            # Bounded in flight, so features of the whole catalogue never pile up in memory
+            for source in queue:
+                extracting[features_pool.submit(feature_stage, source, model_version)] = source
+                if len(extracting) >= 2 * workers:
+                    break
+
+        refill()
+        while extracting or inferring:
+            done, _ = wait(list(extracting) + list(inferring), return_when=FIRST_COMPLETED)
+            for future in done:
+                if future in extracting:
+                    source = extracting.pop(future)
+                    try:
+                        item = future.result()
+                        inferring[inference_pool.submit(inference_stage, item, exhaustive)] = item
+                    except Exception as e:
+                        print(f"Failed to extract features for {source}: {e}")
+                        on_result(source, None, error=str(e))
+                        failed += 1
+                    refill()
+                else:
+                    item = inferring.pop(future)
+                    try:
+                        on_result(item["source"], item["audio_hash"], result=future.result())
+                        analysed += 1
+                    except Exception as e:
+                        print(f"Failed to analyse {item['source']}: {e}")
+                        on_result(item["source"], item["audio_hash"], error=str(e))
+                        failed += 1
+                    item.pop("features", None)
+
+                    elapsed = time.time() - started
+                    print(f"[{analysed + failed}/{len(sources)}] {analysed / elapsed:.2f} tracks/s")
+
+    print(f"Analysed {analysed} tracks, {failed} failed, in {time.time() - started:.1f}s.")
+    return analysed, failed
+
+
+def run_batch(sources, output_path, workers=DEFAULT_WORKERS, write_db=False, exhaustive=False):
+    from genre import genre_ai
+    from mood import mood_ai
+
+    finished = load_finished(output_path)
+    pending = [source for source in sources if source not in finished]
+    print(f"{len(sources)} tracks, {len(sources) - len(pending)} already done, {len(pending)} to analyse.")
+    if not pending:
+        return {"analysed": 0, "failed": 0}
+
+    genre_ai.MODEL_REGISTRY.load()
+    mood_ai.MODEL_REGISTRY.load()
+    writer = ResultWriter(output_path, write_db)
+    try:
+        analysed, failed = analyse_sources(pending, writer.write, workers, exhaustive)
+    finally:
+        writer.close()
+    return {"analysed": analysed, "failed": failed}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Analyse many tracks for genre, mood, BPM, valence and arousal.")
+    parser.add_argument("sources", nargs="+", help="audio files, directories, URLs, or @file with one per line")
+    parser.add_argument("--output", default="analysis_results.jsonl", help="JSON lines output, also used to resume")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="decode/feature worker processes")
+    parser.add_argument("--db", action="store_true",
+                        help="also update the songs table and song_features vectors "
+                             "(then POST /recommendations/reload on a running API)")
+    parser.add_argument("--exhaustive", action="store_true",
+                        help="score every chunk and segment instead of stopping once predictions converge")
+    args = parser.parse_args()
+
+    run_batch(expand_sources(args.sources), args.output, args.workers, args.db, args.exhaustive)
+
+
+if __name__ == "__main__":
+    main()
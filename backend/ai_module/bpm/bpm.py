@@ -1,23 +1,189 @@
+import numpy as np
 import librosa
+import mutagen
+import soundfile as sf
 
-def detect_bpm(audio_file):
-    # Load the audio file
-    y, sr = librosa.load(audio_file)
-    # Run onset envelope (to capture beat strength)
-    onset_env = librosa.onset.onset_strength(y=y, sr=sr)
-    # Estimate tempo (BPM)
-    tempo = librosa.beat.tempo(onset_envelope=onset_env, sr=sr)
+# Bump when the BPM or duration computation changes, to invalidate cached values
+FEATURE_VERSION = "tempo-windows-v2"
 
-    return tempo[0]
+# === Tempo estimation ===
+# Tempo is estimated on a few windows spread over the track instead of the
+# whole signal: each window is read (or cut from the shared decode), turned
+# into an onset envelope and autocorrelated on its own, so the cost is bounded
+# by TEMPO_WINDOWS * TEMPO_WINDOW_SECONDS whatever the track length.
+TEMPO_SR = 22050
+TEMPO_HOP_LENGTH = 512
+TEMPO_WINDOW_SECONDS = 12.0
+TEMPO_WINDOWS = 4
+# Intros and outros are often beatless; windows are placed inside this margin
+TEMPO_EDGE_FRACTION = 0.05
+# Window tempos within this relative distance count as agreeing
+TEMPO_AGREEMENT = 0.04
 
 
-def get_duration(audio_file):
-    y, sr = librosa.load(audio_file)
-    duration = librosa.get_duration(y=y, sr=sr)
-    
+def tempo_window_starts(duration, window=TEMPO_WINDOW_SECONDS, count=TEMPO_WINDOWS):
+    """Start times of the analysed windows: evenly spread, non-overlapping, away from the edges."""
+    if duration <= window:
+        return [0.0]
+    first = duration * TEMPO_EDGE_FRACTION
+    last = duration * (1 - TEMPO_EDGE_FRACTION) - window
+    if last <= first:
+        return [(duration - window) / 2]
+    count = max(1, min(count, int((last - first) // window) + 1))
+    return [float(start) for start in np.linspace(first, last, count)]
+
+
+def _read_window(audio_file, start, duration):
+    """Mono signal of one window at TEMPO_SR, seeking instead of decoding the file up to it."""
+    try:
+        with sf.SoundFile(audio_file) as f:
+            f.seek(int(start * f.samplerate))
+            y = f.read(int(duration * f.samplerate), dtype='float32', always_2d=True).mean(axis=1)
+            sr = f.samplerate
+    except Exception:
+        y, sr = librosa.load(audio_file, sr=None, mono=True, offset=start, duration=duration)
+    if sr != TEMPO_SR:
+        y = librosa.resample(y, orig_sr=sr, target_sr=TEMPO_SR)
+    return y
+
+
+def _window_tempo(y, sr=TEMPO_SR, hop_length=TEMPO_HOP_LENGTH):
+    """(bpm, strength) of one window; strength is the onset autocorrelation at the beat period, 0..1."""
+    onset_env = librosa.onset.onset_strength(y=y, sr=sr, hop_length=hop_length)
+    bpm = float(librosa.feature.tempo(onset_envelope=onset_env, sr=sr, hop_length=hop_length)[0])
+
+    centered = onset_env - onset_env.mean()
+    ac = librosa.autocorrelate(centered)
+    if ac[0] <= 0 or bpm <= 0:
+        return bpm, 0.0
+    lag = int(round(60.0 * sr / (hop_length * bpm)))
+    if lag >= len(ac):
+        return bpm, 0.0
+    peak = ac[max(lag - 1, 1):lag + 2].max() / ac[0]
+    return bpm, float(np.clip(peak, 0.0, 1.0))
+
+
+def estimate_tempo(audio_file, context=None):
+    """
+    Tempo of a track from a few representative windows.
+    Args:
+        audio_file: Path of the audio, read window by window when no context is given.
+        context (AudioContext): Already decoded audio to cut the windows from.
+    Returns:
+        dict: bpm, confidence (0..1: how many windows agree, times how periodic
+        they are) and tempo_curve, the [{"time", "bpm"}] of every window, which
+        follows tempo changes.
+    """
+    if context is not None:
+        duration = context.duration
+    else:
+        duration = probe_duration(audio_file)
+
+    curve = []
+    for start in tempo_window_starts(duration):
+        length = min(TEMPO_WINDOW_SECONDS, duration - start)
+        if context is not None:
+            y = context.segment(start, length, TEMPO_SR)
+        else:
+            y = _read_window(audio_file, start, length)
+        curve.append(tempo_point(y, start))
+
+    return consensus_tempo(curve)
+
+
+def tempo_point(y, start, sr=TEMPO_SR):
+    """Tempo curve point of one window of samples at TEMPO_SR starting at `start` seconds."""
+    bpm, strength = _window_tempo(y, sr)
+    return {"time": round(start + len(y) / sr / 2, 2), "bpm": round(bpm, 2), "strength": strength}
+
+
+def consensus_tempo(curve):
+    """estimate_tempo result from the tempo curve points of the analysed windows."""
+    # The tempo most windows agree on (strongest windows break ties)
+    def agreeing(point):
+        return [other for other in curve if abs(other["bpm"] - point["bpm"]) <= TEMPO_AGREEMENT * point["bpm"]]
+
+    best = max(curve, key=lambda point: (len(agreeing(point)), sum(p["strength"] for p in agreeing(point))))
+    group = agreeing(best)
+    bpm = float(np.median([point["bpm"] for point in group]))
+    confidence = len(group) / len(curve) * float(np.mean([point["strength"] for point in group]))
+
+    return {
+        "bpm": bpm,
+        "confidence": round(confidence, 3),
+        "tempo_curve": [{"time": point["time"], "bpm": point["bpm"]} for point in curve]
+    }
+
+
+def detect_bpm(audio_file, context=None):
+    return estimate_tempo(audio_file, context)["bpm"]
+
+
+# === Duration from file headers ===
+# Header durations further apart than this are inconsistent and trigger a decode
+DURATION_TOLERANCE_SECONDS = 1.0
+
+
+def read_metadata(audio_file):
+    """
+    Duration and stream info from the container and frame headers, without decoding.
+    soundfile and mutagen are both asked; when they disagree, or mutagen
+    flags the MP3 headers as unreliable, duration_seconds is None.
+    Returns:
+        dict: duration_seconds, sample_rate, channels, bitrate, format.
+    """
+    metadata = {"duration_seconds": None, "sample_rate": None, "channels": None, "bitrate": None, "format": None}
+    durations = []
+
+    try:
+        info = sf.info(audio_file)
+        if info.samplerate and info.frames > 0:
+            durations.append(info.frames / info.samplerate)
+        metadata.update(sample_rate=info.samplerate, channels=info.channels, format=info.format)
+    except Exception as e:
+        print("soundfile could not read the headers:", e)
+
+    try:
+        audio = mutagen.File(audio_file)
+        info = audio.info if audio is not None else None
+        if info is not None:
+            if info.length and not getattr(info, "sketchy", False):
+                durations.append(float(info.length))
+            metadata["bitrate"] = getattr(info, "bitrate", None) or None
+            metadata["sample_rate"] = metadata["sample_rate"] or getattr(info, "sample_rate", None)
+            metadata["channels"] = metadata["channels"] or getattr(info, "channels", None)
+            metadata["format"] = metadata["format"] or type(audio).__name__
+    except Exception as e:
+        print("mutagen could not read the headers:", e)
+
+    if durations and max(durations) - min(durations) <= DURATION_TOLERANCE_SECONDS:
+        metadata["duration_seconds"] = min(durations)
+    return metadata
+
+
+def probe_duration(audio_file):
+    """Duration in seconds from the headers, decoding the whole file only when they are missing or inconsistent."""
+    duration = read_metadata(audio_file)["duration_seconds"]
+    if duration is None:
+        print("No reliable duration in the headers, decoding", audio_file)
+        y, sr = librosa.load(audio_file, sr=None)
+        duration = librosa.get_duration(y=y, sr=sr)
+    return duration
+
+
+def get_duration(audio_file, context=None):
+    if context is not None:
+        duration = context.duration
+    else:
+        duration = probe_duration(audio_file)
+
+    return format_duration(duration)
+
+
+def format_duration(duration):
     # Format into hh:mm:ss for PostgreSQL INTERVAL
     hours = int(duration // 3600)
     minutes = int((duration % 3600) // 60)
     seconds = int(duration % 60)
-    
-    return f"{hours:02d}:{minutes:02d}:{seconds:02d}"
\ No newline at end of file
+
+    return f"{hours:02d}:{minutes:02d}:{seconds:02d}"
@@ -0,0 +1,202 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+import numpy as np
+
+# === Configuration ===
+CACHE_DIR = "./backend/ai_module/data/feature_cache/"
+CACHE_BUDGET_BYTES = int(os.getenv("AI_FEATURE_CACHE_MB", "2048")) * 1024 * 1024
+HASH_BLOCK_SIZE = 1024 * 1024
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    audio_hash TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    version TEXT NOT NULL,
+    path TEXT,
+    payload TEXT,
+    size INTEGER NOT NULL,
+    last_access REAL NOT NULL,
+    PRIMARY KEY (audio_hash, kind, version)
+);
+CREATE INDEX IF NOT EXISTS entries_last_access ON entries (last_access);
+"""
+
+
+def hash_file(path):
+    """SHA-256 of the file contents, the key every cache entry of a track hangs off."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class FeatureCache:
+    """
+    Content-addressed cache of analysis artifacts on local disk.
+
+    Entries are keyed by (audio hash, kind, version). Arrays (mel segments,
+    chunk images) are stored as .npy files and memory-mapped on read; small
+    JSON values (predictions, BPM and duration) live in the SQLite index
+    itself. Feature entries are versioned by their extraction parameters and
+    predictions by the model versions that produced them, so a model upload
+    only invalidates inference. The least recently used entries are evicted
+    once the cache grows past its size budget.
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR, budget_bytes=CACHE_BUDGET_BYTES):
+        self.cache_dir = cache_dir
+        self.budget_bytes = budget_bytes
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _connect(self):
+        if self._conn is None:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            # Bulk analysis shares the index between processes; wait out their writes
+            self._conn = sqlite3.connect(
+                os.path.join(self.cache_dir, "index.sqlite3"), timeout=30, check_same_thread=False
+            )
+            self._conn.executescript(SCHEMA)
+        return self._conn
+
+    # --- Arrays ---
+    def get_array(self, audio_hash, kind, version):
+        with self._lock:
+            row = self._touch(audio_hash, kind, version)
+        if row is None or row[0] is None:
+            return None
+        try:
+            return np.load(row[0], mmap_mode="r")
+        except (OSError, ValueError) as e:
+            print(f"Dropping unreadable cache entry {row[0]}: {e}")
+            self.delete(audio_hash, kind, version)
+            return None
+
+    def put_array(self, audio_hash, kind, version, array):
+        directory = os.path.join(self.cache_dir, audio_hash[:2])
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{audio_hash}.{kind}.{version}.npy")
+
+        # Write then rename, so readers never map a half-written file
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.save(f, np.ascontiguousarray(array))
+        os.replace(tmp_path, path)
+
+        self._store(audio_hash, kind, version, path, None, os.path.getsize(path))
+
+    def sample_arrays(self, kind, version, limit):
+        """Up to `limit` cached arrays of one kind and version, most recently used first, without touching them."""
+        with self._lock:
+            rows = self._connect().execute(
+                "SELECT path FROM entries WHERE kind = ? AND version = ? AND path IS NOT NULL "
+                "ORDER BY last_access DESC LIMIT ?",
+                (kind, version, limit),
+            ).fetchall()
+        arrays = []
+        for (path,) in rows:
+            try:
+                arrays.append(np.load(path, mmap_mode="r"))
+            except (OSError, ValueError):
+                continue
+        return arrays
+
+    # --- JSON values ---
+    def get_json(self, audio_hash, kind, version):
+        with self._lock:
+            row = self._touch(audio_hash, kind, version)
+        if row is None or row[1] is None:
+            return None
+        return json.loads(row[1])
+
+    def put_json(self, audio_hash, kind, version, value):
+        payload = json.dumps(value)
+        self._store(audio_hash, kind, version, None, payload, len(payload))
+
+    # --- Maintenance ---
+    def delete(self, audio_hash, kind, version):
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute(
+                "SELECT path FROM entries WHERE audio_hash = ? AND kind = ? AND version = ?",
+                (audio_hash, kind, version),
+            ).fetchone()
+            with conn:
+                conn.execute(
+                    "DELETE FROM entries WHERE audio_hash = ? AND kind = ? AND version = ?",
+                    (audio_hash, kind, version),
+                )
+        if row is not None and row[0]:
+            self._remove_file(row[0])
+
+    def stats(self):
+        with self._lock:
+            conn = self._connect()
+            rows = conn.execute("SELECT kind, COUNT(*), COALESCE(SUM(size), 0) FROM entries GROUP BY kind").fetchall()
+        return {
+            "budget_bytes": self.budget_bytes,
+            "total_bytes": sum(size for _, _, size in rows),
+            "entries": {kind: {"count": count, "bytes": size} for kind, count, size in rows},
+        }
+
+    def _touch(self, audio_hash, kind, version):
+        conn = self._connect()
+        row = conn.execute(
+            "SELECT path, payload FROM entries WHERE audio_hash = ? AND kind = ? AND version = ?",
+            (audio_hash, kind, version),
+        ).fetchone()
+        if row is not None:
+            with conn:
+                conn.execute(
+                    "UPDATE entries SET last_access = ? WHERE audio_hash = ? AND kind = ? AND version = ?",
+                    (time.time(), audio_hash, kind, version),
+                )
+        return row
+
+    def _store(self, audio_hash, kind, version, path, payload, size):
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO entries (audio_hash, kind, version, path, payload, size, last_access) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (audio_hash, kind, version, path, payload, size, time.time()),
+                )
+            evicted = self._evict(conn)
+        for evicted_path in evicted:
+            self._remove_file(evicted_path)
+
+    def _evict(self, conn):
+        """Drop least recently used entries until the cache fits its budget; returns files to delete."""
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.budget_bytes:
+            return []
+
+        evicted = []
+        rows = conn.execute("SELECT audio_hash, kind, version, path, size FROM entries ORDER BY last_access").fetchall()
+        with conn:
+            for audio_hash, kind, version, path, size in rows:
+                if total <= self.budget_bytes:
+                    break
+                conn.execute(
+                    "DELETE FROM entries WHERE audio_hash = ? AND kind = ? AND version = ?",
+                    (audio_hash, kind, version),
+                )
+                total -= size
+                if path:
+                    evicted.append(path)
+        return evicted
+
+    @staticmethod
+    def _remove_file(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
@@ -0,0 +1,173 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import psycopg2
+from dotenv import load_dotenv
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE, connection as pg_connection
+from psycopg2.pool import PoolError, ThreadedConnectionPool
+
+# === Configuration ===
+DOTENV_PATH = os.path.join(os.path.dirname(__file__), '..', '..', 'src', '.env')
+POOL_MIN = int(os.getenv("AI_DB_POOL_MIN", "1"))
+POOL_MAX = int(os.getenv("AI_DB_POOL_MAX", "8"))
+CHECKOUT_TIMEOUT_SECONDS = 30
+# Connections idle longer than this are pinged before being handed out
+HEALTH_CHECK_IDLE_SECONDS = 30
+CONNECTION_ERRORS = (psycopg2.OperationalError, psycopg2.InterfaceError)
+
+
+class PooledConnection(pg_connection):
+    """psycopg2 connection that remembers its prepared statements and when it was last used."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+        self.last_used = time.monotonic()
+
+
+class PreparedStatement:
+    """
+    Server-side prepared statement, prepared once per connection on first use.
+    `sql` uses $1, $2, ... placeholders with the given parameter types.
+    """
+
+    def __init__(self, name, param_types, sql):
+        self.name = name
+        self.param_types = param_types
+        self.sql = sql
+
+    def execute(self, cur, params):
+        conn = cur.connection
+        if self.name not in conn.prepared:
+            cur.execute(f"PREPARE {self.name} ({', '.join(self.param_types)}) AS {self.sql}")
+            conn.prepared.add(self.name)
+        # Cast each argument, as EXECUTE won't coerce e.g. text[] to uuid[]
+        placeholders = ", ".join(f"%s::{param_type}" for param_type in self.param_types)
+        cur.execute(f"EXECUTE {self.name} ({placeholders})", params)
+
+
+class DatabasePool:
+    """
+    Bounded pool of autocommit connections to the app database, opened on
+    first use. Checkouts wait for a free connection instead of failing, dead
+    connections are replaced on checkout, and `run` retries a call once on a
+    fresh connection when the server went away mid-query.
+    """
+
+    def __init__(self, minconn=POOL_MIN, maxconn=POOL_MAX):
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self._pool = None
+        self._init_lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._executor = ThreadPoolExecutor(maxconn, thread_name_prefix="db")
+
+    def _get_pool(self):
+        with self._init_lock:
+            if self._pool is None:
+                print("✅ Establishing database connection pool...")
+                load_dotenv(DOTENV_PATH)
+                self._pool = ThreadedConnectionPool(
+                    self.minconn,
+                    self.maxconn,
+                    dbname=os.getenv("PGDATABASE"),
+                    user=os.getenv("PGUSER"),
+                    password=os.getenv("PGPASSWORD"),
+                    host=os.getenv("PGHOST"),
+                    port=os.getenv("PGPORT"),
+                    connection_factory=PooledConnection
+                )
+            return self._pool
+
+    @contextmanager
+    def connection(self):
+        """A healthy connection, returned to the pool (or discarded if broken) afterwards."""
+        if not self._slots.acquire(timeout=CHECKOUT_TIMEOUT_SECONDS):
+            raise PoolError(f"No database connection free after {CHECKOUT_TIMEOUT_SECONDS}s")
+
+        pool = conn = None
+        broken = False
+        try:
+            pool = self._get_pool()
+            conn = self._checkout(pool)
+            yield conn
+        except CONNECTION_ERRORS:
+            broken = True
+            raise
+        finally:
+            if conn is not None:
+                self._checkin(pool, conn, broken)
+            self._slots.release()
+
+    def _checkout(self, pool):
+        conn = pool.getconn()
+        idle = time.monotonic() - conn.last_used
+        if conn.closed or (idle > HEALTH_CHECK_IDLE_SECONDS and not self._healthy(conn)):
+            print("Replacing dead database connection")
+            pool.putconn(conn, close=True)
+            conn = pool.getconn()
+        conn.autocommit = True
+        return conn
+
+    @staticmethod
+    def _healthy(conn):
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            return True
+        except CONNECTION_ERRORS:
+            return False
+
+    @staticmethod
+    def _checkin(pool, conn, broken):
+        broken = broken or bool(conn.closed)
+        if not broken and conn.info.transaction_status != TRANSACTION_STATUS_IDLE:
+            # Left inside a transaction by an error; don't hand that to the next caller
+            try:
+                conn.rollback()
+            except CONNECTION_ERRORS:
+                broken = True
+        conn.last_used = time.monotonic()
+        pool.putconn(conn, close=broken)
+
+    def run(self, fn, *args, retries=1):
+        """fn(conn, *args) on a pooled connection, retried on a new one if the connection dies."""
+        for attempt in range(retries + 1):
+            try:
+                with self.connection() as conn:
+                    return fn(conn, *args)
+            except CONNECTION_ERRORS as e:
+                if attempt == retries:
+                    raise
+                print(f"Database connection lost ({e}), retrying")
+
+    def run_concurrently(self, calls):
+        """
+        Run several calls on separate connections at the same time.
+        Args:
+            calls (dict): key -> (fn, *args), each run as run(fn, *args).
+        Returns:
+            dict: key -> return value of fn.
+        """
+        futures = {key: self._executor.submit(self.run, *call) for key, call in calls.items()}
+        return {key: future.result() for key, future in futures.items()}
+
+    def close(self):
+        with self._init_lock:
+            if self._pool is not None:
+                self._pool.closeall()
+                self._pool = None
+
+
+def fetch_prepared(conn, statement, params):
+    """Execute a prepared statement; returns (column names, rows)."""
+    with conn.cursor() as cur:
+        statement.execute(cur, params)
+        return [column.name for column in cur.description], cur.fetchall()
+
+
+# Shared by the API and the offline jobs of this process
+DB_POOL = DatabasePool()
@@ -1,53 +1,73 @@
 import os
 import numpy as np
 import librosa
-import librosa.display
-import matplotlib.pyplot as plt
-import tensorflow as tf
-from keras.models import load_model
-from collections import Counter
-from PIL import Image
-import tempfile
 from datetime import datetime
 import re
+from registry.model_registry import ModelRegistry
+from inference.batcher import MicroBatcher
+from inference import lite
+from genre.melspec_render import render_melspec_pixels, pixels_to_model_input
 
 # === Configuration ===
 # MODEL_DIR = "./genre/models/"
 MODEL_DIR = "./backend/ai_module/genre/models/"
 #MODEL_PATH = "./backend/ai_module/genre/models/genre_classifier_model_final.keras"
 TARGET_SHAPE = (288, 288)
+# Upper bound on chunks of one track rendered and submitted at once
+MAX_BATCH_SIZE = 16
+# Shared batches across concurrent requests: flush when full or after the wait
+SHARED_BATCH_SIZE = 32
+SHARED_BATCH_WAIT_MS = 10
+# Bump when chunking, mel or rendering parameters change, to invalidate cached images
+FEATURE_VERSION = "chunk30-overlap15-mel128-288px-v4"
+N_MELS = 128
+N_FFT = 2048
+HOP_LENGTH = 512
+# Frames of the full-track spectrogram computed per STFT call, bounding the complex intermediates
+MEL_BLOCK_FRAMES = 4096
 CLASSES = ['blues', 'classical', 'country', 'disco', 'hiphop', 'jazz', 'metal', 'pop', 'reggae', 'rock']
+# A TFLite export replaces the Keras model only if it stays this close to it on the reference set
+LITE_TOLERANCE = {"max_abs_error": 0.05, "min_top1_agreement": 0.95}
 
 
 # === 1. Load Trained Model ===
+def find_latest_model_file():
+    directory = MODEL_DIR
+
+    # List all files with .keras or .h5 and the timestamp pattern
+    files = [
+        f for f in os.listdir(directory)
+        if re.match(r"genre_classifier_model_\d{8}_\d{6}\.(keras|h5)$", f)
+    ]
+
+    if not files:
+        print("No matching model files found.")
+        return None
+
+    # Extract datetime from filename
+    def get_datetime_from_filename(f):
+        match = re.search(r"_(\d{8}_\d{6})\.(keras|h5)$", f)
+        if match:
+            return datetime.strptime(match.group(1), "%Y%m%d_%H%M%S")
+        return datetime.min
+
+    # Get the latest file based on timestamp in filename
+    return max(files, key=get_datetime_from_filename)
+
+
+def load_keras_model(model_path):
+    # Imported on first use, so processes serving the TFLite export never load TensorFlow
+    from keras.models import load_model
+    return load_model(model_path)
+
+
 def load_trained_model():
     try:
-            directory = MODEL_DIR
-    
-            # List all files with .keras or .h5 and the timestamp pattern
-            files = [
-                f for f in os.listdir(directory)
-                if re.match(r"genre_classifier_model_\d{8}_\d{6}\.(keras|h5)$", f)
-            ]
-
-            latest_file = None
-
-            if files:
-                # Extract datetime from filename
-                def get_datetime_from_filename(f):
-                    match = re.search(r"_(\d{8}_\d{6})\.(keras|h5)$", f)
-                    if match:
-                        return datetime.strptime(match.group(1), "%Y%m%d_%H%M%S")
-                    return datetime.min
-
-                # Get the latest file based on timestamp in filename
-                latest_file = max(files, key=get_datetime_from_filename)
-            else:
-                print("No matching model files found.")
+            latest_file = find_latest_model_file()
 
             if (latest_file):
                 model_path = os.path.join(MODEL_DIR, latest_file)
-                model = load_model(model_path)
+                model = load_keras_model(model_path)
                 print(f"Model loaded successfully from {latest_file}")
                 return model
             else:
@@ -59,23 +79,72 @@ def load_trained_model():
         return None
 
 
+def load_model_version():
+    """Loader for MODEL_REGISTRY: the newest model file and its TFLite export if it passed, else the Keras model."""
+    latest_file = find_latest_model_file()
+    if latest_file is None:
+        return None
+
+    model_path = os.path.join(MODEL_DIR, latest_file)
+    model = lite.load_passing(model_path)
+    if model is not None:
+        print(f"Model loaded successfully from the TFLite export of {latest_file}")
+        return f"{latest_file}+lite", {"model": model}
+
+    model = load_keras_model(model_path)
+    print(f"Model loaded successfully from {latest_file}")
+    return latest_file, {"model": model}
+
+
+# Resident genre model, swapped when a new model is uploaded
+MODEL_REGISTRY = ModelRegistry("genre", load_model_version)
+
+
+def predict_images(images, version):
+    """Run one shared batch of spectrogram images through `version`, acquired by the requests in the batch."""
+    if version is None:
+        raise RuntimeError("No genre model available")
+    return version.artifacts["model"].predict(images, batch_size=len(images), verbose=0)
+
+
+# Batches chunk images from concurrent requests into shared model.predict calls
+BATCHER = MicroBatcher("genre", predict_images, SHARED_BATCH_SIZE, SHARED_BATCH_WAIT_MS)
+
+
 # === 2. Audio Preprocessing Functions ===
-def split_audio(audio_path, chunk_duration=30, overlap_duration=15, sr=22050):
+def chunk_step(sr=22050, chunk_duration=30, overlap_duration=15):
+    """Samples between chunk starts: the chunk length minus the overlap, rounded to whole hops."""
+    chunk_len = int(chunk_duration * sr)
+    return round((chunk_len - int(overlap_duration * sr)) / HOP_LENGTH) * HOP_LENGTH
+
+
+def chunk_starts(n_samples, sr=22050, chunk_duration=30, overlap_duration=15):
+    """
+    First sample of each chunk. Starts fall on whole hops, so the chunks line
+    up with the frames of the full-track spectrogram; the tail chunk covers
+    the end of the track, to within one hop.
+    """
+    chunk_len = int(chunk_duration * sr)
+    step = chunk_step(sr, chunk_duration, overlap_duration)
+
+    starts = list(range(0, n_samples - chunk_len + 1, step))
+    if n_samples > chunk_len:
+        tail = (n_samples - chunk_len) // HOP_LENGTH * HOP_LENGTH
+        if tail != starts[-1]:
+            starts.append(tail)
+    return starts
+
+
+def split_audio(audio_path, chunk_duration=30, overlap_duration=15, sr=22050, context=None):
     try:
-        y, sr = librosa.load(audio_path, sr=sr)
+        if context is not None:
+            y = context.signal(sr)
+        else:
+            y, sr = librosa.load(audio_path, sr=sr)
         print(f"Audio loaded: {len(y) / sr:.2f} seconds at {sr} Hz")
 
         chunk_len = int(chunk_duration * sr)
-        overlap = int(overlap_duration * sr)
-        step = chunk_len - overlap
-
-        chunks = [y[i:i + chunk_len] for i in range(0, len(y) - chunk_len + 1, step)]
-
-        # Optionally handle last chunk
-        if len(y) > chunk_len:
-            last_chunk = y[-chunk_len:]
-            if not np.array_equal(last_chunk, chunks[-1]):
-                chunks.append(last_chunk)
+        chunks = [y[i:i + chunk_len] for i in chunk_starts(len(y), sr, chunk_duration, overlap_duration)]
 
         print(f"Split into {len(chunks)} chunks of {chunk_duration}s each.")
         return chunks, sr
@@ -84,101 +153,186 @@ def split_audio(audio_path, chunk_duration=30, overlap_duration=15, sr=22050):
         return None, None
 
 
-def chunk_to_melspec_image(chunk, sr=22050, target_shape=(288, 288)):
+def track_melspectrogram_db(y, sr=22050):
+    """
+    Mel spectrogram in dB (n_mels, frames) of the whole signal, not yet
+    normalized. Same frames as melspectrogram(y) with its centered default
+    padding, computed MEL_BLOCK_FRAMES frames at a time.
+    """
+    padded = np.pad(y, N_FFT // 2)
+    n_frames = 1 + len(y) // HOP_LENGTH
+    mel_db = np.empty((N_MELS, n_frames), dtype=np.float32)
+    for start in range(0, n_frames, MEL_BLOCK_FRAMES):
+        stop = min(start + MEL_BLOCK_FRAMES, n_frames)
+        mel_db[:, start:stop] = mel_db_frames(padded[start * HOP_LENGTH:(stop - 1) * HOP_LENGTH + N_FFT], sr)
+    return mel_db
+
+
+def mel_db_frames(samples, sr=22050):
+    """Mel frames in dB of already padded samples: one frame per hop, each N_FFT samples long."""
+    mel = librosa.feature.melspectrogram(y=samples, sr=sr, n_mels=N_MELS, n_fft=N_FFT,
+                                         hop_length=HOP_LENGTH, center=False)
+    return 10.0 * np.log10(np.maximum(mel, 1e-10))
+
+
+def window_edge_frames(y, start, chunk_len, sr=22050):
+    """
+    Frame indices and dB frames at both ends of the window starting at sample
+    `start`, computed with the zero padding the chunk would get on its own.
+    In the full-track spectrogram these frames see the neighbouring samples
+    instead; the raster never samples them, but they can hold the window peak.
+    """
+    window_frames = 1 + chunk_len // HOP_LENGTH
+    head = -(-(N_FFT // 2) // HOP_LENGTH)
+    tail_first = max(head, (chunk_len - N_FFT // 2) // HOP_LENGTH + 1)
+    chunk = y[start:start + chunk_len]
+
+    head_samples = np.pad(chunk[:(head - 1) * HOP_LENGTH + N_FFT // 2], (N_FFT // 2, 0))
+    tail_samples = chunk[tail_first * HOP_LENGTH - N_FFT // 2:]
+    tail_samples = np.pad(tail_samples, (0, (window_frames - 1 - tail_first) * HOP_LENGTH + N_FFT - len(tail_samples)))
+
+    indices = np.r_[0:head, tail_first:window_frames]
+    frames = np.concatenate([mel_db_frames(head_samples, sr), mel_db_frames(tail_samples, sr)], axis=1)
+    return indices, frames
+
+
+def normalize_windows_db(mel_db):
+    """dB relative to each window's own peak, floored at -80 dB, as power_to_db(ref=np.max, top_db=80) per chunk."""
+    return np.maximum(mel_db - mel_db.max(axis=(1, 2), keepdims=True), -80.0)
+
+
+def chunks_to_melspec_pixels(chunks, sr=22050, target_shape=TARGET_SHAPE):
+    """Render equal-length chunks as a batch of uint8 model images, fully in memory."""
     try:
-        mel = librosa.feature.melspectrogram(y=chunk, sr=sr, n_mels=128, n_fft=2048, hop_length=512)
-        mel_db = librosa.power_to_db(mel, ref=np.max)
+        mel = librosa.feature.melspectrogram(y=np.stack(chunks), sr=sr, n_mels=N_MELS, n_fft=N_FFT, hop_length=HOP_LENGTH)
+        mel_db = 10.0 * np.log10(np.maximum(mel, 1e-10))
+        return render_melspec_pixels(normalize_windows_db(mel_db), target_shape)
 
-        # Plot and save spectrogram
-        plt.figure(figsize=(3, 3))
-        librosa.display.specshow(mel_db, sr=sr, x_axis=None, y_axis=None, cmap='inferno')
-        plt.axis('off')
+    except Exception as e:
+        print(f"Error generating spectrogram images: {e}")
+        return None
 
-        with tempfile.NamedTemporaryFile(suffix=".png", delete=False) as tmp:
-            tmp_path = tmp.name
-            plt.savefig(tmp_path, bbox_inches='tight', pad_inches=0, dpi=100)
-        plt.close()
 
-        # Open, load, and close the image
-        with Image.open(tmp_path) as img:
-            img_resized = img.resize(target_shape, Image.Resampling.LANCZOS)
-            img_array = np.array(img_resized)
+def chunks_to_melspec_images(chunks, sr=22050, target_shape=TARGET_SHAPE):
+    pixels = chunks_to_melspec_pixels(chunks, sr, target_shape)
+    return None if pixels is None else pixels_to_model_input(pixels)
 
-        os.remove(tmp_path)  # Only remove after it's fully closed
 
-        # Convert grayscale or RGBA to RGB
-        if img_array.ndim == 2:
-            img_array = np.stack([img_array] * 3, axis=-1)
-        elif img_array.shape[-1] == 4:
-            img_array = img_array[:, :, :3]
+def chunk_to_melspec_image(chunk, sr=22050, target_shape=TARGET_SHAPE):
+    images = chunks_to_melspec_images([chunk], sr, target_shape)
+    return None if images is None else images[0]
 
-        return img_array / 255.0
 
+def extract_chunk_images(audio_path, chunk_duration=30, overlap_duration=15, context=None, max_batch_size=MAX_BATCH_SIZE, sr=22050):
+    """
+    Feature stage of the genre pipeline: uint8 images (n_chunks, 288, 288, 3)
+    for every chunk of the track. The mel spectrogram is computed once over
+    the whole signal and the overlapping chunks are taken as strided views of
+    its frames, so no sample is transformed twice. Chunks are rendered
+    max_batch_size at a time so the float intermediates stay bounded on long
+    tracks. None on failure.
+    """
+    try:
+        if context is not None:
+            y = context.signal(sr)
+        else:
+            y, sr = librosa.load(audio_path, sr=sr)
+        print(f"Audio loaded: {len(y) / sr:.2f} seconds at {sr} Hz")
+
+        starts = [start // HOP_LENGTH for start in chunk_starts(len(y), sr, chunk_duration, overlap_duration)]
+        chunk_len = int(chunk_duration * sr)
+        window_frames = 1 + chunk_len // HOP_LENGTH
+        if not starts:
+            print(f"Track shorter than one {chunk_duration}s chunk.")
+            return None
+        mel_db = track_melspectrogram_db(y, sr)
     except Exception as e:
-        print(f"Error generating spectrogram image: {e}")
+        print(f"Error processing audio file: {e}")
         return None
+    print(f"Split into {len(starts)} chunks of {chunk_duration}s each.")
+
+    # (n_mels, start frame, window frame) view over the spectrogram, without copying
+    windows = np.lib.stride_tricks.sliding_window_view(mel_db, window_frames, axis=1)
+
+    images = []
+    for start in range(0, len(starts), max_batch_size):
+        batch_starts = starts[start:start + max_batch_size]
+        try:
+            batch = windows[:, batch_starts].transpose(1, 0, 2)
+            for i, frame in enumerate(batch_starts):
+                edge, edge_frames = window_edge_frames(y, frame * HOP_LENGTH, chunk_len, sr)
+                batch[i][:, edge] = edge_frames
+            images.append(render_melspec_pixels(normalize_windows_db(batch), TARGET_SHAPE))
+        except Exception as e:
+            print(f"Chunks {start+1}-{start+len(batch_starts)}: Failed ({e})")
+
+    if not images:
+        return None
+    return np.concatenate(images, axis=0)
 
 
-# === 3. Prediction Function for Each Chunk ===
-def predict_genre_chunk(model, chunk, sr, classes):
-    image = chunk_to_melspec_image(chunk, sr)
-    if image is None:
-        return None, None, None
-
-    image = np.expand_dims(image, axis=0)
-    pred = model.predict(image, verbose=0)[0]
-    class_idx = np.argmax(pred)
-    return classes[class_idx], pred[class_idx], pred
+# === 3. Batched Prediction for All Chunks ===
+def predict_chunk_images(images, version, max_batch_size=MAX_BATCH_SIZE):
+    """
+    Score uint8 chunk images on `version`, a ModelVersion acquired from
+    MODEL_REGISTRY for the whole request, submitting up to max_batch_size at
+    a time. The images go through the shared BATCHER, so they may be scored
+    together with chunks of other concurrent requests on the same version.
+    Returns an (n_chunks, n_classes) probability array.
+    """
+    all_probs = [
+        BATCHER.predict(pixels_to_model_input(images[start:start + max_batch_size]), version)
+        for start in range(0, len(images), max_batch_size)
+    ]
+    return np.concatenate(all_probs, axis=0)
 
 
 # === 4. Main Genre Prediction Function ===
-def predict_genre(audio_path, chunk_duration=30, overlap_duration=15):
+def predict_genre(audio_path, chunk_duration=30, overlap_duration=15, context=None, max_batch_size=MAX_BATCH_SIZE):
     print("=" * 60)
     print("MUSIC GENRE PREDICTION")
     print("=" * 60)
 
-    if not os.path.exists(audio_path):
+    if context is None and not os.path.exists(audio_path):
         print(f"Audio file '{audio_path}' not found.")
         return None
 
-    model = load_trained_model()
-    if model is None:
-        return None
-
-    chunks, sr = split_audio(audio_path, chunk_duration, overlap_duration)
-    if chunks is None:
+    if not MODEL_REGISTRY.available():
         return None
 
-    predictions = []
-    confidences = []
-    all_probs = []
+    images = extract_chunk_images(audio_path, chunk_duration, overlap_duration, context, max_batch_size)
+    return predict_genre_from_images(images, max_batch_size)
 
-    print("\nAnalyzing Chunks:")
-    for i, chunk in enumerate(chunks):
-        genre, confidence, prob = predict_genre_chunk(model, chunk, sr, CLASSES)
-        if genre:
-            predictions.append(genre)
-            confidences.append(confidence)
-            all_probs.append(prob)
-            print(f"Chunk {i+1:2d}: {genre:>10} ({confidence:.3f})")
-        else:
-            print(f"Chunk {i+1:2d}: Failed")
 
-    if not predictions:
+def predict_genre_from_images(images, max_batch_size=MAX_BATCH_SIZE):
+    """Inference stage of the genre pipeline: score chunk images and vote on the track's genre."""
+    if images is None or not len(images):
         print("No valid predictions.")
         return None
 
+    with MODEL_REGISTRY.acquire() as version:
+        if version is None:
+            return None
+        return summarize_genre(predict_chunk_images(images, version, max_batch_size))
+
+
+def summarize_genre(all_probs):
+    """Vote on the track's genre from the (n_chunks, n_classes) probabilities of its chunks."""
+    chunk_idx = np.argmax(all_probs, axis=1)
+    confidences = all_probs[np.arange(len(all_probs)), chunk_idx]
+
+    print("\nAnalyzing Chunks:")
+    for i, (idx, confidence) in enumerate(zip(chunk_idx, confidences)):
+        print(f"Chunk {i+1:2d}: {CLASSES[idx]:>10} ({confidence:.3f})")
+
     print("-" * 60)
 
     # === Voting: Majority ===
-    vote_counts = Counter(predictions)
-    majority_genre, majority_count = vote_counts.most_common(1)[0]
+    vote_counts = np.bincount(chunk_idx, minlength=len(CLASSES))
+    majority_genre, majority_count = CLASSES[np.argmax(vote_counts)], vote_counts.max()
 
     # === Voting: Confidence Weighted ===
-    weighted_scores = np.zeros(len(CLASSES))
-    for genre, conf in zip(predictions, confidences):
-        idx = CLASSES.index(genre)
-        weighted_scores[idx] += conf
+    weighted_scores = np.bincount(chunk_idx, weights=confidences, minlength=len(CLASSES))
     weighted_genre = CLASSES[np.argmax(weighted_scores)]
 
     # === Voting: Average Probabilities ===
@@ -188,7 +342,7 @@ def predict_genre(audio_path, chunk_duration=30, overlap_duration=15):
 
     # === Final Result ===
     print("FINAL PREDICTION")
-    print(f"Majority Vote:     {majority_genre} ({majority_count}/{len(predictions)} chunks)")
+    print(f"Majority Vote:     {majority_genre} ({majority_count}/{len(all_probs)} chunks)")
     print(f"Confidence Weight: {weighted_genre}")
     print(f"Average Ensemble:  {ensemble_genre} (confidence: {ensemble_conf:.3f})")
 
@@ -0,0 +1,110 @@
+from functools import lru_cache
+
+import matplotlib
+import numpy as np
+
+# === Configuration ===
+# The genre model was trained on PNGs saved by librosa.display.specshow on a
+# 3x3 in, 100 dpi figure with the default subplot margins and the axis cropped
+# with bbox_inches='tight'. That leaves a 232.5 x 231 px axes area, saved as a
+# 232 x 231 px image, which PIL then resized to the model input with LANCZOS.
+# The functions below reproduce that pipeline directly on NumPy arrays,
+# including PIL's fixed-point resampling weights; the output matches the
+# matplotlib/PIL images to within 1/255 per channel (melspec_render_check.py).
+AXES_WIDTH_PX = 232.5
+RASTER_SHAPE = (231, 232)  # (height, width) of the saved PNG
+LANCZOS_SUPPORT = 3
+# PIL resamples 8-bit images with fixed-point weights of this many fractional bits
+PRECISION_BITS = 22
+COLORMAP = "inferno"
+
+
+@lru_cache(maxsize=None)
+def colormap_lut(name=COLORMAP):
+    """256-entry uint8 RGB lookup table, as used by matplotlib when saving the PNG."""
+    rgba = matplotlib.colormaps[name](np.arange(256))
+    return np.round(rgba[:, :3] * 255).astype(np.uint8)
+
+
+@lru_cache(maxsize=None)
+def _raster_indices(n_mels, n_frames):
+    """Mel row and frame index sampled by each pixel of the rasterized spectrogram."""
+    height, width = RASTER_SHAPE
+    rows = ((np.arange(height) + 0.5) * n_mels / height).astype(np.intp)[::-1]  # low bands at the bottom
+    cols = ((np.arange(width) + 0.5) * n_frames / AXES_WIDTH_PX).astype(np.intp)
+    return rows, np.minimum(cols, n_frames - 1)
+
+
+@lru_cache(maxsize=None)
+def _lanczos_weights(n_in, n_out):
+    """Resampling matrix (n_out, n_in) with the same kernel and support as PIL's LANCZOS."""
+    scale = n_in / n_out
+    filter_scale = max(scale, 1.0)
+    support = LANCZOS_SUPPORT * filter_scale
+
+    centers = (np.arange(n_out) + 0.5) * scale
+    x_min = np.maximum((centers - support + 0.5).astype(np.intp), 0)
+    x_max = np.minimum((centers + support + 0.5).astype(np.intp), n_in)
+
+    x = np.arange(n_in)
+    t = (x[None, :] - centers[:, None] + 0.5) / filter_scale
+    weights = np.sinc(t) * np.sinc(t / LANCZOS_SUPPORT)
+    weights[(x[None, :] < x_min[:, None]) | (x[None, :] >= x_max[:, None])] = 0.0
+    weights /= weights.sum(axis=1, keepdims=True)
+
+    # Rounded to fixed point as PIL does for 8-bit images; kept as float64, which holds the integer sums exactly
+    scaled = weights * (1 << PRECISION_BITS)
+    return np.where(scaled < 0, np.trunc(scaled - 0.5), np.trunc(scaled + 0.5))
+
+
+def _resample_pass(images, weights):
+    """One fixed-point resampling pass along the last axis, rounding and clipping to 8 bits like PIL."""
+    acc = images @ weights.T + (1 << (PRECISION_BITS - 1))
+    return np.clip(np.floor(acc / (1 << PRECISION_BITS)), 0, 255)
+
+
+def _resample(images, target_shape):
+    """Separable LANCZOS resize of (n, 3, h, w) uint8 images, horizontal pass first like PIL."""
+    height, width = images.shape[2:]
+    target_w, target_h = target_shape
+    wx = _lanczos_weights(width, target_w)
+    wy = _lanczos_weights(height, target_h)
+
+    horizontal = _resample_pass(images, wx)
+    return _resample_pass(horizontal.swapaxes(2, 3), wy).swapaxes(2, 3)
+
+
+def render_melspec_pixels(mel_db, target_shape=(288, 288)):
+    """
+    Render dB mel spectrograms as the RGB images the genre model expects.
+    Args:
+        mel_db (np.array): One spectrogram (n_mels, frames) or a batch (n, n_mels, frames).
+        target_shape (tuple): Output (width, height), as passed to PIL's resize.
+    Returns:
+        np.array: uint8 images of shape (n, height, width, 3), as the saved PNGs held them.
+    """
+    mel_db = np.asarray(mel_db)
+    if mel_db.ndim == 2:
+        mel_db = mel_db[np.newaxis]
+
+    # Per-image autoscaling to the colormap range, as specshow does
+    lo = mel_db.min(axis=(1, 2), keepdims=True)
+    hi = mel_db.max(axis=(1, 2), keepdims=True)
+    span = np.where(hi > lo, hi - lo, 1.0)
+    levels = np.clip(((mel_db - lo) / span * 256).astype(np.intp), 0, 255)
+
+    rows, cols = _raster_indices(*mel_db.shape[1:])
+    raster = colormap_lut()[levels[:, rows][:, :, cols]]  # (n, h, w, 3)
+
+    images = _resample(raster.transpose(0, 3, 1, 2).astype(np.float64), target_shape)
+    return images.transpose(0, 2, 3, 1).astype(np.uint8)
+
+
+def pixels_to_model_input(pixels):
+    """uint8 images to the float32 [0, 1] input of the genre model."""
+    return pixels.astype(np.float32) / 255.0
+
+
+def render_melspec_images(mel_db, target_shape=(288, 288)):
+    """Same as render_melspec_pixels, as float32 images scaled to [0, 1]."""
+    return pixels_to_model_input(render_melspec_pixels(mel_db, target_shape))
@@ -0,0 +1,91 @@
+"""
+Checks that the genre images cut from the full-track mel spectrogram match
+the images of each chunk transformed on its own.
+
+    python backend/ai_module/genre_window_check.py [audio files ...]
+
+Without arguments, synthetic tracks of several lengths are checked, plus one
+with a loud burst just before a chunk start, where the window edge frames
+hold the peak. Edge frames are recomputed with the chunk's own zero padding,
+so images must be identical. Exits non-zero when a track differs.
+"""
+import argparse
+import sys
+import time
+
+import numpy as np
+import librosa
+
+from genre import genre_ai
+from analysis.audio_context import AudioContext
+
+SR = 22050
+SYNTHETIC_SECONDS = [30, 45, 61.3, 200, 241.7]
+# Largest allowed difference of any pixel channel, out of 255
+MAX_PIXEL_DIFFERENCE = 0
+
+
+def synthetic_track(seconds, sr=SR):
+    """A gliding tone, clicks on every half second and noise."""
+    rng = np.random.default_rng(0)
+    n = int(seconds * sr)
+    t = np.arange(n) / sr
+    y = 0.3 * np.sin(2 * np.pi * (200 + 150 * np.sin(t / 3)) * t) + 0.05 * rng.standard_normal(n)
+    y += librosa.clicks(times=np.arange(0, seconds, 0.5), sr=sr, length=n)
+    return y.astype(np.float32)
+
+
+def edge_burst_track(seconds, sr=SR):
+    """A synthetic track with a burst right before the second chunk, inside the padding of its first frames."""
+    y = synthetic_track(seconds, sr)
+    start = genre_ai.chunk_step(sr)
+    y[start - genre_ai.N_FFT // 4:start - genre_ai.N_FFT // 8] = 50.0
+    return y
+
+
+def per_chunk_images(context):
+    """The reference: split_audio, then every chunk transformed separately."""
+    chunks, sr = genre_ai.split_audio(None, context=context)
+    return np.concatenate([
+        genre_ai.chunks_to_melspec_pixels(chunks[start:start + genre_ai.MAX_BATCH_SIZE], sr)
+        for start in range(0, len(chunks), genre_ai.MAX_BATCH_SIZE)
+    ])
+
+
+def check(label, context):
+    started = time.time()
+    expected = per_chunk_images(context)
+    per_chunk_time = time.time() - started
+
+    started = time.time()
+    images = genre_ai.extract_chunk_images(None, context=context)
+    windowed_time = time.time() - started
+
+    if images is None or images.shape != expected.shape:
+        print(f"FAIL {label}: shape {None if images is None else images.shape}, expected {expected.shape}")
+        return False
+
+    difference = np.abs(images.astype(int) - expected.astype(int))
+    ok = difference.max() <= MAX_PIXEL_DIFFERENCE
+    print(f"{'ok  ' if ok else 'FAIL'} {label}: {len(images)} chunks, max difference {difference.max()}, "
+          f"mean {difference.mean():.4f} | per chunk {per_chunk_time:.2f}s, full track {windowed_time:.2f}s")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare full-track and per-chunk genre spectrogram images.")
+    parser.add_argument("files", nargs="*")
+    args = parser.parse_args()
+
+    if args.files:
+        cases = [(path, AudioContext.from_file(path, SR)) for path in args.files]
+    else:
+        cases = [(f"synthetic {seconds}s", AudioContext(synthetic_track(seconds), SR)) for seconds in SYNTHETIC_SECONDS]
+        cases.append(("edge burst 61.3s", AudioContext(edge_burst_track(61.3), SR)))
+
+    results = [check(label, context) for label, context in cases]
+    sys.exit(0 if all(results) else 1)
+
+
+if __name__ == "__main__":
+    main()
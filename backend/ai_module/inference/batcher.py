@@ -0,0 +1,149 @@
+import queue
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import Future
+
+import numpy as np
+
+# === Configuration ===
+DEFAULT_MAX_BATCH_SIZE = 32
+DEFAULT_MAX_WAIT_MS = 10
+WAIT_SAMPLES = 1000  # recent queue waits kept for percentiles
+
+
+class _Request:
+    def __init__(self, inputs, version):
+        self.inputs = inputs
+        self.version = version
+        self.future = Future()
+        self.enqueued_at = time.perf_counter()
+
+
+class MicroBatcher:
+    """
+    Dynamic batching in front of one model.
+
+    Concurrent callers submit input tensors (batch axis first) with the model
+    version they acquired; a single worker thread concatenates them into
+    shared batches and runs `predict_fn(inputs, version)` once per batch. A
+    batch only holds inputs for one version, so every input of a request is
+    scored by the version the request started with, even during a hot-swap.
+    A batch is flushed when it reaches `max_batch_size` rows, when the oldest
+    waiting request has waited `max_wait_ms`, or when the next request is for
+    another version. Each caller gets back the rows of the output that belong
+    to its inputs.
+    """
+
+    def __init__(self, name, predict_fn, max_batch_size=DEFAULT_MAX_BATCH_SIZE, max_wait_ms=DEFAULT_MAX_WAIT_MS):
+        self.name = name
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._predict_fn = predict_fn
+        self._queue = queue.Queue()
+        self._carry = None
+        self._worker = None
+        self._start_lock = threading.Lock()
+
+        self._metrics_lock = threading.Lock()
+        self._batch_sizes = Counter()
+        self._waits = deque(maxlen=WAIT_SAMPLES)
+        self._total_wait = 0.0
+        self._max_wait_seen = 0.0
+        self._requests = 0
+
+    def submit(self, inputs, version):
+        """Queue `inputs` for the next shared batch of `version` and return a Future of its outputs."""
+        self._ensure_worker()
+        request = _Request(inputs, version)
+        self._queue.put(request)
+        return request.future
+
+    def predict(self, inputs, version):
+        """Blocking predict on `version`; inputs larger than one batch are split across several."""
+        futures = [
+            self.submit(inputs[start:start + self.max_batch_size], version)
+            for start in range(0, len(inputs), self.max_batch_size)
+        ]
+        return np.concatenate([future.result() for future in futures], axis=0)
+
+    def metrics(self):
+        with self._metrics_lock:
+            waits = np.array(self._waits) * 1000.0
+            batches = sum(self._batch_sizes.values())
+            return {
+                "batches": batches,
+                "requests": self._requests,
+                "rows": sum(size * count for size, count in self._batch_sizes.items()),
+                "batch_size_distribution": {str(size): count for size, count in sorted(self._batch_sizes.items())},
+                "queue_wait_ms": {
+                    "mean": round(self._total_wait * 1000.0 / self._requests, 3) if self._requests else 0.0,
+                    "p50": round(float(np.percentile(waits, 50)), 3) if len(waits) else 0.0,
+                    "p95": round(float(np.percentile(waits, 95)), 3) if len(waits) else 0.0,
+                    "max": round(self._max_wait_seen * 1000.0, 3),
+                },
+                "queued": self._queue.qsize(),
+            }
+
+    def _ensure_worker(self):
+        if self._worker is not None:
+            return
+        with self._start_lock:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name=f"{self.name}-batcher", daemon=True)
+                self._worker.start()
+
+    def _collect(self):
+        """Block for the first request, then gather more until the batch is full or the wait expires."""
+        first = self._carry if self._carry is not None else self._queue.get()
+        self._carry = None
+        batch, rows = [first], len(first.inputs)
+        deadline = first.enqueued_at + self.max_wait
+
+        while rows < self.max_batch_size:
+            # Past the deadline, still take whatever is already queued without waiting
+            remaining = deadline - time.perf_counter()
+            try:
+                if remaining > 0:
+                    request = self._queue.get(timeout=remaining)
+                else:
+                    request = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if rows + len(request.inputs) > self.max_batch_size or request.version is not first.version:
+                self._carry = request  # starts the next batch
+                break
+            batch.append(request)
+            rows += len(request.inputs)
+        return batch, rows
+
+    def _run(self):
+        while True:
+            batch, rows = self._collect()
+            started = time.perf_counter()
+            self._record(batch, rows, started)
+
+            try:
+                outputs = self._predict_fn(np.concatenate([request.inputs for request in batch], axis=0),
+                                           batch[0].version)
+            except Exception as e:
+                print(f"[{self.name}] Batch of {rows} failed: {e}")
+                for request in batch:
+                    request.future.set_exception(e)
+                continue
+
+            offset = 0
+            for request in batch:
+                size = len(request.inputs)
+                request.future.set_result(outputs[offset:offset + size])
+                offset += size
+
+    def _record(self, batch, rows, started):
+        with self._metrics_lock:
+            self._batch_sizes[rows] += 1
+            for request in batch:
+                wait = started - request.enqueued_at
+                self._waits.append(wait)
+                self._total_wait += wait
+                self._max_wait_seen = max(self._max_wait_seen, wait)
+                self._requests += 1
@@ -0,0 +1,197 @@
+"""
+TensorFlow Lite exports of the uploaded Keras models, for CPU inference.
+
+An export is written next to the Keras file it came from, together with a
+report of its accuracy-parity check against the Keras outputs:
+
+    genre_classifier_model_<timestamp>.keras
+    genre_classifier_model_<timestamp>.tflite       only if the check passed
+    genre_classifier_model_<timestamp>.tflite.json  the report, pass or fail
+
+The model loaders use the export instead of the Keras model when its report
+passed. It runs on tflite_runtime when that is installed (optional, not in
+requirements.txt), so TensorFlow is never imported, and on tf.lite from the
+tensorflow requirement otherwise.
+"""
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+# === Configuration ===
+# Post-training quantization of new exports: "float32" (none), "float16" or "int8"; "off" disables exports
+LITE_QUANTIZATION = os.getenv("AI_LITE_QUANTIZATION", "float16")
+# Set to 0 to serve the Keras models even where a passing export exists
+USE_LITE_MODELS = os.getenv("AI_USE_LITE_MODELS", "1") == "1"
+LITE_THREADS = int(os.getenv("AI_LITE_THREADS", str(os.cpu_count() or 1)))
+QUANTIZATIONS = ("float32", "float16", "int8")
+
+
+def lite_path(model_path):
+    return os.path.splitext(model_path)[0] + ".tflite"
+
+
+def report_path(model_path):
+    return lite_path(model_path) + ".json"
+
+
+def _interpreter_class():
+    try:
+        from tflite_runtime.interpreter import Interpreter
+    except ImportError:
+        import tensorflow as tf
+        Interpreter = tf.lite.Interpreter
+    return Interpreter
+
+
+class LiteModel:
+    """A .tflite model behind the predict() signature of the Keras model it replaces."""
+
+    def __init__(self, path, num_threads=LITE_THREADS):
+        self.path = path
+        self._interpreter = _interpreter_class()(model_path=path, num_threads=num_threads)
+        self._input = self._interpreter.get_input_details()[0]
+        self._output = self._interpreter.get_output_details()[0]
+        self._batch_size = None
+        # One interpreter, one invocation at a time
+        self._lock = threading.Lock()
+
+    def predict(self, inputs, batch_size=None, verbose=0):
+        inputs = np.ascontiguousarray(inputs, dtype=self._input["dtype"])
+        with self._lock:
+            if self._batch_size != len(inputs):
+                self._interpreter.resize_tensor_input(self._input["index"], inputs.shape)
+                self._interpreter.allocate_tensors()
+                self._batch_size = len(inputs)
+            self._interpreter.set_tensor(self._input["index"], inputs)
+            self._interpreter.invoke()
+            return self._interpreter.get_tensor(self._output["index"]).copy()
+
+
+def convert(model, quantization=LITE_QUANTIZATION, calibration=None):
+    """
+    TFLite flatbuffer of a Keras model. int8 quantizes weights and activations
+    with ranges measured on `calibration` (model inputs, batch axis first);
+    inputs and outputs stay float32 either way, so callers are unchanged.
+    """
+    import tensorflow as tf
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    if quantization == "float16":
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.target_spec.supported_types = [tf.float16]
+    elif quantization == "int8":
+        if calibration is None or not len(calibration):
+            raise ValueError("int8 quantization needs calibration inputs")
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.representative_dataset = lambda: (
+            [np.asarray(sample, dtype=np.float32)[np.newaxis]] for sample in calibration
+        )
+    elif quantization != "float32":
+        raise ValueError(f"Unknown quantization {quantization!r}, expected one of {QUANTIZATIONS}")
+    return converter.convert()
+
+
+def parity_report(expected, actual, max_abs_error, min_top1_agreement=None):
+    """
+    How closely the export's outputs follow the Keras outputs on the reference set.
+    Args:
+        expected, actual (np.array): (n, outputs) Keras and export outputs.
+        max_abs_error (float): Largest allowed difference of any output.
+        min_top1_agreement (float): For classifiers, the share of inputs that must keep the same top class.
+    """
+    difference = np.abs(np.asarray(expected, dtype=np.float64) - np.asarray(actual, dtype=np.float64))
+    report = {
+        "reference_samples": len(expected),
+        "max_abs_error": float(difference.max()),
+        "mean_abs_error": float(difference.mean()),
+        "max_abs_error_allowed": max_abs_error,
+    }
+    passed = report["max_abs_error"] <= max_abs_error
+    if min_top1_agreement is not None:
+        report["top1_agreement"] = float(np.mean(np.argmax(expected, axis=1) == np.argmax(actual, axis=1)))
+        report["top1_agreement_required"] = min_top1_agreement
+        passed = passed and report["top1_agreement"] >= min_top1_agreement
+    report["passed"] = bool(passed)
+    return report
+
+
+def _write_report(model_path, report):
+    path = report_path(model_path)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(report, f, indent=1)
+    os.replace(tmp_path, path)
+
+
+def read_report(model_path):
+    try:
+        with open(report_path(model_path)) as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return None
+
+
+def export(model_path, model, calibration, reference, tolerance, quantization=LITE_QUANTIZATION):
+    """
+    Convert the Keras model loaded from model_path, check it against the Keras
+    outputs on `reference` and keep the export only if it passes. The report
+    is written either way, so a failing model is not converted again; if the
+    conversion or the check raises, the report is a failing one with the error.
+    Args:
+        tolerance (dict): parity_report thresholds (max_abs_error, min_top1_agreement).
+    Returns:
+        dict: The report.
+    """
+    started = time.time()
+    output_path = lite_path(model_path)
+    tmp_path = f"{output_path}.{os.getpid()}.tmp"
+    details = {
+        "model": os.path.basename(model_path),
+        "quantization": quantization,
+        "calibration_samples": len(calibration),
+        "keras_bytes": os.path.getsize(model_path),
+    }
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(convert(model, quantization, calibration))
+
+        expected = model.predict(reference, batch_size=len(reference), verbose=0)
+        actual = LiteModel(tmp_path).predict(reference)
+        report = parity_report(expected, actual, **tolerance)
+        report["lite_bytes"] = os.path.getsize(tmp_path)
+    except Exception as e:
+        report = {"passed": False, "error": f"{type(e).__name__}: {e}"}
+    report.update(details, seconds=round(time.time() - started, 1), created_at=time.strftime("%Y-%m-%dT%H:%M:%S"))
+
+    try:
+        if report["passed"]:
+            os.replace(tmp_path, output_path)
+        _write_report(model_path, report)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    if "error" in report:
+        print(f"Export of {report['model']} ({quantization}) FAILED, keeping the Keras model: {report['error']}")
+    else:
+        verdict = "passed" if report["passed"] else "FAILED, keeping the Keras model"
+        print(f"Exported {report['model']} ({quantization}, {report['lite_bytes'] / 1e6:.1f} MB): parity {verdict}, "
+              f"max abs error {report['max_abs_error']:.4f}")
+    return report
+
+
+def load_passing(model_path):
+    """LiteModel of the export of model_path if it exists and passed its parity check, else None."""
+    if not USE_LITE_MODELS:
+        return None
+    report = read_report(model_path)
+    if not report or not report.get("passed") or not os.path.exists(lite_path(model_path)):
+        return None
+    try:
+        return LiteModel(lite_path(model_path))
+    except Exception as e:
+        print(f"Error loading {lite_path(model_path)}, using the Keras model: {e}")
+        return None
@@ -0,0 +1,243 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime
+
+import httpx
+
+# === Configuration ===
+JOBS_DB_PATH = "./backend/ai_module/data/jobs.sqlite3"
+JOB_WORKERS = int(os.getenv("AI_JOB_WORKERS", "1"))
+# Queued jobs claimed at once and handed to the batch pipeline, when one is configured
+JOB_BATCH_SIZE = int(os.getenv("AI_JOB_BATCH_SIZE", "32"))
+POLL_INTERVAL_SECONDS = 5
+CALLBACK_ATTEMPTS = 3
+CALLBACK_TIMEOUT_SECONDS = 10
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    file_url TEXT NOT NULL,
+    callback_url TEXT,
+    status TEXT NOT NULL,
+    result TEXT,
+    error TEXT,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_file_url ON jobs (file_url);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at);
+"""
+
+
+def _now():
+    return datetime.now().isoformat(timespec="seconds")
+
+
+class JobQueue:
+    """
+    Persistent queue of analysis jobs backed by SQLite.
+
+    Jobs are stored before they are acknowledged, so they survive restarts:
+    jobs that were running when the process stopped are queued again on
+    start(). Submitting a file URL that already has a queued or running job
+    returns that job instead of analysing the file twice at once; a finished
+    job is never reused, so a file submitted again is analysed on the current
+    models (the prediction cache answers it if they have not changed). With
+    `force`, a new job is queued even while another one is pending.
+
+    `process_fn(file_url)` runs on the worker threads; main.py hands it to
+    the shared analysis pool, so jobs count against the same concurrency
+    bound as the API. When several jobs are queued (e.g. from /batch-jobs)
+    and `batch_fn(file_urls, on_result)` is given, up to `batch_size` of
+    them are claimed at once and analysed together by it; it calls
+    on_result(file_url, audio_hash, result=..., error=...) per file.
+    """
+
+    def __init__(self, process_fn, db_path=JOBS_DB_PATH, workers=JOB_WORKERS, batch_fn=None,
+                 batch_size=JOB_BATCH_SIZE):
+        self._process_fn = process_fn
+        self._batch_fn = batch_fn
+        self.batch_size = batch_size if batch_fn is not None else 1
+        self.db_path = db_path
+        self.workers = workers
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._threads = []
+        self._conn = None
+
+    # --- Lifecycle ---
+    def start(self):
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock, self._conn:
+            self._conn.executescript(SCHEMA)
+            recovered = self._conn.execute(
+                "UPDATE jobs SET status = ?, updated_at = ? WHERE status = ?", (QUEUED, _now(), RUNNING)
+            ).rowcount
+        if recovered:
+            print(f"Re-queued {recovered} interrupted analysis jobs.")
+
+        self._stopping.clear()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"job-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        self._stopping.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout=1)
+        self._threads = []
+
+    # --- Public API ---
+    def submit(self, file_url, callback_url=None, force=False):
+        """Queue an analysis of file_url, or return its pending job. Returns (job, deduplicated)."""
+        with self._lock, self._conn:
+            existing = None
+            if not force:
+                existing = self._conn.execute(
+                    "SELECT * FROM jobs WHERE file_url = ? AND status IN (?, ?) ORDER BY created_at DESC LIMIT 1",
+                    (file_url, QUEUED, RUNNING),
+                ).fetchone()
+
+            if existing is not None:
+                if callback_url and not existing["callback_url"]:
+                    self._conn.execute(
+                        "UPDATE jobs SET callback_url = ?, updated_at = ? WHERE id = ?",
+                        (callback_url, _now(), existing["id"]),
+                    )
+                job, deduplicated = self._to_dict(existing), True
+            else:
+                job_id = str(uuid.uuid4())
+                now = _now()
+                self._conn.execute(
+                    "INSERT INTO jobs (id, file_url, callback_url, status, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+                    (job_id, file_url, callback_url, QUEUED, now, now),
+                )
+                job = self._get(job_id)
+                deduplicated = False
+
+        self._wakeup.set()
+        return job, deduplicated
+
+    def get(self, job_id):
+        with self._lock:
+            return self._get(job_id)
+
+    def counts(self):
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status").fetchall()
+        return {row["status"]: row["n"] for row in rows}
+
+    # --- Workers ---
+    def _run(self):
+        while not self._stopping.is_set():
+            jobs = self._claim(self.batch_size)
+            if not jobs:
+                self._wakeup.wait(POLL_INTERVAL_SECONDS)
+                self._wakeup.clear()
+                continue
+
+            if len(jobs) > 1:
+                self._run_batch(jobs)
+                continue
+
+            job = jobs[0]
+            print(f"Running analysis job {job['id']} for {job['file_url']}")
+            try:
+                result = self._process_fn(job["file_url"])
+                self._complete(job["id"], DONE, result=result)
+            except Exception as e:
+                print(f"Analysis job {job['id']} failed: {e}")
+                self._complete(job["id"], FAILED, error=str(e))
+
+    def _run_batch(self, jobs):
+        """Analyse several claimed jobs in one batch_fn call, finishing each job as its result arrives."""
+        pending = {job["file_url"]: job["id"] for job in jobs}
+        print(f"Running {len(jobs)} analysis jobs as one batch")
+
+        def on_result(file_url, audio_hash, result=None, error=None):
+            job_id = pending.pop(file_url, None)
+            if job_id is None:
+                return
+            if error is not None:
+                print(f"Analysis job {job_id} failed: {error}")
+            # Callbacks go out on their own threads so slow webhooks never stall the batch
+            self._complete(job_id, FAILED if error is not None else DONE, result=result, error=error,
+                           deliver_async=True)
+
+        try:
+            self._batch_fn(list(pending), on_result)
+        except Exception as e:
+            print(f"Analysis batch failed: {e}")
+        for job_id in list(pending.values()):
+            self._complete(job_id, FAILED, error="Batch analysis stopped before this file was done")
+
+    def _complete(self, job_id, status, result=None, error=None, deliver_async=False):
+        """Store a job's outcome and deliver its callback, if it has one."""
+        self._finish(job_id, status, result=result, error=error)
+        job = self.get(job_id)
+        if job["callback_url"]:
+            if deliver_async:
+                threading.Thread(target=self._deliver, args=(job["callback_url"], job), daemon=True).start()
+            else:
+                self._deliver(job["callback_url"], job)
+
+    def _claim(self, limit=1):
+        """Mark up to `limit` of the oldest queued jobs as running and return them."""
+        with self._lock, self._conn:
+            rows = self._conn.execute(
+                "SELECT id, file_url FROM jobs WHERE status = ? ORDER BY created_at LIMIT ?", (QUEUED, limit)
+            ).fetchall()
+            now = _now()
+            self._conn.executemany(
+                "UPDATE jobs SET status = ?, updated_at = ? WHERE id = ?", [(RUNNING, now, row["id"]) for row in rows]
+            )
+            return [{"id": row["id"], "file_url": row["file_url"]} for row in rows]
+
+    def _finish(self, job_id, status, result=None, error=None):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, updated_at = ? WHERE id = ?",
+                (status, json.dumps(result) if result is not None else None, error, _now(), job_id),
+            )
+
+    def _deliver(self, callback_url, job):
+        """POST the finished job to its webhook, retrying with backoff; failures are only logged."""
+        payload = {key: job[key] for key in ("job_id", "status", "file_url", "result", "error")}
+        for attempt in range(1, CALLBACK_ATTEMPTS + 1):
+            try:
+                response = httpx.post(callback_url, json=payload, timeout=CALLBACK_TIMEOUT_SECONDS)
+                if response.status_code < 400:
+                    return
+                print(f"Callback for job {job['job_id']} returned {response.status_code}")
+            except Exception as e:
+                print(f"Callback for job {job['job_id']} failed: {e}")
+            time.sleep(2 ** attempt)
+
+    # --- Helpers ---
+    def _get(self, job_id):
+        row = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._to_dict(row) if row is not None else None
+
+    @staticmethod
+    def _to_dict(row):
+        return {
+            "job_id": row["id"],
+            "status": row["status"],
+            "file_url": row["file_url"],
+            "callback_url": row["callback_url"],
+            "result": json.loads(row["result"]) if row["result"] else None,
+            "error": row["error"],
+            "created_at": row["created_at"],
+            "updated_at": row["updated_at"],
+        }
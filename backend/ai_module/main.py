@@ -1,116 +1,352 @@
-import requests
-import tempfile
 import os
 import shutil
+import threading
+from functools import partial
+from typing import List, Optional
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, File, UploadFile, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import JSONResponse
+from pydantic import BaseModel
 import uvicorn
-from genre.genre_ai import predict_genre
-from mood.mood_ai import predict_mood
-from bpm.bpm import detect_bpm, get_duration
-import json
+from genre.genre_ai import MODEL_REGISTRY as GENRE_MODELS, BATCHER as GENRE_BATCHER
+from mood.mood_ai import MODEL_REGISTRY as MOOD_MODELS, BATCHER as MOOD_BATCHER
+from analysis.pipeline import analyze_file, analyze_source, unknown_result, FEATURE_CACHE
+from analysis.download import download_to_temp
+from bpm.bpm import read_metadata, probe_duration, format_duration
+from analysis.worker_pool import AnalysisPool, PoolSaturated, RETRY_AFTER_SECONDS
+from jobs.job_queue import JobQueue
+from batch_analysis import list_audio_files, analyse_sources
+from recommend.song_index import SongIndex
+from optimize_models import optimize_and_reload
+from playlist_generation import build_user_vector, encode_song_vector
+from db.pool import DB_POOL
+from recommend.recommendation_store import (
+    ensure_table, load_recommendations, save_recommendations, STORED_RECOMMENDATIONS
+)
 from datetime import datetime
 
 MAIN_DIR = "./backend/ai_module/"
-app = FastAPI()
+SONGS_DIR = "./backend/file_server/public/songs"
+# Decode/feature processes of one batch of queued jobs (see batch_analysis.analyse_sources)
+BATCH_JOB_WORKERS = int(os.getenv("AI_BATCH_JOB_WORKERS", "2"))
 
-@app.get("/predict")
-async def predict(file_url: str):
-    print("Received file_url:", file_url)
 
-    # 1. Download file to temp storage
+@asynccontextmanager
+async def lifespan(app):
+    # Load the newest models once; uploads swap them in place afterwards
+    for registry in (GENRE_MODELS, MOOD_MODELS):
+        try:
+            await run_in_threadpool(registry.load)
+        except Exception as e:
+            print(f"Error loading {registry.name} model at startup: {e}")
+
+    # Export models that have no TFLite export yet, e.g. uploaded before exports existed
+    start_export("genre", GENRE_MODELS)
+    start_export("mood", MOOD_MODELS)
+
+    # Restore the song index from its snapshot and delta log
     try:
-        print("Downloading file from URL...")
-        response = requests.get(file_url)
-        if response.status_code != 200:
-            print("Failed to download file. Status code:", response.status_code)
-            return {
-                "genre": {"prediction": "Unknown", "confidence": 0},
-                "mood": {"prediction": "Unknown", "confidence": 0},
-                "bpm": 0,
-                "valence": 0,
-                "arousal": 0
-            }
-        print("File downloaded successfully.")
+        await run_in_threadpool(SONG_INDEX.load)
     except Exception as e:
-        print("Exception while downloading file:", e)
-        return {
-            "genre": {"prediction": "Unknown", "confidence": 0},
-            "mood": {"prediction": "Unknown", "confidence": 0},
-            "bpm": 0,
-            "valence": 0,
-            "arousal": 0
-        }
+        print(f"Error loading song index at startup: {e}")
 
-    # Save to temporary file
-    tmp_path = None
     try:
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".mp3") as tmp_file:
-            tmp_file.write(response.content)
-            tmp_path = tmp_file.name
-        print("Saved file to temp path:", tmp_path)
+        await run_in_threadpool(DB_POOL.run, ensure_table)
     except Exception as e:
-        print("Exception while saving temp file:", e)
-        return {
-            "genre": {"prediction": "Unknown", "confidence": 0},
-            "mood": {"prediction": "Unknown", "confidence": 0},
-            "bpm": 0,
-            "valence": 0,
-            "arousal": 0
-        }
+        print(f"Error preparing the recommendations table: {e}")
+
+    # Keep publish/block/encryption state and deletions in the index in step with the database
+    SONG_INDEX.start_refresh()
+
+    # Resume analysis jobs persisted before the last shutdown
+    JOB_QUEUE.start()
+    yield
+    JOB_QUEUE.stop()
+    SONG_INDEX.stop_refresh()
+    DB_POOL.close()
+
+app = FastAPI(lifespan=lifespan)
+ANALYSIS_POOL = AnalysisPool()
+# Jobs run in the analysis pool too, so they count against its bound instead of competing with /predict.
+# Several queued jobs are analysed together by the batch pipeline, taking one slot of the pool
+JOB_QUEUE = JobQueue(
+    partial(ANALYSIS_POOL.run_blocking, analyze_source),
+    batch_fn=partial(ANALYSIS_POOL.run_blocking, partial(analyse_sources, workers=BATCH_JOB_WORKERS))
+)
+SONG_INDEX = SongIndex()
+
+
+def start_export(kind, registry):
+    """Export the newest model to TFLite in the background; the registry switches to it if it passes."""
+    threading.Thread(target=optimize_and_reload, args=(kind, registry), daemon=True, name=f"export-{kind}").start()
+
+
+def is_http_url(url):
+    return url.startswith(("http://", "https://"))
+
+
+class JobRequest(BaseModel):
+    file_url: str
+    callback_url: Optional[str] = None
+    force: bool = False
 
-    # 2. Run AI models safely
+
+class SongFlagsRequest(BaseModel):
+    song_id: Optional[str] = None
+    album_id: Optional[str] = None
+    published: Optional[bool] = None
+    is_blocked: Optional[bool] = None
+    playable: Optional[bool] = None
+
+
+class BatchJobRequest(BaseModel):
+    file_urls: List[str] = []
+    directory: Optional[str] = None
+    callback_url: Optional[str] = None
+    force: bool = False
+
+
+def index_song(song_id, album_id, result):
+    """Add a freshly analysed song to the recommendation index"""
+    if result["genre"]["prediction"] == "Unknown" or result["mood"]["prediction"] == "Unknown":
+        return
     try:
-        print("Predicting genre...")
-        genre_results = predict_genre(tmp_path)
-        if genre_results is None:
-            genre_results = {"prediction": "Unknown", "confidence": 0}
-        print("Genre results:", genre_results)
+        vector = encode_song_vector(
+            result["bpm"], result["valence"], result["arousal"],
+            result["genre"]["prediction"], result["mood"]["prediction"]
+        )
+        SONG_INDEX.upsert(song_id, vector, result["genre"]["prediction"], result["mood"]["prediction"], album_id)
     except Exception as e:
-        print("Error in predict_genre:", e)
-        genre_results = {"prediction": "Unknown", "confidence": 0}
+        print(f"Error indexing song {song_id}: {e}")
+
+
+@app.get("/predict")
+async def predict(file_url: str, song_id: Optional[str] = None, album_id: Optional[str] = None,
+                  exhaustive: bool = False):
+    print("Received file_url:", file_url)
 
+    # Turn the request away early if the analysis pool is saturated
     try:
-        print("Predicting mood...")
-        mood_data = predict_mood(tmp_path)
-        if mood_data is None:
-            mood_results, avg_valence_predicted, avg_arousal_predicted = {"prediction": "Unknown", "confidence": 0}, 0, 0
-        else:
-            mood_results, avg_valence_predicted, avg_arousal_predicted = mood_data
-        print("Mood results:", mood_results)
+        ANALYSIS_POOL.reserve()
+    except PoolSaturated as e:
+        print("Analysis pool saturated:", e)
+        return JSONResponse(
+            status_code=503,
+            content={"message": "AI module is busy, retry later"},
+            headers={"Retry-After": str(RETRY_AFTER_SECONDS)}
+        )
+
+    tmp_path = None
+    try:
+        # 1. Stream the file to temp storage, hashing it on the way
+        tmp_path, audio_hash = await download_to_temp(file_url)
+        if tmp_path is None:
+            return unknown_result()
+
+        # 2. Run AI models in the worker pool, off the event loop; exhaustive scores every segment
+        try:
+            result = await ANALYSIS_POOL.run(analyze_file, tmp_path, audio_hash, exhaustive)
+        except Exception as e:
+            print("Error analysing file:", e)
+            return unknown_result()
+    finally:
+        ANALYSIS_POOL.release()
+
+        # 3. Cleanup
+        try:
+            if tmp_path and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+                print("Temp file removed:", tmp_path)
+        except Exception as e:
+            print("Error deleting temp file:", e)
+
+    # 4. Keep the recommendation index fresh without a full rebuild
+    if song_id:
+        await run_in_threadpool(index_song, song_id, album_id, result)
+
+    # 5. Return structured response
+    print("Returning result:", result)
+    return result
+
+
+def audio_metadata(path):
+    """Header metadata of a file, decoding it only when the headers carry no reliable duration"""
+    metadata = read_metadata(path)
+    metadata["duration_source"] = "header"
+    if metadata["duration_seconds"] is None:
+        metadata["duration_seconds"] = probe_duration(path)
+        metadata["duration_source"] = "decode"
+    metadata["duration"] = format_duration(metadata["duration_seconds"])
+    return metadata
+
+
+@app.get("/metadata")
+async def get_metadata(file_url: str):
+    """Duration and stream info of an audio file without running the analysis"""
+    tmp_path, _ = await download_to_temp(file_url)
+    if tmp_path is None:
+        raise HTTPException(status_code=400, detail="Could not download the file")
+    try:
+        return await run_in_threadpool(audio_metadata, tmp_path)
     except Exception as e:
-        print("Error in predict_mood:", e)
-        mood_results, avg_valence_predicted, avg_arousal_predicted = {"prediction": "Unknown", "confidence": 0}, 0, 0
+        print("Error reading audio metadata:", e)
+        raise HTTPException(status_code=422, detail="Unreadable audio file")
+    finally:
+        try:
+            os.remove(tmp_path)
+        except OSError as e:
+            print("Error deleting temp file:", e)
+
+@app.post("/jobs", status_code=202)
+async def submit_job(job_request: JobRequest):
+    """
+    Queue an analysis and return its job ID immediately; poll /jobs/{job_id} or wait for the callback.
+    A pending job for the same URL is reused unless `force` is set
+    """
+    if not is_http_url(job_request.file_url):
+        raise HTTPException(status_code=400, detail="file_url must be an http(s) URL")
+    job, deduplicated = await run_in_threadpool(
+        JOB_QUEUE.submit, job_request.file_url, job_request.callback_url, job_request.force)
+    print(f"Job {job['job_id']} for {job_request.file_url} ({'existing' if deduplicated else 'new'})")
+    return {
+        "job_id": job["job_id"],
+        "status": job["status"],
+        "deduplicated": deduplicated
+    }
 
+@app.post("/batch-jobs", status_code=202)
+async def submit_batch_jobs(batch_request: BatchJobRequest):
+    """
+    Queue analyses for a list of file URLs and/or every audio file in a directory
+    under the songs folder. The job workers claim them in batches and run them
+    through the batch pipeline (parallel decode and features, shared inference)
+    """
+    if not all(is_http_url(url) for url in batch_request.file_urls):
+        raise HTTPException(status_code=400, detail="file_urls must be http(s) URLs")
+
+    sources = list(batch_request.file_urls)
+    if batch_request.directory:
+        songs_dir = os.path.realpath(SONGS_DIR)
+        directory = os.path.realpath(os.path.join(songs_dir, batch_request.directory))
+        if os.path.commonpath([songs_dir, directory]) != songs_dir or not os.path.isdir(directory):
+            raise HTTPException(status_code=400, detail="Directory must be inside the songs folder")
+        sources.extend(list_audio_files(directory))
+
+    jobs = []
+    for source in sources:
+        job, deduplicated = await run_in_threadpool(
+            JOB_QUEUE.submit, source, batch_request.callback_url, batch_request.force)
+        jobs.append({
+            "source": source,
+            "job_id": job["job_id"],
+            "status": job["status"],
+            "deduplicated": deduplicated
+        })
+    print(f"Queued batch of {len(jobs)} analysis jobs")
+    return {"total": len(jobs), "jobs": jobs}
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Status of an analysis job, with its result once done"""
+    job = await run_in_threadpool(JOB_QUEUE.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+def stored_recommendations(user_id):
+    """Precomputed recommendations still within their TTL, or None"""
     try:
-        print("Detecting BPM...")
-        bpm = detect_bpm(tmp_path) or 0
-        print("Detected BPM:", bpm)
+        songs = DB_POOL.run(load_recommendations, user_id)
     except Exception as e:
-        print("Error in detect_bpm:", e)
-        bpm = 0
+        print(f"Error reading stored recommendations for {user_id}: {e}")
+        return None
+
+    # Drop songs blocked or deleted since the list was computed
+    if songs is not None and SONG_INDEX.loaded():
+        songs = [song for song in songs if SONG_INDEX.is_available(song[0])] or None
+    return songs
 
-    duration = get_duration(tmp_path)
 
-    # 3. Cleanup
+def live_recommendations(user_id, k, genre, mood):
+    """Recommendations computed now from the song index; unfiltered ones are stored for later requests"""
+    if not SONG_INDEX.loaded():
+        SONG_INDEX.load()
+    user_vector = build_user_vector(user_id)
+    if user_vector is None:
+        return []
+
+    if genre is not None or mood is not None:
+        return SONG_INDEX.query(user_vector, k, genre, mood)
+
+    songs = SONG_INDEX.query(user_vector, max(k, STORED_RECOMMENDATIONS))
     try:
-        if tmp_path and os.path.exists(tmp_path):
-            os.remove(tmp_path)
-            print("Temp file removed:", tmp_path)
+        DB_POOL.run(save_recommendations, {user_id: songs[:STORED_RECOMMENDATIONS]})
     except Exception as e:
-        print("Error deleting temp file:", e)
-
-    # 4. Return structured response
-    result = {
-        "genre": json.loads(json.dumps(genre_results)),
-        "mood": mood_results,
-        "bpm": round(bpm),
-        "valence": round(avg_valence_predicted, 2),
-        "arousal": round(avg_arousal_predicted, 2),
-        "duration": duration
+        print(f"Error storing recommendations for {user_id}: {e}")
+    return songs[:k]
+
+
+@app.get("/recommendations")
+async def get_recommendations(user_id: str, k: int = 10, genre: Optional[str] = None, mood: Optional[str] = None):
+    """
+    Top-k available songs closest to the user's taste vector. Served from the
+    precomputed table while fresh, otherwise computed on the song index and stored
+    """
+    if not 1 <= k <= 500:
+        raise HTTPException(status_code=400, detail="k must be between 1 and 500")
+
+    songs = None
+    if genre is None and mood is None and k <= STORED_RECOMMENDATIONS:
+        songs = await run_in_threadpool(stored_recommendations, user_id)
+        if songs is not None and len(songs) < k:
+            songs = None
+    source = "precomputed" if songs is not None else "live"
+
+    if songs is None:
+        try:
+            songs = await run_in_threadpool(live_recommendations, user_id, k, genre, mood)
+        except Exception as e:
+            print(f"Error computing recommendations for {user_id}: {e}")
+            raise HTTPException(status_code=500, detail="Failed to load recommendation data")
+
+    return {
+        "user_id": user_id,
+        "source": source,
+        "songs": [{"song_id": song_id, "similarity": round(similarity, 4)} for song_id, similarity in songs[:k]]
     }
-    print("Returning result:", result)
-    return result
+
+@app.post("/recommendations/reload")
+async def reload_recommendations():
+    """Rebuild the song index from song_features"""
+    try:
+        await run_in_threadpool(SONG_INDEX.load_from_db)
+    except Exception as e:
+        print(f"Error reloading song index: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to reload song index: {str(e)}")
+    return SONG_INDEX.status()
+
+@app.post("/recommendations/flags")
+async def set_song_flags(flags: SongFlagsRequest):
+    """Update published / blocked / playable state of a song or of all songs of an album in the index"""
+    if (flags.song_id is None) == (flags.album_id is None):
+        raise HTTPException(status_code=400, detail="Give exactly one of song_id and album_id")
+    await run_in_threadpool(
+        SONG_INDEX.set_flags, flags.song_id, flags.album_id, flags.published, flags.is_blocked, flags.playable
+    )
+    return SONG_INDEX.status()
+
+@app.delete("/recommendations/songs/{song_id}")
+async def delete_indexed_song(song_id: str):
+    """Remove a deleted song from the index"""
+    await run_in_threadpool(SONG_INDEX.delete, song_id, None)
+    return SONG_INDEX.status()
+
+@app.delete("/recommendations/albums/{album_id}")
+async def delete_indexed_album(album_id: str):
+    """Remove every song of a deleted album from the index"""
+    await run_in_threadpool(SONG_INDEX.delete, None, album_id)
+    return SONG_INDEX.status()
 
 @app.post("/upload-mood-model")
 async def upload_mood_model(model_file: UploadFile = File(...)):
@@ -149,6 +385,14 @@ async def upload_mood_model(model_file: UploadFile = File(...)):
             buffer.write(content)
         
         print(f"Mood model saved to: {model_path}")
+
+        # Swap the resident model; requests already running finish on the old one
+        active_version = await run_in_threadpool(MOOD_MODELS.load)
+
+        # Then build the lightweight CPU export; it replaces the Keras model once it passes its parity check
+        lite_export = file_extension in ('.keras', '.h5')
+        if lite_export:
+            start_export("mood", MOOD_MODELS)
         
         return JSONResponse(
             status_code=200,
@@ -156,7 +400,9 @@ async def upload_mood_model(model_file: UploadFile = File(...)):
                 "message": "Mood model uploaded successfully",
                 "filename": file_name,
                 "path": model_path,
-                "size": len(content)
+                "size": len(content),
+                "active_version": active_version,
+                "lite_export": "started" if lite_export else None
             }
         )
         
@@ -201,6 +447,14 @@ async def upload_genre_model(model_file: UploadFile = File(...)):
             buffer.write(content)
         
         print(f"Genre model saved to: {model_path}")
+
+        # Swap the resident model; requests already running finish on the old one
+        active_version = await run_in_threadpool(GENRE_MODELS.load)
+
+        # Then build the lightweight CPU export; it replaces the Keras model once it passes its parity check
+        lite_export = file_extension in ('.keras', '.h5')
+        if lite_export:
+            start_export("genre", GENRE_MODELS)
         
         return JSONResponse(
             status_code=200,
@@ -208,7 +462,9 @@ async def upload_genre_model(model_file: UploadFile = File(...)):
                 "message": "Genre model uploaded successfully",
                 "filename": file_name,
                 "path": model_path,
-                "size": len(content)
+                "size": len(content),
+                "active_version": active_version,
+                "lite_export": "started" if lite_export else None
             }
         )
         
@@ -254,7 +510,9 @@ async def get_model_status():
                 "mood_models": mood_models,
                 "genre_models": genre_models,
                 "total_mood_models": len(mood_models),
-                "total_genre_models": len(genre_models)
+                "total_genre_models": len(genre_models),
+                "active_mood_model": MOOD_MODELS.status(),
+                "active_genre_model": GENRE_MODELS.status()
             },
             "message": "Model status retrieved successfully"
         }
@@ -271,5 +529,17 @@ async def get_model_status():
             "message": f"Error retrieving model status: {str(e)}"
         }
 
+@app.get("/inference-metrics")
+async def get_inference_metrics():
+    """Batcher, worker pool, job queue, feature cache and song index metrics"""
+    return {
+        "genre": GENRE_BATCHER.metrics(),
+        "mood": MOOD_BATCHER.metrics(),
+        "analysis_pool": ANALYSIS_POOL.status(),
+        "jobs": JOB_QUEUE.counts(),
+        "feature_cache": FEATURE_CACHE.stats(),
+        "song_index": SONG_INDEX.status()
+    }
+
 if __name__ == "__main__":
     uvicorn.run(app, host="localhost", port=8000)
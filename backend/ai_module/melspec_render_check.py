@@ -0,0 +1,90 @@
+"""
+Checks the in-memory genre spectrogram renderer against the matplotlib/PIL
+path the genre model was trained on: librosa.display.specshow saved to a PNG,
+then resized with LANCZOS.
+
+    python backend/ai_module/melspec_render_check.py [audio files ...]
+
+Without arguments, 30 s chunks of synthetic tracks are rendered. Exits
+non-zero when any pixel channel differs by more than the tolerance.
+"""
+import argparse
+import io
+import sys
+import time
+
+import matplotlib
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+import numpy as np
+import librosa
+import librosa.display
+from PIL import Image
+
+from genre import genre_ai
+from genre.melspec_render import render_melspec_pixels
+from analysis.audio_context import AudioContext
+from genre_window_check import synthetic_track, SR, SYNTHETIC_SECONDS
+
+# Largest allowed difference of any pixel channel, out of 255
+MAX_PIXEL_DIFFERENCE = 1
+
+
+def reference_pixels(mel_db, sr=SR, target_shape=genre_ai.TARGET_SHAPE):
+    """The previous rendering: specshow on a 3x3 in figure, saved at 100 dpi, resized with PIL."""
+    plt.figure(figsize=(3, 3))
+    librosa.display.specshow(mel_db, sr=sr, x_axis=None, y_axis=None, cmap="inferno")
+    plt.axis("off")
+    buffer = io.BytesIO()
+    plt.savefig(buffer, bbox_inches="tight", pad_inches=0, dpi=100)
+    plt.close()
+
+    buffer.seek(0)
+    with Image.open(buffer) as img:
+        return np.array(img.resize(target_shape, Image.Resampling.LANCZOS))[:, :, :3]
+
+
+def chunk_mels(y, sr=SR):
+    """Normalized dB mel spectrograms of the track's genre chunks, as extract_chunk_images renders them."""
+    chunks, sr = genre_ai.split_audio(None, context=AudioContext(y, sr))
+    mel = librosa.feature.melspectrogram(y=np.stack(chunks), sr=sr, n_mels=genre_ai.N_MELS,
+                                         n_fft=genre_ai.N_FFT, hop_length=genre_ai.HOP_LENGTH)
+    return genre_ai.normalize_windows_db(10.0 * np.log10(np.maximum(mel, 1e-10)))
+
+
+def check(label, mel_db):
+    started = time.time()
+    expected = np.stack([reference_pixels(mel) for mel in mel_db])
+    reference_time = time.time() - started
+
+    started = time.time()
+    pixels = render_melspec_pixels(mel_db)
+    render_time = time.time() - started
+
+    if pixels.shape != expected.shape:
+        print(f"FAIL {label}: shape {pixels.shape}, expected {expected.shape}")
+        return False
+
+    difference = np.abs(pixels.astype(int) - expected.astype(int))
+    ok = difference.max() <= MAX_PIXEL_DIFFERENCE
+    print(f"{'ok  ' if ok else 'FAIL'} {label}: {len(pixels)} images, max difference {difference.max()}, "
+          f"mean {difference.mean():.4f} | matplotlib/PIL {reference_time:.2f}s, NumPy {render_time:.2f}s")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the NumPy genre spectrogram renderer with matplotlib/PIL.")
+    parser.add_argument("files", nargs="*")
+    args = parser.parse_args()
+
+    if args.files:
+        cases = [(path, librosa.load(path, sr=SR)[0]) for path in args.files]
+    else:
+        cases = [(f"synthetic {seconds}s", synthetic_track(seconds)) for seconds in SYNTHETIC_SECONDS]
+
+    results = [check(label, chunk_mels(y)) for label, y in cases]
+    sys.exit(0 if all(results) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,102 +1,130 @@
-import tensorflow as tf
 import librosa
 import numpy as np
 import os
 import joblib
 from datetime import datetime
 import re
+from registry.model_registry import ModelRegistry
+from inference.batcher import MicroBatcher
+from inference import lite
 
 # MODEL_DIR = "./mood/models/"
 MODEL_DIR = "./backend/ai_module/mood/models/"
 #MODEL_PATH = "./backend/ai_module/mood/models/best_cnn_model.keras"
 #LABEL_SCALAR_PATH = "./backend/ai_module/mood/models/fitted_label_scaler.pkl"
+# Bump when segmentation or mel parameters change, to invalidate cached segments
+FEATURE_VERSION = "seg5-sr44100-mel128-v1"
+# Shared batches of 5 s segments across concurrent requests: flush when full or after the wait
+SHARED_BATCH_SIZE = 64
+SHARED_BATCH_WAIT_MS = 10
+# Segments transformed per melspectrogram call, bounding the complex STFT intermediates
+MEL_BATCH_SEGMENTS = 16
+# A TFLite export replaces the Keras model only if its normalized outputs stay this close on the reference set
+LITE_TOLERANCE = {"max_abs_error": 0.02}
 
 # --- 1. Load the Trained Model ---
+def find_latest_file(extensions):
+    directory = MODEL_DIR
+
+    # List all files with the given extensions and the timestamp pattern
+    files = [
+        f for f in os.listdir(directory)
+        if re.match(rf"mood_classifier_model_\d{{8}}_\d{{6}}\.({extensions})$", f)
+    ]
+
+    if not files:
+        print("No matching model files found.")
+        return None
+
+    # Extract datetime from filename
+    def get_datetime_from_filename(f):
+        match = re.search(rf"_(\d{{8}}_\d{{6}})\.({extensions})$", f)
+        if match:
+            return datetime.strptime(match.group(1), "%Y%m%d_%H%M%S")
+        return datetime.min
+
+    # Get the latest file based on timestamp in filename
+    return max(files, key=get_datetime_from_filename)
+
+
+def load_keras_model(model_path):
+    # Imported on first use, so processes serving the TFLite export never load TensorFlow
+    import tensorflow as tf
+    return tf.keras.models.load_model(model_path)
+
+
 def load_model():
+    model_path = None
     try:
-        directory = MODEL_DIR
-
-        # List all files with .keras or .h5 and the timestamp pattern
-        files = [
-            f for f in os.listdir(directory)
-            if re.match(r"mood_classifier_model_\d{8}_\d{6}\.(keras|h5)$", f)
-        ]
-
-        latest_file = None
-
-        if files:
-            # Extract datetime from filename
-            def get_datetime_from_filename(f):
-                match = re.search(r"_(\d{8}_\d{6})\.(keras|h5)$", f)
-                if match:
-                    return datetime.strptime(match.group(1), "%Y%m%d_%H%M%S")
-                return datetime.min
-
-            # Get the latest file based on timestamp in filename
-            latest_file = max(files, key=get_datetime_from_filename)
-        else:
-            print("No matching model files found.")
-
+        latest_file = find_latest_file("keras|h5")
+        if not latest_file:
+            return None
 
-        if (latest_file):
-            model_path = os.path.join(MODEL_DIR, latest_file)
-            model = tf.keras.models.load_model(model_path)
-            print(f"Model loaded successfully from {latest_file}")
-        else:
-            exit()
-            
-            
-        model = tf.keras.models.load_model(model_path)
+        model_path = os.path.join(MODEL_DIR, latest_file)
+        model = load_keras_model(model_path)
         print(f"Model {model_path} loaded successfully.")
         return model
     except Exception as e:
         print(f"Error loading model: {e}")
         print(f"Please ensure {model_path} is in the same directory or provide the full path.")
-        exit()
+        return None
 
 # --- 2. Load the Fitted MinMaxScaler ---
 def load_scaler():
+    pkl_path = None
     try:
-        directory = MODEL_DIR
-
-        # List all files with .keras or .h5 and the timestamp pattern
-        files = [
-            f for f in os.listdir(directory)
-            if re.match(r"mood_classifier_model_\d{8}_\d{6}\.(pkl)$", f)
-        ]
-
-        latest_file = None
-
-        if files:
-            # Extract datetime from filename
-            def get_datetime_from_filename(f):
-                match = re.search(r"_(\d{8}_\d{6})\.(pkl)$", f)
-                if match:
-                    return datetime.strptime(match.group(1), "%Y%m%d_%H%M%S")
-                return datetime.min
-
-            # Get the latest file based on timestamp in filename
-            latest_file = max(files, key=get_datetime_from_filename)
-        else:
-            print("No matching model files found.")
-
-
-        if (latest_file):
-            pkl_path = os.path.join(MODEL_DIR, latest_file)
-            scaler = joblib.load(pkl_path)
-            print(f"MinMaxScaler {pkl_path} loaded successfully.")
-            return scaler
-        else:
-            exit()
-
+        latest_file = find_latest_file("pkl")
+        if not latest_file:
+            return None
+
+        pkl_path = os.path.join(MODEL_DIR, latest_file)
+        scaler = joblib.load(pkl_path)
+        print(f"MinMaxScaler {pkl_path} loaded successfully.")
+        return scaler
     except Exception as e:
         print(f"Error loading scaler: {e}")
         print(f"Please ensure {pkl_path} is in the same directory or provide the full path.")
         print("You need to run your training notebook again to save this file if it's missing.")
-        exit()
+        return None
+
+
+def load_model_version():
+    """Loader for MODEL_REGISTRY: the newest model (its TFLite export if it passed) and scaler, swapped together as one version."""
+    model_file = find_latest_file("keras|h5")
+    scaler_file = find_latest_file("pkl")
+    if model_file is None or scaler_file is None:
+        return None
+
+    model_path = os.path.join(MODEL_DIR, model_file)
+    scaler = joblib.load(os.path.join(MODEL_DIR, scaler_file))
+    model = lite.load_passing(model_path)
+    if model is not None:
+        print(f"TFLite export of {model_file} and scaler {scaler_file} loaded successfully.")
+        return f"{model_file}+lite+{scaler_file}", {"model": model, "scaler": scaler}
+
+    model = load_keras_model(model_path)
+    print(f"Model {model_file} and scaler {scaler_file} loaded successfully.")
+    return f"{model_file}+{scaler_file}", {"model": model, "scaler": scaler}
+
+
+# Resident mood model and scaler, swapped when a new model is uploaded
+MODEL_REGISTRY = ModelRegistry("mood", load_model_version)
+
+
+def predict_segments(segments, version):
+    """Run one shared batch of mel segments through `version`, acquired by the requests in the batch, on the 1-9 scale."""
+    if version is None:
+        raise RuntimeError("No mood model available")
+    # Model and scaler come from the same version, even during a hot-swap
+    predictions_normalized = version.artifacts["model"].predict(segments, batch_size=len(segments), verbose=0)
+    return version.artifacts["scaler"].inverse_transform(predictions_normalized)
+
+
+# Batches segments from concurrent requests into shared model.predict calls
+BATCHER = MicroBatcher("mood", predict_segments, SHARED_BATCH_SIZE, SHARED_BATCH_WAIT_MS)
 
 # --- 3. Define Preprocessing Function ---
-def preprocess_song(audio_path, sr=44100, segment_length=5, n_mels=128, n_fft=2048, hop_length=512):
+def preprocess_song(audio_path, sr=44100, segment_length=5, n_mels=128, n_fft=2048, hop_length=512, context=None):
     """
     Loads an audio file, converts it to mel-spectrograms, and segments it.
     Args:
@@ -106,36 +134,48 @@ def preprocess_song(audio_path, sr=44100, segment_length=5, n_mels=128, n_fft=20
         n_mels (int): Number of Mel bands to generate.
         n_fft (int): Length of the FFT window.
         hop_length (int): Number of samples between successive frames.
+        context (AudioContext): Already decoded audio to reuse instead of loading audio_path.
     Returns:
         np.array: An array of mel-spectrogram segments, ready for the CNN model, or None if error.
     """
     try:
-        # Load audio (mono)
-        y_full, sr = librosa.load(audio_path, sr=sr, mono=True)
+        # Load audio (mono), reusing the shared decode when available
+        if context is not None:
+            y_full = context.signal(sr)
+        else:
+            y_full, sr = librosa.load(audio_path, sr=sr, mono=True)
     except Exception as e:
         print(f"Error loading audio file {audio_path}: {e}")
         return None
 
-    # Segment audio
+    # Segment audio: full segments only, as a (n_segments, segment_samples) view without copying
     segment_samples = segment_length * sr
-    segments = [y_full[i:i + segment_samples] for i in range(0, len(y_full), segment_samples)
-                if len(y_full[i:i + segment_samples]) == segment_samples]
-
-    if not segments:
+    n_segments = len(y_full) // segment_samples
+    if n_segments == 0:
         print(f"No full {segment_length}-second segments found in {audio_path}. Song might be too short.")
         return None
+    segments = y_full[:n_segments * segment_samples].reshape(n_segments, segment_samples)
 
-    mel_specs = []
-    for segment in segments:
-        # Compute Mel-spectrogram
-        mel_spec = librosa.feature.melspectrogram(y=segment, sr=sr, n_mels=n_mels, n_fft=n_fft, hop_length=hop_length)
-        # Convert to dB scale
-        mel_spec_db = librosa.power_to_db(mel_spec, ref=np.max)
-        mel_specs.append(mel_spec_db)
+    return segments_to_mel(segments, sr, n_mels, n_fft, hop_length)
 
-    # Convert to numpy array and add channel dimension for CNN input
-    mel_specs_array = np.array(mel_specs)
-    mel_specs_array = np.expand_dims(mel_specs_array, axis=-1)
+
+def segments_to_mel(segments, sr=44100, n_mels=128, n_fft=2048, hop_length=512):
+    """
+    Mel spectrograms in dB of equal-length segments (n_segments, samples),
+    written straight into the (n, n_mels, frames, 1) float32 model input.
+    """
+    n_segments, segment_samples = segments.shape
+    n_frames = 1 + segment_samples // hop_length
+    mel_specs_array = np.empty((n_segments, n_mels, n_frames, 1), dtype=np.float32)
+    for start in range(0, n_segments, MEL_BATCH_SEGMENTS):
+        batch = segments[start:start + MEL_BATCH_SEGMENTS]
+        mel_spec = librosa.feature.melspectrogram(y=batch, sr=sr, n_mels=n_mels, n_fft=n_fft, hop_length=hop_length)
+        # power_to_db(ref=np.max) per segment: dB relative to its own peak, floored 80 dB below it
+        out = mel_specs_array[start:start + len(batch), :, :, 0]
+        np.log10(np.maximum(mel_spec, 1e-10), out=out)
+        out *= 10.0
+        out -= out.max(axis=(1, 2), keepdims=True)
+        np.maximum(out, -80.0, out=out)
 
     return mel_specs_array
 
@@ -155,54 +195,62 @@ def categorize_mood(valence, arousal, val_thresh=5.0, aro_thresh=5.0, margin=0.0
         return "Mixed / Uncertain Mood"
 
 
-def predict_mood(file_name):
-    if not os.path.exists(file_name):
+def predict_mood(file_name, context=None):
+    if context is None and not os.path.exists(file_name):
         print(f"Error: The file '{file_name}' does not exist.")
         print("Please provide a valid path to your song file.")
         return 
     else:
         print(f"\nProcessing song: {os.path.basename(file_name)}...")
-        _song = preprocess_song(file_name)
-
-        if _song is not None:
-            print(f"Processed into {_song.shape[0]} segments.")
-            print(f"Input shape for model: {_song.shape}")
-
-            # Make Predictions (Normalized) ---
-            model = load_model()
-            predictions_normalized = model.predict(_song)
-            print("\nNormalized Predictions (first 5 segments):")
-            print(predictions_normalized[:5])
-
-            # Inverse Transform Predictions to Original Scale (1-9) ---
-            scaler = load_scaler()
-            predictions_original_scale = scaler.inverse_transform(predictions_normalized)
-            print("\nOriginal Scale Predictions (first 5 segments):")
-            print(predictions_original_scale[:5])
-
-            # Average Predictions Across All Segments for the Song ---
-            avg_valence_predicted = np.mean(predictions_original_scale[:, 0])
-            avg_arousal_predicted = np.mean(predictions_original_scale[:, 1])
-
-            print(f"\n--- Final Predicted Emotion for '{os.path.basename(file_name)}' ---")
-            print(f"Predicted Valence (1-9 scale): {avg_valence_predicted:.2f}")
-            print(f"Predicted Arousal (1-9 scale): {avg_arousal_predicted:.2f}")
-
-            # confidence
-            valence_std = np.std(predictions_original_scale[:, 0])
-            arousal_std = np.std(predictions_original_scale[:, 1])
-            ensemble_conf = 1 - np.mean([valence_std, arousal_std]) / 4.0  # normalize by max expected std
-            ensemble_conf = max(0.0, min(1.0, ensemble_conf))  # Clamp between 0 and 1
-
-
-            results = categorize_mood(avg_valence_predicted, avg_arousal_predicted)
-            print(results)
-            return {
-                "prediction": str(results),
-                "confidence": str(round(ensemble_conf, 2)),
-            }, float(avg_valence_predicted), float(avg_arousal_predicted)
+        if not MODEL_REGISTRY.available():
+            print("No mood model available. Prediction aborted.")
+            return
 
-        else:
-            print("Failed to preprocess the song. Prediction aborted.")
+        _song = preprocess_song(file_name, context=context)
+        return predict_mood_from_segments(_song, os.path.basename(file_name))
 
 
+def predict_mood_from_segments(_song, song_name="song"):
+    """Inference stage of the mood pipeline: score mel segments and average them over the song."""
+    if _song is not None:
+        print(f"Processed into {_song.shape[0]} segments.")
+        print(f"Input shape for model: {_song.shape}")
+
+        with MODEL_REGISTRY.acquire() as version:
+            if version is None:
+                print("No mood model available. Prediction aborted.")
+                return
+
+            # Make Predictions, inverse transformed to Original Scale (1-9) ---
+            return summarize_mood(BATCHER.predict(_song, version), song_name)
+
+    else:
+        print("Failed to preprocess the song. Prediction aborted.")
+
+
+def summarize_mood(predictions_original_scale, song_name="song"):
+    """Mood result, valence and arousal of a song from the (n_segments, 2) predictions of its segments."""
+    print("\nOriginal Scale Predictions (first 5 segments):")
+    print(predictions_original_scale[:5])
+
+    # Average Predictions Across All Segments for the Song ---
+    avg_valence_predicted = np.mean(predictions_original_scale[:, 0])
+    avg_arousal_predicted = np.mean(predictions_original_scale[:, 1])
+
+    print(f"\n--- Final Predicted Emotion for '{song_name}' ---")
+    print(f"Predicted Valence (1-9 scale): {avg_valence_predicted:.2f}")
+    print(f"Predicted Arousal (1-9 scale): {avg_arousal_predicted:.2f}")
+
+    # confidence
+    valence_std = np.std(predictions_original_scale[:, 0])
+    arousal_std = np.std(predictions_original_scale[:, 1])
+    ensemble_conf = 1 - np.mean([valence_std, arousal_std]) / 4.0  # normalize by max expected std
+    ensemble_conf = max(0.0, min(1.0, ensemble_conf))  # Clamp between 0 and 1
+
+    results = categorize_mood(avg_valence_predicted, avg_arousal_predicted)
+    print(results)
+    return {
+        "prediction": str(results),
+        "confidence": str(round(ensemble_conf, 2)),
+    }, float(avg_valence_predicted), float(avg_arousal_predicted)
+
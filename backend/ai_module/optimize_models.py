@@ -0,0 +1,152 @@
+"""
+TFLite export of the newest genre and mood models.
+
+    python backend/ai_module/optimize_models.py [genre|mood ...] [--quantization float16|int8|float32] [--force]
+
+The API runs this after every model upload and, at startup, for models that
+were never exported. Each model is converted with optional post-training
+quantization, calibrated on a small set of real model inputs and checked
+against its Keras outputs on a separate reference set; the loaders only
+switch to exports that pass (see inference/lite.py).
+
+Model inputs come from the feature cache (spectrograms of recently analysed
+tracks), topped up with synthetic tracks when the cache holds too few.
+"""
+import argparse
+import os
+import threading
+
+import numpy as np
+import librosa
+
+from analysis.audio_context import AudioContext, ANALYSIS_SR
+from analysis.pipeline import FEATURE_CACHE
+from genre import genre_ai
+from genre.melspec_render import pixels_to_model_input
+from inference import lite
+from mood import mood_ai
+
+# === Configuration ===
+CALIBRATION_SAMPLES = 64
+REFERENCE_SAMPLES = 128
+MODEL_KINDS = ("genre", "mood")
+# Cached tracks sampled, and inputs taken from each, so the sets span many tracks
+CACHED_TRACKS = 64
+INPUTS_PER_TRACK = 4
+
+# One export at a time: uploads and the startup check may overlap
+_EXPORT_LOCK = threading.Lock()
+
+
+def synthetic_track(seed, seconds=60, sr=ANALYSIS_SR):
+    """Tones, noise and clicks at a random tempo, to top up the inputs when the cache is nearly empty."""
+    rng = np.random.default_rng(seed)
+    n = int(seconds * sr)
+    t = np.arange(n) / sr
+    y = sum(rng.uniform(0.05, 0.3) * np.sin(2 * np.pi * rng.uniform(60, 2000) * t) for _ in range(4))
+    y += rng.uniform(0.005, 0.1) * rng.standard_normal(n)
+    y += librosa.clicks(times=np.arange(0, seconds, 60 / rng.uniform(60, 180)), sr=sr, length=n)
+    return y.astype(np.float32)
+
+
+def _spread(arrays, count, rng):
+    """Up to `count` rows drawn from several arrays, at most INPUTS_PER_TRACK from each."""
+    rows = []
+    for array in arrays:
+        picks = rng.choice(len(array), size=min(INPUTS_PER_TRACK, len(array)), replace=False)
+        rows.extend(np.asarray(array[i]) for i in sorted(picks))
+        if len(rows) >= count:
+            break
+    return rows[:count]
+
+
+def sample_inputs(kind, count, seed=0):
+    """(count, ...) float32 model inputs of the genre or mood model, shuffled."""
+    rng = np.random.default_rng(seed)
+    if kind == "genre":
+        cached = FEATURE_CACHE.sample_arrays("genre_images", genre_ai.FEATURE_VERSION, CACHED_TRACKS)
+    else:
+        cached = FEATURE_CACHE.sample_arrays("mood_segments", mood_ai.FEATURE_VERSION, CACHED_TRACKS)
+    rows = _spread(cached, count, rng)
+
+    track = 0
+    while len(rows) < count:
+        context = AudioContext(synthetic_track(seed * 1000 + track), ANALYSIS_SR)
+        if kind == "genre":
+            features = genre_ai.extract_chunk_images(None, context=context)
+        else:
+            features = mood_ai.preprocess_song(None, context=context)
+        if features is not None:
+            rows.extend(_spread([features], count - len(rows), rng))
+        track += 1
+    print(f"[{kind}] {count} model inputs, {min(count, len(cached) * INPUTS_PER_TRACK)} from cached tracks")
+
+    inputs = np.stack(rows)
+    rng.shuffle(inputs)
+    if kind == "genre":
+        return pixels_to_model_input(inputs)
+    return inputs.astype(np.float32)
+
+
+def latest_model_path(kind):
+    if kind == "genre":
+        latest_file = genre_ai.find_latest_model_file()
+        return os.path.join(genre_ai.MODEL_DIR, latest_file) if latest_file else None
+    latest_file = mood_ai.find_latest_file("keras|h5")
+    return os.path.join(mood_ai.MODEL_DIR, latest_file) if latest_file else None
+
+
+def optimize(kind, quantization=lite.LITE_QUANTIZATION, force=False):
+    """
+    Export the newest model of `kind` ("genre" or "mood") unless it already
+    has a report. Returns the parity report, or None if there was nothing to do.
+    """
+    if quantization == "off":
+        return None
+    model_path = latest_model_path(kind)
+    if model_path is None:
+        print(f"[{kind}] No model to export")
+        return None
+    if not force and lite.read_report(model_path) is not None:
+        print(f"[{kind}] {os.path.basename(model_path)} already exported")
+        return None
+
+    module = genre_ai if kind == "genre" else mood_ai
+    print(f"[{kind}] Exporting {os.path.basename(model_path)} to TFLite ({quantization})")
+    model = module.load_keras_model(model_path)
+    inputs = sample_inputs(kind, CALIBRATION_SAMPLES + REFERENCE_SAMPLES)
+    calibration, reference = inputs[:CALIBRATION_SAMPLES], inputs[CALIBRATION_SAMPLES:]
+    return lite.export(model_path, model, calibration, reference, module.LITE_TOLERANCE, quantization)
+
+
+def optimize_and_reload(kind, registry, quantization=lite.LITE_QUANTIZATION, force=False):
+    """Export the newest model, then reload the registry so a passing export goes live."""
+    try:
+        with _EXPORT_LOCK:
+            report = optimize(kind, quantization, force)
+    except Exception as e:
+        print(f"[{kind}] TFLite export failed, keeping the Keras model: {e}")
+        return None
+    if report is not None and report["passed"]:
+        registry.load()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the newest genre and mood models to TFLite.")
+    # Checked below: argparse rejects an empty (or default) list against `choices` for nargs="*"
+    parser.add_argument("kinds", nargs="*", metavar="{genre,mood}", help="models to export (default: both)")
+    parser.add_argument("--quantization", choices=lite.QUANTIZATIONS, default=lite.LITE_QUANTIZATION)
+    parser.add_argument("--force", action="store_true", help="export again even if a report exists")
+    args = parser.parse_args()
+    invalid = [kind for kind in args.kinds if kind not in MODEL_KINDS]
+    if invalid:
+        parser.error(f"invalid model kind: {', '.join(invalid)} (choose from {', '.join(MODEL_KINDS)})")
+    args.kinds = args.kinds or list(MODEL_KINDS)
+
+    for kind in args.kinds:
+        optimize(kind, args.quantization, args.force)
+
+
+if __name__ == "__main__":
+    main()
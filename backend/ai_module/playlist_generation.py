@@ -1,67 +1,12 @@
-import os
+import sys
 import pandas as pd
 import numpy as np
-from dotenv import load_dotenv
-import psycopg2
-from sklearn.preprocessing import MinMaxScaler
+from db.pool import DB_POOL, PreparedStatement, fetch_prepared
 
 # ---------------------------
-# 1. Load environment & connect
+# 1. Schema & weights
 # ---------------------------
-dotenv_path = os.path.join(os.path.dirname(__file__), '..', 'src', '.env')
-load_dotenv(dotenv_path)
-
-conn = psycopg2.connect(
-    dbname=os.getenv("PGDATABASE"),
-    user=os.getenv("PGUSER"),
-    password=os.getenv("PGPASSWORD"),
-    host=os.getenv("PGHOST"),
-    port=os.getenv("PGPORT")
-)
-conn.autocommit = True
-
-def get_db_connection():
-    print("✅ Establishing database connection...")
-    return conn
-
-# ---------------------------
-# 2. Fetch user-related songs
-# ---------------------------
-user_id = "881e2b4f-dbed-4a58-84ad-87be6473f3f3"
-
-queries = {
-    "liked": f"SELECT * FROM get_user_liked_songs_features('{user_id}');",
-    "history": f"SELECT * FROM get_user_recent_history_features('{user_id}', 30);",
-    "album": f"SELECT * FROM get_user_album_songs_features('{user_id}');"
-}
-
-dfs = []
-for source, query in queries.items():
-    df = pd.read_sql(query, conn)
-    if df.empty:
-        continue
-    df["source"] = source
-    dfs.append(df)
-
-if not dfs:
-    print("⚠️ No songs found for this user.")
-    exit()
-
-all_songs = pd.concat(dfs, ignore_index=True)
-
-# ---------------------------
-# 3. Remove duplicate songs
-# ---------------------------
-all_songs_unique = all_songs.drop_duplicates(subset="song_id", keep="first")
-print(f"🎵 Unique songs fetched: {len(all_songs_unique)}")
-
-# ---------------------------
-# 4. Encode features (18-dim schema)
-# ---------------------------
-# Normalize bpm the same way as in SQL
-all_songs_unique["bpm"] = all_songs_unique["bpm"] / 200.0  
-
-# Define schema columns
+# 18-dim schema, the same layout as song_features.vector
 feature_columns = [
     "bpm", "valence", "arousal",
     "genre_blues", "genre_classical", "genre_country",
@@ -70,13 +15,7 @@ feature_columns = [
     "mood_happy_excited", "mood_angry_tense", "mood_sad_calm",
     "mood_calm_relaxed", "mood_mixed_uncertain"
 ]
-
-# Add genre one-hot
 genre_map = ["blues","classical","country","disco","hiphop","jazz","metal","pop","reggae","rock"]
-for g in genre_map:
-    all_songs_unique[f"genre_{g}"] = (all_songs_unique["genre"] == g).astype(int)
-
-# Add mood one-hot
 mood_map = {
     "Happy / Excited": "mood_happy_excited",
     "Angry / Tense": "mood_angry_tense",
@@ -84,62 +23,191 @@ mood_map = {
     "Calm / Relaxed": "mood_calm_relaxed",
     "Mixed / Uncertain Mood": "mood_mixed_uncertain"
 }
-for m, col in mood_map.items():
-    all_songs_unique[col] = (all_songs_unique["mood"] == m).astype(int)
 
-# Ensure all feature columns exist
-for col in feature_columns:
-    if col not in all_songs_unique:
-        all_songs_unique[col] = 0
+base_weights = {"liked": 1.0, "history": 0.8, "album": 0.5}
+HISTORY_DAYS = 30
+MIN_RECENCY_FACTOR = 0.2
+
+# One prepared statement per source for a whole batch of users; history also
+# carries when each song was last played, for the recency weight. Sources are
+# listed in priority order: a song found by several keeps the first one.
+statements = {
+    "liked": PreparedStatement("user_liked_songs_features", ["uuid[]"], """
+        SELECT u.user_id::text AS user_id, f.*
+        FROM unnest($1) AS u(user_id)
+        CROSS JOIN LATERAL get_user_liked_songs_features(u.user_id) f
+    """),
+    "history": PreparedStatement("user_recent_history_features", ["uuid[]", "integer"], """
+        SELECT u.user_id::text AS user_id, f.*,
+               (SELECT MAX(h.last_played) FROM song_history h
+                WHERE h.user_id = u.user_id AND h.song_id = f.song_id) AS last_played
+        FROM unnest($1) AS u(user_id)
+        CROSS JOIN LATERAL get_user_recent_history_features(u.user_id, $2) f
+    """),
+    "album": PreparedStatement("user_album_songs_features", ["uuid[]"], """
+        SELECT u.user_id::text AS user_id, f.*
+        FROM unnest($1) AS u(user_id)
+        CROSS JOIN LATERAL get_user_album_songs_features(u.user_id) f
+    """)
+}
+
+# ---------------------------
+# 2. Fetch user-related songs
+# ---------------------------
+def fetch_user_songs(user_ids):
+    """Liked, recent history and album songs of each user, one row per (user, song)."""
+    user_ids = list(user_ids)
+    params = {
+        "liked": (user_ids,),
+        "history": (user_ids, HISTORY_DAYS),
+        "album": (user_ids,)
+    }
+
+    # The three sources are fetched at the same time, on separate pooled connections
+    results = DB_POOL.run_concurrently({
+        source: (fetch_prepared, statement, params[source]) for source, statement in statements.items()
+    })
+
+    dfs = []
+    for source in statements:
+        columns, rows = results[source]
+        if not rows:
+            continue
+        df = pd.DataFrame(rows, columns=columns)
+        df["source"] = source
+        dfs.append(df)
+
+    if not dfs:
+        return pd.DataFrame(columns=["user_id", "song_id", "source"])
+
+    all_songs = pd.concat(dfs, ignore_index=True)
+    return all_songs.drop_duplicates(subset=["user_id", "song_id"], keep="first").reset_index(drop=True)
 
 # ---------------------------
-# 5. Build weighted user vector
+# 3. Encode features (18-dim schema)
 # ---------------------------
-base_weights = {"liked": 1.0, "history": 0.8, "album": 0.5}
-weights = []
+def encode_features(songs):
+    """(n, 18) feature matrix, in the order of feature_columns."""
+    n = len(songs)
+    X = np.zeros((n, len(feature_columns)))
+    if n == 0:
+        return X
+
+    # Normalize bpm the same way as in SQL
+    X[:, 0] = pd.to_numeric(songs["bpm"], errors="coerce").to_numpy(dtype=float) / 200.0
+    X[:, 1] = pd.to_numeric(songs["valence"], errors="coerce").to_numpy(dtype=float)
+    X[:, 2] = pd.to_numeric(songs["arousal"], errors="coerce").to_numpy(dtype=float)
+
+    genres = songs["genre"].to_numpy(dtype=object)[:, None]
+    X[:, 3:13] = genres == np.array(genre_map, dtype=object)[None, :]
+
+    moods = songs["mood"].to_numpy(dtype=object)[:, None]
+    X[:, 13:18] = moods == np.array(list(mood_map), dtype=object)[None, :]
+
+    # Missing BPM/valence/arousal count as 0
+    return np.nan_to_num(X, nan=0.0)
+
 
-for _, row in all_songs_unique.iterrows():
-    w = base_weights.get(row["source"], 0.5)
+def encode_song_vector(bpm, valence, arousal, genre, mood):
+    """18-dim vector of one analysed song, e.g. from a /predict result."""
+    song = pd.DataFrame({"bpm": [bpm], "valence": [valence], "arousal": [arousal], "genre": [genre], "mood": [mood]})
+    return encode_features(song)[0]
 
-    # Recency factor if from history
-    if row["source"] == "history" and "last_played" in all_songs_unique.columns:
-        last_played = all_songs_unique.loc[
-            all_songs_unique["song_id"] == row["song_id"], "last_played"
-        ].values[0]
-        if pd.notnull(last_played):
-            days_ago = (pd.Timestamp.now() - pd.to_datetime(last_played)).days
-            recency_factor = max(0.2, 1 - (days_ago / 30))
-            w *= recency_factor
 
-    weights.append(w)
+def song_weights(songs, now=None):
+    """Source weight of every song, scaled down for history songs played long ago."""
+    weights = songs["source"].map(base_weights).fillna(0.5).to_numpy(dtype=float)
 
-weights = np.array(weights)
+    if "last_played" in songs.columns:
+        now = now if now is not None else pd.Timestamp.now()
+        last_played = pd.to_datetime(songs["last_played"], errors="coerce")
+        if last_played.dt.tz is not None:
+            last_played = last_played.dt.tz_convert(None)
+        days_ago = (now - last_played).dt.days.to_numpy(dtype=float)
 
-X = all_songs_unique[feature_columns].values
-user_vector = np.average(X, axis=0, weights=weights)
+        recency_factor = np.maximum(MIN_RECENCY_FACTOR, 1 - days_ago / HISTORY_DAYS)
+        is_recent = (songs["source"].to_numpy() == "history") & ~np.isnan(days_ago)
+        weights = np.where(is_recent, weights * recency_factor, weights)
 
-# Replace NaNs with 0
-user_vector = np.nan_to_num(user_vector, nan=0.0)
-print("✅ User vector (18 elements):", user_vector)
-print("📌 Length:", len(user_vector))
+    return weights
 
 # ---------------------------
-# 6. Compare with all songs in song_features table
+# 4. Build weighted user vectors
 # ---------------------------
-with conn.cursor() as cur:
-    # Use psycopg2 param substitution to safely pass array
-    query = """
-        WITH user_vec AS (
-            SELECT %s::REAL[] AS vector
-        )
-        SELECT sf.song_id, cosine_similarity(uv.vector, sf.vector) AS similarity
-        FROM song_features sf, user_vec uv
-        ORDER BY similarity DESC
-        LIMIT 10;
+def build_user_vectors(user_ids, songs=None):
     """
-    cur.execute(query, (list(user_vector),))
-    top_songs = cur.fetchall()
+    Weighted average of the 18-dim features of each user's songs.
+    Args:
+        user_ids (list): User IDs to build vectors for.
+        songs (pd.DataFrame): Optional prefetched rows, as returned by fetch_user_songs.
+    Returns:
+        dict: user_id -> np.array of 18 elements, or None for users without songs.
+    """
+    user_ids = [str(user_id) for user_id in user_ids]
+    if songs is None:
+        songs = fetch_user_songs(user_ids)
+
+    vectors = dict.fromkeys(user_ids)
+    if songs.empty:
+        return vectors
+
+    X = encode_features(songs)
+    weights = song_weights(songs)
+
+    # Per-user weighted sums in one pass over all rows
+    codes, users = pd.factorize(songs["user_id"].astype(str))
+    weighted_sums = np.zeros((len(users), X.shape[1]))
+    np.add.at(weighted_sums, codes, X * weights[:, None])
+    weight_totals = np.bincount(codes, weights=weights, minlength=len(users))
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        user_matrix = np.nan_to_num(weighted_sums / weight_totals[:, None], nan=0.0)
 
-print("🎯 Top 10 Recommended Songs:")
-for song_id, sim in top_songs:
-    print(f"Song ID: {song_id}, Similarity: {sim:.4f}")
+    for user_id, vector in zip(users, user_matrix):
+        if user_id in vectors:
+            vectors[user_id] = vector
+    return vectors
+
+
+def build_user_vector(user_id):
+    """18-dim taste vector of one user, or None if they have no liked, history or album songs."""
+    return build_user_vectors([user_id])[str(user_id)]
+
+# ---------------------------
+# 5. Compare with all songs in song_features table
+# ---------------------------
+def _top_similar_songs(conn, user_vector, limit):
+    with conn.cursor() as cur:
+        # Use psycopg2 param substitution to safely pass array
+        query = """
+            WITH user_vec AS (
+                SELECT %s::REAL[] AS vector
+            )
+            SELECT sf.song_id, cosine_similarity(uv.vector, sf.vector) AS similarity
+            FROM song_features sf, user_vec uv
+            ORDER BY similarity DESC
+            LIMIT %s;
+        """
+        cur.execute(query, ([float(x) for x in user_vector], limit))
+        return cur.fetchall()
+
+
+def recommend_songs(user_vector, limit=10):
+    """(song_id, similarity) of the songs closest to user_vector."""
+    return DB_POOL.run(_top_similar_songs, user_vector, limit)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python playlist_generation.py <user_id> [<user_id> ...]")
+        sys.exit(1)
+
+    for user_id, user_vector in build_user_vectors(sys.argv[1:]).items():
+        if user_vector is None:
+            print(f"⚠️ No songs found for user {user_id}.")
+            continue
+
+        print(f"✅ User vector for {user_id} (18 elements):", user_vector)
+        print("🎯 Top 10 Recommended Songs:")
+        for song_id, sim in recommend_songs(user_vector):
+            print(f"Song ID: {song_id}, Similarity: {sim:.4f}")
@@ -0,0 +1,82 @@
+"""
+Offline recommendation precomputation for every active user.
+
+    python backend/ai_module/precompute_recommendations.py [--days 30] [--top-k 50]
+
+Users are processed in chunks: their liked, history and album features are
+fetched with one set-based query per source, their vectors are built as one
+matrix, and that matrix is scored against the song index block by block.
+The results replace the users' rows in user_recommendations, which
+/recommendations serves until they are older than the TTL.
+"""
+import argparse
+import time
+
+import numpy as np
+
+from db.pool import DB_POOL
+from playlist_generation import build_user_vectors, HISTORY_DAYS
+from recommend.song_index import SongIndex
+from recommend.recommendation_store import ensure_table, save_recommendations, STORED_RECOMMENDATIONS
+
+# === Configuration ===
+USER_CHUNK_SIZE = 2000
+
+# Users who listened to or liked something recently
+ACTIVE_USERS_QUERY = """
+    SELECT user_id::text FROM song_history WHERE last_played > now() - %(days)s * interval '1 day'
+    UNION
+    SELECT user_id::text FROM liked_songs WHERE created_at > now() - %(days)s * interval '1 day';
+"""
+
+
+def active_user_ids(conn, days=HISTORY_DAYS):
+    with conn.cursor() as cur:
+        cur.execute(ACTIVE_USERS_QUERY, {"days": days})
+        return sorted(row[0] for row in cur.fetchall())
+
+
+def precompute_chunk(index, user_ids, top_k):
+    """Recommendations of one chunk of users, saved to user_recommendations; returns how many users had any."""
+    vectors = {user_id: vector for user_id, vector in build_user_vectors(user_ids).items()
+               if vector is not None}
+    if not vectors:
+        return 0
+
+    users = list(vectors)
+    results = index.query_many(np.stack([vectors[user_id] for user_id in users]), top_k)
+    DB_POOL.run(save_recommendations, dict(zip(users, results)))
+    return len(users)
+
+
+def precompute_all(days=HISTORY_DAYS, top_k=STORED_RECOMMENDATIONS, chunk_size=USER_CHUNK_SIZE, index=None):
+    DB_POOL.run(ensure_table)
+    if index is None:
+        index = SongIndex()
+        index.load()
+
+    user_ids = DB_POOL.run(active_user_ids, days)
+    print(f"Precomputing recommendations for {len(user_ids)} active users")
+
+    started = time.time()
+    done = 0
+    for start in range(0, len(user_ids), chunk_size):
+        done += precompute_chunk(index, user_ids[start:start + chunk_size], top_k)
+        print(f"[{min(start + chunk_size, len(user_ids))}/{len(user_ids)}] {time.time() - started:.1f}s")
+
+    print(f"Stored recommendations for {done} users in {time.time() - started:.1f}s")
+    return done
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompute song recommendations for all active users.")
+    parser.add_argument("--days", type=int, default=HISTORY_DAYS, help="activity window defining active users")
+    parser.add_argument("--top-k", type=int, default=STORED_RECOMMENDATIONS, help="recommendations stored per user")
+    parser.add_argument("--chunk-size", type=int, default=USER_CHUNK_SIZE, help="users processed per batch")
+    args = parser.parse_args()
+
+    precompute_all(args.days, args.top_k, args.chunk_size)
+
+
+if __name__ == "__main__":
+    main()
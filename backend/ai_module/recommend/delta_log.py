@@ -0,0 +1,49 @@
+import json
+import os
+import threading
+
+
+class DeltaLog:
+    """
+    Append-only JSON-lines log of index changes made since the last snapshot.
+    Records are flushed as they are written; a torn last line from a crash is
+    skipped on replay.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = None
+        self.records = 0
+
+    def append(self, record):
+        with self._lock:
+            if self._file is None:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                self._file = open(self.path, "a")
+            self._file.write(json.dumps(record) + "\n")
+            self._file.flush()
+            self.records += 1
+
+    def replay(self):
+        """Records in the order they were written."""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    print(f"Skipping unreadable record in {self.path}")
+                    continue
+                yield record
+
+    def truncate(self):
+        """Drop all records, once a snapshot holds their effect."""
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            self.records = 0
@@ -0,0 +1,73 @@
+import os
+
+from psycopg2.extras import execute_values
+
+# === Configuration ===
+STORED_RECOMMENDATIONS = int(os.getenv("AI_STORED_RECOMMENDATIONS", "50"))
+RECOMMENDATION_TTL_HOURS = float(os.getenv("AI_RECOMMENDATION_TTL_HOURS", "24"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS user_recommendations (
+    user_id uuid NOT NULL,
+    rank integer NOT NULL,
+    song_id uuid NOT NULL,
+    similarity real NOT NULL,
+    computed_at timestamp with time zone DEFAULT now() NOT NULL,
+    PRIMARY KEY (user_id, rank)
+);
+"""
+
+
+def ensure_table(conn):
+    with conn.cursor() as cur:
+        cur.execute(SCHEMA)
+
+
+def save_recommendations(conn, recommendations):
+    """
+    Replace the stored recommendations of the given users.
+    Args:
+        recommendations (dict): user_id -> list of (song_id, similarity), best first.
+    """
+    if not recommendations:
+        return
+    rows = [
+        (user_id, rank, song_id, similarity)
+        for user_id, songs in recommendations.items()
+        for rank, (song_id, similarity) in enumerate(songs, start=1)
+    ]
+    # Explicit transaction, as the shared connection runs in autocommit mode
+    with conn.cursor() as cur:
+        cur.execute("BEGIN")
+        try:
+            cur.execute(
+                "DELETE FROM user_recommendations WHERE user_id = ANY(%s::uuid[])",
+                (list(recommendations),)
+            )
+            execute_values(
+                cur,
+                "INSERT INTO user_recommendations (user_id, rank, song_id, similarity) VALUES %s",
+                rows,
+                template="(%s::uuid, %s, %s::uuid, %s)",
+                page_size=1000
+            )
+            cur.execute("COMMIT")
+        except Exception:
+            cur.execute("ROLLBACK")
+            raise
+
+
+def load_recommendations(conn, user_id, ttl_hours=RECOMMENDATION_TTL_HOURS):
+    """Stored (song_id, similarity) pairs of a user, or None if there are none younger than the TTL."""
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            SELECT song_id::text, similarity
+            FROM user_recommendations
+            WHERE user_id = %s::uuid AND computed_at > now() - %s * interval '1 hour'
+            ORDER BY rank;
+            """,
+            (user_id, ttl_hours)
+        )
+        rows = cur.fetchall()
+    return rows or None
@@ -0,0 +1,606 @@
+import os
+import threading
+import time
+import uuid
+
+import numpy as np
+
+from db.pool import DB_POOL
+from playlist_generation import genre_map, mood_map
+from recommend.delta_log import DeltaLog
+
+# === Configuration ===
+VECTOR_DIM = 18
+INDEX_DIR = "./backend/ai_module/data/song_index/"
+# Up to this many songs every query scans the whole matrix with one BLAS call;
+# above it, queries go through the IVF index
+EXACT_SEARCH_MAX = int(os.getenv("AI_EXACT_SEARCH_MAX", "200000"))
+# Lists scanned per IVF query. IVF search is approximate: on synthetic catalogues
+# (tests/test_song_index.py) 8 probes find about 96% of the exact top 10 at 20k
+# songs, 80% at 50k. There are sqrt(n) lists, so recall drops as the catalogue
+# grows; raise this with EXACT_SEARCH_MAX (32 probes: over 99% at 50k).
+IVF_PROBES = int(os.getenv("AI_IVF_PROBES", "8"))
+KMEANS_ITERATIONS = 10
+KMEANS_SAMPLE_SIZE = 50000
+# Fold the delta log into a new snapshot after this many changes
+COMPACT_AFTER = int(os.getenv("AI_INDEX_COMPACT_AFTER", "5000"))
+INITIAL_CAPACITY = 1024
+# Songs scored per block when recommending for many users at once
+QUERY_BLOCK_SIZE = 16384
+# Publish/block/encryption state and deletions are re-read from the database this often
+FLAG_REFRESH_SECONDS = int(os.getenv("AI_INDEX_FLAG_REFRESH_SECONDS", "60"))
+# /predict runs before the song row is written; until then a new song is not treated as deleted
+NEW_SONG_GRACE_SECONDS = 600
+
+MOODS = list(mood_map)
+
+# Latest vector of every song, with what the filters need. "playable" mirrors
+# the Node side: only songs whose file was encrypted can be streamed.
+LOAD_QUERY = """
+    SELECT DISTINCT ON (sf.song_id)
+        sf.song_id::text, sf.vector, s.album_id::text, a.published, a.is_blocked,
+        s.encryption_key IS NOT NULL AS playable, s.genre, s.mood
+    FROM song_features sf
+    JOIN songs s ON s.id = sf.song_id
+    JOIN albums a ON a.id = s.album_id
+    ORDER BY sf.song_id, sf.created_at DESC;
+"""
+
+# Current state of every song, for refresh_flags
+FLAGS_QUERY = """
+    SELECT s.id::text, s.album_id::text, a.published, a.is_blocked, s.encryption_key IS NOT NULL AS playable
+    FROM songs s
+    JOIN albums a ON a.id = s.album_id;
+"""
+
+
+def normalize_rows(vectors):
+    """Rows scaled to unit length (zero rows stay zero), as contiguous float32."""
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return np.divide(vectors, norms, out=np.zeros_like(vectors), where=norms > 0)
+
+
+def top_k(scores, k):
+    """Indices of the k highest finite scores, best first."""
+    k = min(k, int(np.isfinite(scores).sum()))
+    if k <= 0:
+        return np.empty(0, dtype=np.intp)
+    best = np.argpartition(-scores, k - 1)[:k]
+    return best[np.argsort(-scores[best], kind="stable")]
+
+
+class IVFIndex:
+    """
+    Inverted-file index: songs are grouped by their nearest k-means centroid,
+    and a query only scores the songs of the few closest groups.
+    """
+
+    def __init__(self, matrix, n_lists=None, seed=0):
+        n = len(matrix)
+        self.rows = n
+        self.n_lists = n_lists or max(1, int(np.sqrt(n)))
+        rng = np.random.default_rng(seed)
+
+        # Spherical k-means on a sample; vectors are unit length, so dot = cosine
+        sample = matrix[rng.choice(n, min(n, KMEANS_SAMPLE_SIZE), replace=False)]
+        centroids = sample[rng.choice(len(sample), self.n_lists, replace=False)]
+        for _ in range(KMEANS_ITERATIONS):
+            assignment = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, sample)
+            empty = np.bincount(assignment, minlength=self.n_lists) == 0
+            sums[empty] = centroids[empty]
+            centroids = normalize_rows(sums)
+        self.centroids = centroids
+
+        # Lists stored CSR-style: song rows sorted by list, with offsets per list
+        assignment = self.assign(matrix)
+        self.order = np.argsort(assignment, kind="stable")
+        self.offsets = np.concatenate(([0], np.cumsum(np.bincount(assignment, minlength=self.n_lists))))
+
+    def assign(self, vectors):
+        """Nearest list of each vector."""
+        return np.argmax(vectors @ self.centroids.T, axis=1)
+
+    def candidates(self, query, probes=IVF_PROBES):
+        """Rows in the `probes` lists closest to the query."""
+        lists = top_k(self.centroids @ query, probes)
+        return np.concatenate([self.order[self.offsets[i]:self.offsets[i + 1]] for i in lists])
+
+
+class _Rows:
+    """
+    Column arrays of the index with spare capacity, so songs can be appended
+    without copying. A row is written before `size` covers it, so queries
+    reading `size` first never see a half-written row.
+    """
+
+    def __init__(self, capacity):
+        self.size = 0
+        self.matrix = np.zeros((capacity, VECTOR_DIM), dtype=np.float32)
+        self.song_ids = np.empty(capacity, dtype=object)
+        self.album_ids = np.empty(capacity, dtype=object)
+        self.published = np.zeros(capacity, dtype=bool)
+        self.blocked = np.zeros(capacity, dtype=bool)
+        self.playable = np.zeros(capacity, dtype=bool)
+        self.live = np.zeros(capacity, dtype=bool)
+        self.available = np.zeros(capacity, dtype=bool)
+        self.genre_masks = {genre: np.zeros(capacity, dtype=bool) for genre in genre_map}
+        self.mood_masks = {mood: np.zeros(capacity, dtype=bool) for mood in MOODS}
+
+    def columns(self):
+        return [
+            self.matrix, self.song_ids, self.album_ids, self.published, self.blocked,
+            self.playable, self.live, self.available, *self.genre_masks.values(), *self.mood_masks.values()
+        ]
+
+    def grown(self):
+        """Copy with twice the capacity."""
+        bigger = _Rows(2 * len(self.matrix))
+        for old, new in zip(self.columns(), bigger.columns()):
+            new[:self.size] = old[:self.size]
+        bigger.size = self.size
+        return bigger
+
+    def refresh_available(self, rows):
+        self.available[rows] = self.live[rows] & self.published[rows] & ~self.blocked[rows] & self.playable[rows]
+
+
+class SongIndex:
+    """
+    In-memory top-k search over the 18-dim song vectors.
+
+    Vectors live in one contiguous, pre-normalized float32 matrix, so the
+    similarity of a user vector to every song is a single matrix-vector
+    product; large catalogues are searched through an IVF index instead,
+    which trades some recall for speed (see IVF_PROBES). query_many is
+    always exact.
+    Availability, genre and mood filters are boolean masks over the rows,
+    kept up to date as songs change rather than computed per query.
+
+    Songs analysed after the index was built are appended (an updated song
+    gets a new row and its old row is tombstoned) and written to a delta log,
+    so a restart loads the last snapshot and replays the log instead of
+    reading song_features again. Rows appended after the IVF index was built
+    are always scanned exactly; compaction folds the log into a new snapshot
+    and rebuilds the IVF index.
+
+    Publishing, blocking, encrypting and deleting happen on the Node side, so
+    refresh_flags() re-reads that state from the database on load and every
+    FLAG_REFRESH_SECONDS once start_refresh() is called; the flag and delete
+    endpoints only make a change visible sooner.
+    """
+
+    def __init__(self, exact_search_max=EXACT_SEARCH_MAX, index_dir=INDEX_DIR):
+        self.exact_search_max = exact_search_max
+        self.snapshot_path = os.path.join(index_dir, "snapshot.npz")
+        self.log = DeltaLog(os.path.join(index_dir, "deltas.jsonl"))
+        self._lock = threading.RLock()
+        self._rows = None
+        self._row_of = {}
+        self._ivf = None
+        self._built_at = None
+        self._unconfirmed = {}
+        self._refreshed_at = None
+        self._stop_refresh = threading.Event()
+        self._refresh_thread = None
+
+    # --- Building ---
+    def build(self, song_ids, vectors, album_ids, published, blocked, playable, genres, moods):
+        """Replace the index contents; every argument has one entry per song."""
+        n = len(song_ids)
+        rows = _Rows(max(INITIAL_CAPACITY, 2 * n))
+        rows.matrix[:n] = normalize_rows(np.asarray(vectors, dtype=np.float32).reshape(-1, VECTOR_DIM))
+        rows.song_ids[:n] = list(song_ids)
+        rows.album_ids[:n] = list(album_ids)
+        rows.published[:n] = published
+        rows.blocked[:n] = blocked
+        rows.playable[:n] = playable
+        rows.live[:n] = True
+        genres = np.asarray(genres, dtype=object)
+        moods = np.asarray(moods, dtype=object)
+        for genre, mask in rows.genre_masks.items():
+            mask[:n] = genres == genre
+        for mood, mask in rows.mood_masks.items():
+            mask[:n] = moods == mood
+        rows.size = n
+        rows.refresh_available(slice(0, n))
+
+        ivf = IVFIndex(rows.matrix[:n]) if n > self.exact_search_max else None
+        with self._lock:
+            self._rows = rows
+            self._row_of = {song_id: i for i, song_id in enumerate(rows.song_ids[:n])}
+            self._ivf = ivf
+            self._built_at = time.time()
+        print(f"Song index built: {n} songs, {'IVF' if ivf else 'exact'} search")
+
+    def load(self):
+        """Last snapshot plus the delta log if there is one, otherwise song_features; then the current flags."""
+        with self._lock:
+            if os.path.exists(self.snapshot_path):
+                self._load_snapshot()
+                replayed = self._replay()
+                print(f"Song index restored from snapshot, {replayed} changes replayed")
+                if replayed >= COMPACT_AFTER:
+                    self.compact()
+            else:
+                self.load_from_db()
+                return
+
+        # The snapshot and log may predate publishes, blocks and deletions made meanwhile
+        try:
+            self.refresh_flags()
+        except Exception as e:
+            print(f"Error refreshing song index flags: {e}")
+
+    def load_from_db(self):
+        """Rebuild from song_features, keeping logged changes the table does not have yet."""
+        rows = DB_POOL.run(self._fetch_rows)
+        rows = [row for row in rows if row[1] is not None and len(row[1]) == VECTOR_DIM]
+        columns = list(zip(*rows)) if rows else [[]] * 8
+
+        with self._lock:
+            self.build(columns[0], np.array(columns[1], dtype=np.float32).reshape(-1, VECTOR_DIM), *columns[2:])
+            self._replay()
+            self.compact()
+        # Logged flag changes replayed above may be older than the table
+        self.refresh_flags()
+
+    @staticmethod
+    def _fetch_rows(conn):
+        with conn.cursor() as cur:
+            cur.execute(LOAD_QUERY)
+            return cur.fetchall()
+
+    def loaded(self):
+        return self._rows is not None
+
+    # --- Database state ---
+    def refresh_flags(self):
+        """
+        Re-read publish/block/encryption state from the database and tombstone
+        songs that no longer exist there. Returns (rows changed, rows deleted).
+        """
+        state = {row[0]: row[1:] for row in DB_POOL.run(self._fetch_flags)}
+        with self._lock:
+            rows = self._rows
+            if rows is None:
+                return 0, 0
+            now = time.time()
+            changed, deleted = [], []
+            for song_id, i in list(self._row_of.items()):
+                current = state.get(song_id)
+                if current is None:
+                    if now - self._unconfirmed.get(song_id, 0) > NEW_SONG_GRACE_SECONDS:
+                        self._row_of.pop(song_id)
+                        self._unconfirmed.pop(song_id, None)
+                        deleted.append(i)
+                    continue
+
+                self._unconfirmed.pop(song_id, None)
+                album_id, published, blocked, playable = current
+                flags = (bool(published), bool(blocked), bool(playable))
+                if rows.album_ids[i] != album_id or (rows.published[i], rows.blocked[i], rows.playable[i]) != flags:
+                    rows.album_ids[i] = album_id
+                    rows.published[i], rows.blocked[i], rows.playable[i] = flags
+                    changed.append(i)
+
+            rows.live[deleted] = False
+            rows.refresh_available(changed + deleted)
+            self._refreshed_at = now
+
+        if changed or deleted:
+            print(f"Song index flags refreshed: {len(changed)} songs changed, {len(deleted)} deleted")
+        return len(changed), len(deleted)
+
+    @staticmethod
+    def _fetch_flags(conn):
+        with conn.cursor() as cur:
+            cur.execute(FLAGS_QUERY)
+            return cur.fetchall()
+
+    def start_refresh(self, interval=FLAG_REFRESH_SECONDS):
+        """Call refresh_flags every `interval` seconds on a background thread until stop_refresh()."""
+        def run():
+            while not self._stop_refresh.wait(interval):
+                try:
+                    self.refresh_flags()
+                except Exception as e:
+                    print(f"Error refreshing song index flags: {e}")
+
+        self._stop_refresh.clear()
+        self._refresh_thread = threading.Thread(target=run, name="song-index-refresh", daemon=True)
+        self._refresh_thread.start()
+
+    def stop_refresh(self):
+        self._stop_refresh.set()
+        if self._refresh_thread is not None:
+            self._refresh_thread.join(timeout=1)
+            self._refresh_thread = None
+
+    # --- Incremental changes ---
+    def upsert(self, song_id, vector, genre, mood, album_id=None, published=None, blocked=None, playable=None):
+        """
+        Add or replace one song. Flags left as None keep the song's current
+        values; a song new to the index is unavailable until they are set.
+        """
+        record = {
+            "op": "upsert", "song_id": song_id, "vector": [float(x) for x in vector], "genre": genre,
+            "mood": mood, "album_id": album_id, "published": published, "blocked": blocked, "playable": playable
+        }
+        self._apply_and_log(record)
+
+    def set_flags(self, song_id=None, album_id=None, published=None, blocked=None, playable=None):
+        """Update publish/block/encryption state of one song or of every song of an album."""
+        record = {
+            "op": "flags", "song_id": song_id, "album_id": album_id,
+            "published": published, "blocked": blocked, "playable": playable
+        }
+        self._apply_and_log(record)
+
+    def delete(self, song_id=None, album_id=None):
+        """Tombstone one song, or every song of a deleted album."""
+        self._apply_and_log({"op": "delete", "song_id": song_id, "album_id": album_id})
+
+    def _apply_and_log(self, record):
+        with self._lock:
+            # Not loaded yet: only log the change, load() replays it
+            if self._rows is not None:
+                self._apply(record)
+            self.log.append(record)
+            if self._rows is not None and self.log.records >= COMPACT_AFTER:
+                self.compact()
+
+    def _apply(self, record):
+        op = record["op"]
+        if op == "upsert":
+            self._apply_upsert(record)
+            return
+
+        rows = self._select(record.get("song_id"), record.get("album_id"))
+        if op == "delete":
+            for i in rows:
+                self._row_of.pop(self._rows.song_ids[i], None)
+            self._rows.live[rows] = False
+        elif op == "flags":
+            for name in ("published", "blocked", "playable"):
+                if record.get(name) is not None:
+                    getattr(self._rows, name)[rows] = record[name]
+        self._rows.refresh_available(rows)
+
+    def _apply_upsert(self, record):
+        rows = self._rows
+        old = self._row_of.get(record["song_id"])
+        if rows.size == len(rows.matrix):
+            rows = self._rows = rows.grown()
+
+        # Unset flags carry over from the song's previous row; a new song
+        # takes the album-wide publish/block state from its album's songs
+        album_id = record.get("album_id") or (rows.album_ids[old] if old is not None else None)
+        sibling = old
+        if sibling is None and album_id is not None:
+            siblings = self._select(None, album_id)
+            sibling = siblings[0] if len(siblings) else None
+
+        def flag(name):
+            if record.get(name) is not None:
+                return record[name]
+            source = old if name == "playable" else sibling
+            return bool(getattr(rows, name)[source]) if source is not None else False
+
+        i = rows.size
+        rows.matrix[i] = normalize_rows(np.asarray(record["vector"], dtype=np.float32).reshape(1, VECTOR_DIM))[0]
+        rows.song_ids[i] = record["song_id"]
+        rows.album_ids[i] = album_id
+        rows.published[i] = flag("published")
+        rows.blocked[i] = flag("blocked")
+        rows.playable[i] = flag("playable")
+        rows.live[i] = True
+        for genre, mask in rows.genre_masks.items():
+            mask[i] = record["genre"] == genre
+        for mood, mask in rows.mood_masks.items():
+            mask[i] = record["mood"] == mood
+        rows.refresh_available([i])
+        rows.size = i + 1
+
+        self._row_of[record["song_id"]] = i
+        self._unconfirmed[record["song_id"]] = time.time()
+        if old is not None:
+            rows.live[old] = False
+            rows.refresh_available([old])
+
+    def _select(self, song_id, album_id):
+        """Live rows of a song or of an album."""
+        if song_id is not None:
+            row = self._row_of.get(song_id)
+            return np.array([] if row is None else [row], dtype=np.intp)
+        n = self._rows.size
+        return np.flatnonzero((self._rows.album_ids[:n] == album_id) & self._rows.live[:n])
+
+    # --- Persistence ---
+    def compact(self):
+        """Write the live songs to a new snapshot, empty the delta log and rebuild the search structures."""
+        with self._lock:
+            rows, n = self._rows, self._rows.size
+            live = np.flatnonzero(rows.live[:n])
+            genres = self._codes(rows.genre_masks, live)
+            moods = self._codes(rows.mood_masks, live)
+
+            os.makedirs(os.path.dirname(self.snapshot_path), exist_ok=True)
+            tmp_path = f"{self.snapshot_path}.{uuid.uuid4().hex}.tmp.npz"
+            np.savez(
+                tmp_path,
+                matrix=rows.matrix[live],
+                song_ids=rows.song_ids[live].astype(str),
+                album_ids=np.array(["" if a is None else a for a in rows.album_ids[live]], dtype=str),
+                published=rows.published[live],
+                blocked=rows.blocked[live],
+                playable=rows.playable[live],
+                genres=genres,
+                moods=moods,
+            )
+            os.replace(tmp_path, self.snapshot_path)
+            self.log.truncate()
+            self._load_snapshot()
+
+    def _load_snapshot(self):
+        with np.load(self.snapshot_path, allow_pickle=False) as data:
+            genres = [genre_map[c] if c >= 0 else None for c in data["genres"]]
+            moods = [MOODS[c] if c >= 0 else None for c in data["moods"]]
+            album_ids = [a or None for a in data["album_ids"].tolist()]
+            self.build(
+                data["song_ids"].tolist(), data["matrix"], album_ids, data["published"],
+                data["blocked"], data["playable"], genres, moods
+            )
+
+    def _replay(self):
+        replayed = 0
+        for record in self.log.replay():
+            self._apply(record)
+            replayed += 1
+        self.log.records = replayed
+        return replayed
+
+    @staticmethod
+    def _codes(masks, rows):
+        codes = np.full(len(rows), -1, dtype=np.int8)
+        for code, mask in enumerate(masks.values()):
+            codes[mask[rows]] = code
+        return codes
+
+    # --- Queries ---
+    def query(self, user_vector, k=10, genre=None, mood=None, include_unavailable=False, exclude=None):
+        """
+        Songs most similar to user_vector.
+        Args:
+            user_vector (np.array): 18-dim vector, e.g. from build_user_vector.
+            k (int): Number of songs to return.
+            genre (str), mood (str): Only songs with this genre / mood.
+            include_unavailable (bool): Also return unpublished, blocked or unencrypted songs.
+            exclude (iterable): Song IDs to leave out.
+        Returns:
+            list: (song_id, cosine similarity) pairs, most similar first.
+        """
+        rows, ivf = self._rows, self._ivf
+        if rows is None:
+            return []
+        n = rows.size
+        if n == 0:
+            return []
+        matrix = rows.matrix[:n]
+
+        mask = self._mask(rows, n, genre, mood, include_unavailable, exclude)
+        if not mask.any():
+            return []
+        query = normalize_rows(np.asarray(user_vector, dtype=np.float32).reshape(1, VECTOR_DIM))[0]
+
+        best = None
+        if ivf is not None:
+            # Probed lists, plus every row appended since the IVF index was built
+            candidates = np.concatenate([ivf.candidates(query), np.arange(ivf.rows, n)])
+            candidates = candidates[mask[candidates]]
+            # Too few matches in the probed lists (narrow filters): scan everything
+            if len(candidates) >= k:
+                best = candidates[top_k(matrix[candidates] @ query, k)]
+
+        if best is None:
+            scores = matrix @ query
+            scores[~mask] = -np.inf
+            best = top_k(scores, k)
+
+        similarities = matrix[best] @ query
+        return [(rows.song_ids[i], float(s)) for i, s in zip(best, similarities)]
+
+    def query_many(self, user_matrix, k=10, block_size=QUERY_BLOCK_SIZE):
+        """
+        Top-k available songs for many users at once, by exact search.
+        Scores are computed one block of songs at a time as a matrix-matrix
+        product, keeping a running top-k per user, so memory stays at
+        (users x block_size) whatever the catalogue size. Only scores above a
+        user's current k-th best are merged, which after the first block is a
+        small fraction of each block.
+        Returns:
+            list: One list of (song_id, cosine similarity) pairs per row of user_matrix.
+        """
+        rows = self._rows
+        users = normalize_rows(np.asarray(user_matrix, dtype=np.float32).reshape(-1, VECTOR_DIM))
+        m = len(users)
+        if rows is None or rows.size == 0 or m == 0:
+            return [[] for _ in range(m)]
+        n = rows.size
+        # Added to the scores: 0 for available songs, -inf for the rest
+        penalty = np.where(rows.available[:n], 0.0, -np.inf).astype(np.float32)
+
+        best_scores = np.full((m, k), -np.inf, dtype=np.float32)
+        best_rows = np.zeros((m, k), dtype=np.intp)
+        for start in range(0, n, block_size):
+            stop = min(start + block_size, n)
+            scores = users @ rows.matrix[start:stop].T
+            scores += penalty[start:stop]
+
+            if start == 0 and stop - start > k:
+                # First block: its own top-k seeds the running top-k
+                top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+                best_scores = np.take_along_axis(scores, top, axis=1)
+                best_rows = top
+                continue
+
+            # Candidates beating each user's current k-th best, packed into a padded (m, c) array
+            user_idx, col_idx = np.nonzero(scores > best_scores.min(axis=1)[:, None])
+            if len(user_idx) == 0:
+                continue
+            counts = np.bincount(user_idx, minlength=m)
+            position = np.arange(len(user_idx)) - np.repeat(np.cumsum(counts) - counts, counts)
+            new_scores = np.full((m, counts.max()), -np.inf, dtype=np.float32)
+            new_rows = np.zeros((m, counts.max()), dtype=np.intp)
+            new_scores[user_idx, position] = scores[user_idx, col_idx]
+            new_rows[user_idx, position] = start + col_idx
+
+            # Merge with the running top-k
+            merged_scores = np.concatenate([best_scores, new_scores], axis=1)
+            merged_rows = np.concatenate([best_rows, new_rows], axis=1)
+            top = np.argpartition(-merged_scores, k - 1, axis=1)[:, :k]
+            best_scores = np.take_along_axis(merged_scores, top, axis=1)
+            best_rows = np.take_along_axis(merged_rows, top, axis=1)
+
+        order = np.argsort(-best_scores, axis=1, kind="stable")
+        best_scores = np.take_along_axis(best_scores, order, axis=1)
+        best_rows = np.take_along_axis(best_rows, order, axis=1)
+        return [
+            [(rows.song_ids[i], float(s)) for i, s in zip(user_rows, user_scores) if np.isfinite(s)]
+            for user_rows, user_scores in zip(best_rows, best_scores)
+        ]
+
+    def is_available(self, song_id):
+        """True if the song is in the index and can be recommended."""
+        rows = self._rows
+        row = self._row_of.get(song_id)
+        return rows is not None and row is not None and bool(rows.available[row])
+
+    @staticmethod
+    def _mask(rows, n, genre, mood, include_unavailable, exclude):
+        mask = (rows.live[:n] if include_unavailable else rows.available[:n]).copy()
+        if genre is not None:
+            mask &= rows.genre_masks[genre][:n] if genre in rows.genre_masks else False
+        if mood is not None:
+            mask &= rows.mood_masks[mood][:n] if mood in rows.mood_masks else False
+        if exclude:
+            mask &= ~np.isin(rows.song_ids[:n], list(exclude))
+        return mask
+
+    def status(self):
+        rows = self._rows
+        if rows is None:
+            return {"loaded": False}
+        n = rows.size
+        return {
+            "loaded": True,
+            "songs": int(rows.live[:n].sum()),
+            "available": int(rows.available[:n].sum()),
+            "tombstoned_rows": int(n - rows.live[:n].sum()),
+            "pending_deltas": self.log.records,
+            "search": "ivf" if self._ivf is not None else "exact",
+            "built_at": self._built_at,
+            "flags_refreshed_at": self._refreshed_at,
+        }
@@ -0,0 +1,100 @@
+import gc
+import threading
+from contextlib import contextmanager
+
+
+class ModelVersion:
+    """One loaded set of artifacts (model, scaler, ...) and the requests using it."""
+
+    def __init__(self, name, artifacts):
+        self.name = name
+        self.artifacts = artifacts
+        self.in_flight = 0
+        self.retired = False
+
+
+class ModelRegistry:
+    """
+    Process-wide holder for the newest model of one kind.
+
+    `loader` returns `(version_name, artifacts)` for the newest artifacts on
+    disk, or None when there is nothing to load. The current version stays
+    resident between requests; `load()` swaps in a new one atomically, and a
+    replaced version is only released once the requests that acquired it have
+    finished.
+    """
+
+    def __init__(self, name, loader):
+        self.name = name
+        self._loader = loader
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._current = None
+        self._draining = []
+
+    def load(self):
+        """Load the newest artifacts from disk and make them the current version."""
+        with self._load_lock:
+            loaded = self._loader()
+            if loaded is None:
+                print(f"[{self.name}] No model available to load.")
+                return None
+
+            version_name, artifacts = loaded
+            with self._lock:
+                old = self._current
+                if old is not None and old.name == version_name:
+                    return old.name
+                self._current = ModelVersion(version_name, artifacts)
+                if old is not None:
+                    old.retired = True
+                    if old.in_flight == 0:
+                        self._release(old)
+                    else:
+                        self._draining.append(old)
+
+            print(f"[{self.name}] Active model version: {version_name}")
+            return version_name
+
+    def available(self):
+        """True if a model version is loaded, loading one on first use."""
+        if self._current is None:
+            self.load()
+        return self._current is not None
+
+    @contextmanager
+    def acquire(self):
+        """
+        Yield the current ModelVersion (or None if no model exists) and keep it
+        alive until the block exits, even if a newer version is swapped in.
+        """
+        if self._current is None:
+            self.load()
+
+        with self._lock:
+            version = self._current
+            if version is not None:
+                version.in_flight += 1
+        try:
+            yield version
+        finally:
+            if version is not None:
+                with self._lock:
+                    version.in_flight -= 1
+                    if version.retired and version.in_flight == 0 and version in self._draining:
+                        self._draining.remove(version)
+                        self._release(version)
+
+    def status(self):
+        with self._lock:
+            current = self._current
+            return {
+                "active_version": current.name if current else None,
+                "in_flight": current.in_flight if current else 0,
+                "draining_versions": [v.name for v in self._draining],
+            }
+
+    def _release(self, version):
+        print(f"[{self.name}] Released model version: {version.name}")
+        version.artifacts = None
+        gc.collect()
@@ -0,0 +1,81 @@
+"""
+Compares adaptive sampling with scoring every chunk and segment, on the
+resident genre and mood models.
+
+    python backend/ai_module/sampling_check.py backend/file_server/public/songs [more files or directories ...]
+
+For each track, prints the genre and mood of both modes, the valence and
+arousal difference and how many chunks and segments the adaptive mode
+scored. Exits non-zero when a genre or mood label differs, when a track
+cannot be checked, or when no track was checked at all.
+"""
+import argparse
+import os
+import sys
+import time
+
+from analysis import pipeline
+from batch_analysis import expand_sources
+from genre import genre_ai
+from mood import mood_ai
+
+
+def check(path):
+    features = pipeline.extract_features(path, pipeline.hash_file(path))
+
+    started = time.time()
+    exhaustive = pipeline.run_inference(features, path, exhaustive=True)
+    exhaustive_time = time.time() - started
+
+    started = time.time()
+    adaptive = pipeline.run_inference(features, path, exhaustive=False)
+    adaptive_time = time.time() - started
+
+    same = (adaptive["genre"]["prediction"] == exhaustive["genre"]["prediction"]
+            and adaptive["mood"]["prediction"] == exhaustive["mood"]["prediction"])
+    segments = adaptive["segments"]
+    return same, (
+        f"{'ok  ' if same else 'DIFF'} {os.path.basename(path)}: "
+        f"genre {exhaustive['genre']['prediction']} / {adaptive['genre']['prediction']}, "
+        f"mood {exhaustive['mood']['prediction']} / {adaptive['mood']['prediction']}, "
+        f"valence {abs(adaptive['valence'] - exhaustive['valence']):.2f} "
+        f"arousal {abs(adaptive['arousal'] - exhaustive['arousal']):.2f} off | "
+        f"chunks {segments['genre']['used']}/{segments['genre']['total']}, "
+        f"segments {segments['mood']['used']}/{segments['mood']['total']} | "
+        f"exhaustive {exhaustive_time:.2f}s, adaptive {adaptive_time:.2f}s"
+    ), segments
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare adaptive and exhaustive genre and mood scoring.")
+    parser.add_argument("sources", nargs="+", help="audio files or directories")
+    args = parser.parse_args()
+
+    genre_ai.MODEL_REGISTRY.load()
+    mood_ai.MODEL_REGISTRY.load()
+
+    lines, results, errors, used, total = [], [], [], 0, 0
+    for path in expand_sources(args.sources):
+        try:
+            same, line, segments = check(path)
+        except Exception as e:
+            print(f"Error checking {path}: {e}")
+            errors.append(path)
+            continue
+        lines.append(line)
+        results.append(same)
+        used += segments["genre"]["used"] + segments["mood"]["used"]
+        total += segments["genre"]["total"] + segments["mood"]["total"]
+
+    print("\n".join(lines))
+    if total:
+        print(f"{sum(results)}/{len(results)} tracks agree, scoring {used / total:.0%} of the chunks and segments")
+    if errors:
+        print(f"FAIL {len(errors)} tracks could not be checked")
+    if not results:
+        print("FAIL no track was checked")
+    sys.exit(0 if results and all(results) and not errors else 1)
+
+
+if __name__ == "__main__":
+    main()
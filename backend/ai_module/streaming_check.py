@@ -0,0 +1,138 @@
+"""
+Checks that streaming analysis feeds the models the same inputs as the
+regular pipeline, and finds the same tempo.
+
+    python backend/ai_module/streaming_check.py [audio files ...]
+
+Without arguments, a synthetic track just longer than STREAMING_MIN_SECONDS
+is written to a temporary WAV file, with a loud burst right before a genre
+chunk start so the window edge frames matter. Genre images, mood mel
+segments and the tempo estimate of both paths are compared; the files are
+resampled by different code (one-shot and block by block), so small
+differences are allowed. Exits non-zero when a track differs.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import soundfile as sf
+
+from genre import genre_ai
+from mood import mood_ai
+from bpm import bpm as bpm_ai
+from analysis import streaming
+from analysis.audio_context import AudioContext, ANALYSIS_SR
+from analysis.pipeline import STREAMING_MIN_SECONDS, should_stream
+from genre_window_check import synthetic_track
+
+# Largest allowed difference of any genre image pixel channel, out of 255
+MAX_PIXEL_DIFFERENCE = 1
+# Largest allowed difference of any mood mel segment value, in dB
+MAX_MEL_DB_DIFFERENCE = 0.01
+# Largest allowed difference of the track BPM and of any tempo curve point
+MAX_BPM_DIFFERENCE = 0.5
+
+
+def long_track_file(directory, seconds=STREAMING_MIN_SECONDS + 61.3, sr=ANALYSIS_SR):
+    """A synthetic track past the streaming threshold, with a burst just before the second genre chunk."""
+    y = synthetic_track(seconds, sr)
+    start = genre_ai.chunk_step(sr)
+    y[start - genre_ai.N_FFT // 2:start - genre_ai.N_FFT // 4] = 0.99
+    path = os.path.join(directory, "streaming_check.wav")
+    sf.write(path, np.clip(y, -1, 1), sr, subtype="PCM_16")
+    return path
+
+
+def regular_features(audio_path):
+    """Model inputs and tempo as pipeline.extract_features computes them."""
+    context = AudioContext.from_file(audio_path)
+    return {
+        "genre": genre_ai.extract_chunk_images(audio_path, context=context),
+        "mood": mood_ai.preprocess_song(audio_path, context=context),
+        "tempo": bpm_ai.estimate_tempo(audio_path, context=context),
+    }
+
+
+def streaming_features(audio_path):
+    """Model inputs and tempo as streaming.analyze_streaming computes them, collected instead of scored."""
+    with sf.SoundFile(audio_path) as f:
+        duration = f.frames / f.samplerate
+    genre_windows, mood_segments = streaming.GenreWindows(), streaming.MoodSegments()
+    tempo_windows = streaming.TempoWindows(duration)
+    images, segments = [], []
+    for block in streaming.read_blocks(audio_path, (streaming.MOOD_SR, streaming.GENRE_SR)):
+        images.extend(genre_windows.feed(block[streaming.GENRE_SR]))
+        segments.extend(mood_segments.feed(block[streaming.MOOD_SR]))
+        tempo_windows.feed(block[streaming.GENRE_SR])
+    images.extend(genre_windows.finish())
+    segments.extend(mood_segments.finish())
+    return {
+        "genre": np.concatenate(images),
+        "mood": np.concatenate(segments),
+        "tempo": tempo_windows.finish(),
+    }
+
+
+def compare_arrays(name, actual, expected, tolerance):
+    if actual is None or expected is None or actual.shape != expected.shape:
+        print(f"  {name}: shape {None if actual is None else actual.shape}, "
+              f"expected {None if expected is None else expected.shape}")
+        return False
+    difference = np.abs(actual.astype(np.float64) - expected.astype(np.float64))
+    print(f"  {name}: {len(actual)} inputs, max difference {difference.max():.4f}, mean {difference.mean():.6f}")
+    return difference.max() <= tolerance
+
+
+def compare_tempo(actual, expected):
+    points = [(a["time"], a["bpm"], e["time"], e["bpm"])
+              for a, e in zip(actual["tempo_curve"] or [], expected["tempo_curve"] or [])]
+    curve_ok = (len(actual["tempo_curve"] or []) == len(expected["tempo_curve"] or [])
+                and all(abs(at - et) < 1e-6 and abs(ab - eb) <= MAX_BPM_DIFFERENCE for at, ab, et, eb in points))
+    bpm_ok = (actual["bpm"] is not None and expected["bpm"] is not None
+              and abs(actual["bpm"] - expected["bpm"]) <= MAX_BPM_DIFFERENCE)
+    print(f"  tempo: {actual['bpm']} BPM (confidence {actual['confidence']}), expected {expected['bpm']} "
+          f"(confidence {expected['confidence']}), {len(points)} curve points {'match' if curve_ok else 'differ'}")
+    return bpm_ok and curve_ok
+
+
+def check(label, audio_path):
+    if not should_stream(audio_path):
+        print(f"FAIL {label}: not long enough (or not readable block by block) to be streamed")
+        return False
+
+    started = time.time()
+    expected = regular_features(audio_path)
+    regular_time = time.time() - started
+    started = time.time()
+    actual = streaming_features(audio_path)
+    streaming_time = time.time() - started
+
+    print(f"{label}: regular {regular_time:.1f}s, streaming {streaming_time:.1f}s")
+    results = [
+        compare_arrays("genre images", actual["genre"], expected["genre"], MAX_PIXEL_DIFFERENCE),
+        compare_arrays("mood segments", actual["mood"], expected["mood"], MAX_MEL_DB_DIFFERENCE),
+        compare_tempo(actual["tempo"], expected["tempo"]),
+    ]
+    print(f"{'ok  ' if all(results) else 'FAIL'} {label}")
+    return all(results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare streaming and regular analysis of long tracks.")
+    parser.add_argument("files", nargs="*")
+    args = parser.parse_args()
+
+    if args.files:
+        results = [check(path, path) for path in args.files]
+    else:
+        with tempfile.TemporaryDirectory() as directory:
+            path = long_track_file(directory)
+            results = [check(f"synthetic {sf.info(path).duration:.1f}s with edge burst", path)]
+    sys.exit(0 if results and all(results) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+Windowed tempo estimation against full-track librosa tempo on synthetic click tracks.
+
+    python backend/ai_module/tempo_benchmark.py [--seconds 240]
+
+Each track is decoded into an AudioContext like an upload; both estimates
+run on it, so the timings compare tempo work only. The windowed BPM must be
+within TEMPO_TOLERANCE of the click tempo, allowing for half or double tempo.
+On a single-tempo track it must also agree with the full-track estimate
+within TEMPO_TOLERANCE and be no less accurate than it (up to
+FULL_TRACK_SLACK); on a track that changes tempo, the first and last points
+of the tempo curve must match the first and last sections.
+Exits non-zero when a track fails.
+"""
+import argparse
+import sys
+import time
+
+import numpy as np
+import librosa
+
+from bpm import bpm as bpm_ai
+from analysis.audio_context import AudioContext, ANALYSIS_SR
+
+# (start seconds, bpm) sections of each track; the last one changes tempo halfway
+TRACKS = [[(0, 80)], [(0, 95)], [(0, 120)], [(0, 128)], [(0, 140)], [(0, 174)], [(0, 90), (0.5, 130)]]
+# Largest relative BPM error accepted, after octave correction
+TEMPO_TOLERANCE = 0.04
+OCTAVE_FACTORS = (1, 2, 0.5)
+# How much larger the windowed error may be than the full-track error: the tempo grid steps are ~1%
+FULL_TRACK_SLACK = 0.01
+
+
+def click_track(sections, seconds, sr=ANALYSIS_SR, noise=0.01):
+    times = []
+    for i, (start, bpm) in enumerate(sections):
+        start = start * seconds if start < 1 else start
+        end = sections[i + 1][0] * seconds if i + 1 < len(sections) else seconds
+        times.extend(np.arange(start, end, 60.0 / bpm))
+    y = librosa.clicks(times=np.array(times), sr=sr, length=int(seconds * sr))
+    return (y + noise * np.random.default_rng(0).standard_normal(len(y))).astype(np.float32)
+
+
+def tempo_error(estimate, reference):
+    """Relative error of a BPM estimate against the reference tempo or its closest octave."""
+    if not estimate:
+        return float("inf")
+    return min(abs(estimate - reference * factor) / (reference * factor) for factor in OCTAVE_FACTORS)
+
+
+def check(sections, windowed, full):
+    """Whether the windowed estimate matches the click tempo of `sections` and the full-track BPM, with the reason."""
+    tempos = [bpm for _, bpm in sections]
+    error = min(tempo_error(windowed["bpm"], bpm) for bpm in tempos)
+    if error > TEMPO_TOLERANCE:
+        return False, f"BPM off by {error:.1%}"
+    if len(sections) == 1:
+        if not windowed["bpm"] or abs(windowed["bpm"] - full) / full > TEMPO_TOLERANCE:
+            return False, f"disagrees with the full-track estimate {full:.1f}"
+        full_error = tempo_error(full, tempos[0])
+        if error > full_error + FULL_TRACK_SLACK:
+            return False, f"BPM off by {error:.1%}, full track only {full_error:.1%}"
+    else:
+        curve = windowed["tempo_curve"] or []
+        if not curve or tempo_error(curve[0]["bpm"], tempos[0]) > TEMPO_TOLERANCE \
+                or tempo_error(curve[-1]["bpm"], tempos[-1]) > TEMPO_TOLERANCE:
+            return False, "tempo curve misses the change"
+    return True, f"BPM off by {error:.1%}"
+
+
+def full_track_tempo(context):
+    """The previous estimate: onset envelope and tempo over the whole signal."""
+    y = context.signal(bpm_ai.TEMPO_SR)
+    onset_env = librosa.onset.onset_strength(y=y, sr=bpm_ai.TEMPO_SR)
+    return float(librosa.feature.tempo(onset_envelope=onset_env, sr=bpm_ai.TEMPO_SR)[0])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the windowed tempo estimator.")
+    parser.add_argument("--seconds", type=float, default=240)
+    args = parser.parse_args()
+
+    # Warm up librosa's JIT-compiled functions so the first track isn't skewed
+    bpm_ai.estimate_tempo(None, context=AudioContext(click_track(TRACKS[0], 30), ANALYSIS_SR))
+
+    results = []
+    for sections in TRACKS:
+        label = " -> ".join(str(bpm) for _, bpm in sections)
+
+        y = click_track(sections, args.seconds)
+
+        started = time.time()
+        windowed = bpm_ai.estimate_tempo(None, context=AudioContext(y, ANALYSIS_SR))
+        windowed_time = time.time() - started
+
+        started = time.time()
+        full = full_track_tempo(AudioContext(y, ANALYSIS_SR))
+        full_time = time.time() - started
+
+        ok, reason = check(sections, windowed, full)
+        results.append(ok)
+        curve = ", ".join(f"{point['bpm']:.0f}" for point in windowed["tempo_curve"] or [])
+        print(f"{'ok  ' if ok else 'FAIL'} {label:>10} BPM | full track {full:6.1f} in {full_time:.2f}s | "
+              f"windowed {windowed['bpm'] or 0:6.1f} in {windowed_time:.2f}s, "
+              f"confidence {windowed['confidence'] or 0:.2f}, curve [{curve}] | {reason}")
+
+    print(f"{sum(results)}/{len(results)} tracks within {TEMPO_TOLERANCE:.0%}")
+    sys.exit(0 if all(results) else 1)
+
+
+if __name__ == "__main__":
+    main()
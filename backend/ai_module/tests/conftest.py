@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The AI module imports its packages from its own directory, as main.py does when served
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
@@ -1,6 +1,10 @@
+import argparse
+import hashlib
+import json
 import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from Cryptodome.Cipher import AES
-from Cryptodome.Random import get_random_bytes
 from Cryptodome.Util.Padding import pad
 
 # Define a directory where your MP3 files are located
@@ -18,35 +22,227 @@ Hexadecimal Key: e2797ff1c1bca2b5056d20aba421f69a31b115b8f68537ffc46783404a23cfc
 Hexadecimal IV: ce0b1f79486e0bead826238530d543f0
 """
 
-def encrypt_file(file_path):
-    """Encrypts a single file using AES-CBC."""
-    try:
-        with open(file_path, 'rb') as f_in:
-            data = f_in.read()
+# Plaintext is read and encrypted this many bytes at a time; a multiple of the AES block size
+CHUNK_SIZE = 1024 * 1024
+
+def encrypted_size(plain_size):
+    """Size of the AES-CBC output: PKCS#7 always adds 1 to 16 bytes of padding."""
+    return (plain_size // AES.block_size + 1) * AES.block_size
 
+def encrypt_file(file_path, chunk_size=CHUNK_SIZE):
+    """
+    Encrypts a single file using AES-CBC, streaming it in fixed-size blocks so
+    memory use stays at one block whatever the file size. The output is
+    written to a temp file, checked against the expected size and renamed into
+    place, so a '.encrypted' file is never left half-written.
+    Returns the SHA-256 of the plaintext, or None if encryption failed.
+    """
+    new_file_path = file_path + '.encrypted'
+    tmp_path = f"{new_file_path}.{os.getpid()}.tmp"
+    try:
+        plain_size = os.path.getsize(file_path)
         cipher = AES.new(KEY, AES.MODE_CBC, IV)
-        encrypted_data = cipher.encrypt(pad(data, AES.block_size))
+        digest = hashlib.sha256()
+        buffer = bytearray(chunk_size)
+        read_size = 0
 
-        new_file_path = file_path + '.encrypted'
-        with open(new_file_path, 'wb') as f_out:
-            f_out.write(encrypted_data)
-        
+        with open(file_path, 'rb') as f_in, open(tmp_path, 'wb') as f_out:
+            while True:
+                n = f_in.readinto(buffer)
+                read_size += n
+                digest.update(memoryview(buffer)[:n])
+                if n < chunk_size:
+                    # Last block: pad the remainder (possibly empty)
+                    f_out.write(cipher.encrypt(pad(bytes(buffer[:n]), AES.block_size)))
+                    break
+                # CBC chains across calls, so block-by-block output equals one-shot encryption
+                f_out.write(cipher.encrypt(buffer))
+            f_out.flush()
+            os.fsync(f_out.fileno())
+
+        if read_size != plain_size:
+            raise IOError(f"read {read_size} bytes, expected {plain_size}; file changed while encrypting")
+        written_size = os.path.getsize(tmp_path)
+        if written_size != encrypted_size(plain_size):
+            raise IOError(f"wrote {written_size} bytes, expected {encrypted_size(plain_size)}")
+
+        os.replace(tmp_path, new_file_path)
         print(f"Encrypted '{file_path}' to '{new_file_path}'")
-        return True
+        return digest.hexdigest()
     except Exception as e:
         print(f"Error encrypting file {file_path}: {e}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return None
+
+def hash_file(file_path, chunk_size=CHUNK_SIZE):
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(chunk_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+# === Bulk encryption ===
+# Per source file: size, mtime and content hash when it was last encrypted
+MANIFEST_NAME = '.encryption_manifest.json'
+# Save the manifest at least this often, so an interrupted run loses little
+MANIFEST_SAVE_INTERVAL_SECONDS = 10
+# A temp output untouched this long is abandoned, even if its PID was reused by a live process
+STALE_TEMP_SECONDS = 3600
+
+def load_manifest(music_dir):
+    path = os.path.join(music_dir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        print(f"Ignoring unreadable manifest {path}: {e}")
+        return {}
+
+def save_manifest(music_dir, manifest):
+    path = os.path.join(music_dir, MANIFEST_NAME)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
         return False
+    except PermissionError:
+        return True
+    return True
+
+def remove_stale_temp_files(music_dir):
+    """
+    Temp outputs left behind by an interrupted run. Temp files are named
+    after the PID of the process writing them; those of a live process are
+    kept, so a concurrent run is not disturbed, unless they have not been
+    written to for STALE_TEMP_SECONDS.
+    """
+    now = time.time()
+    for filename in os.listdir(music_dir):
+        if not (filename.endswith('.tmp') and '.encrypted.' in filename):
+            continue
+        path = os.path.join(music_dir, filename)
+        pid = filename[:-len('.tmp')].rsplit('.', 1)[-1]
+        try:
+            if pid.isdigit() and _pid_alive(int(pid)) and now - os.path.getmtime(path) < STALE_TEMP_SECONDS:
+                continue
+            os.remove(path)
+        except FileNotFoundError:
+            # Renamed into place or removed by its own run meanwhile
+            pass
+
+def plan_file(file_path, entry, force=False):
+    """Whether file_path needs encrypting, given its manifest entry: 'encrypt', 'skip' or 'check'."""
+    if force or entry is None:
+        return 'encrypt'
+    output_path = file_path + '.encrypted'
+    stat = os.stat(file_path)
+    if not os.path.exists(output_path) or os.path.getsize(output_path) != encrypted_size(stat.st_size):
+        return 'encrypt'
+    if stat.st_size != entry['size']:
+        return 'encrypt'
+    if stat.st_mtime_ns == entry['mtime_ns']:
+        return 'skip'
+    # Same size, new mtime: only the content hash can tell
+    return 'check'
+
+def process_file(file_path, action, known_hash=None):
+    """Worker: encrypt (or hash-check, then encrypt if changed) one file; returns its manifest entry."""
+    started = time.time()
+    stat = os.stat(file_path)
+    if action == 'check':
+        content_hash = hash_file(file_path)
+        if content_hash == known_hash:
+            return {'status': 'unchanged', 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+                    'sha256': content_hash, 'seconds': time.time() - started}
+
+    content_hash = encrypt_file(file_path)
+    if content_hash is None:
+        return {'status': 'failed', 'seconds': time.time() - started}
+    return {'status': 'encrypted', 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+            'sha256': content_hash, 'seconds': time.time() - started}
+
+def encrypt_music_directory(music_dir=MUSIC_DIR, workers=None, force=False):
+    """
+    Encrypts all MP3 files in the music directory, in parallel processes.
+    Files whose size and mtime (or content hash) match the manifest and whose
+    output is in place are skipped, so re-runs only encrypt new or changed
+    files. The manifest is saved as files finish, so an interrupted run
+    resumes where it stopped.
+    """
+    if not os.path.exists(music_dir):
+        print(f"Error: Directory '{music_dir}' not found.")
+        return None
+
+    remove_stale_temp_files(music_dir)
+    manifest = load_manifest(music_dir)
+
+    tasks = []
+    skipped = 0
+    for filename in sorted(os.listdir(music_dir)):
+        if not filename.endswith('.mp3'):
+            continue
+        file_path = os.path.join(music_dir, filename)
+        entry = manifest.get(filename)
+        action = plan_file(file_path, entry, force)
+        if action == 'skip':
+            skipped += 1
+        else:
+            tasks.append((filename, action, entry['sha256'] if entry else None))
+    print(f"{len(tasks)} files to process, {skipped} unchanged")
+
+    counts = {'encrypted': 0, 'unchanged': 0, 'failed': 0}
+    failures = []
+    encrypted_bytes = 0
+    started = last_save = time.time()
+    with ProcessPoolExecutor(workers) as pool:
+        futures = {
+            pool.submit(process_file, os.path.join(music_dir, filename), action, known_hash): filename
+            for filename, action, known_hash in tasks
+        }
+        for future in as_completed(futures):
+            filename = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                result = {'status': 'failed', 'error': str(e)}
+
+            status = result.pop('status')
+            counts[status] += 1
+            if status == 'failed':
+                failures.append(filename)
+                continue
+            result.pop('seconds', None)
+            result['encrypted_at'] = time.strftime('%Y-%m-%dT%H:%M:%S')
+            manifest[filename] = result
+            if status == 'encrypted':
+                encrypted_bytes += result['size']
+
+            if time.time() - last_save > MANIFEST_SAVE_INTERVAL_SECONDS:
+                save_manifest(music_dir, manifest)
+                last_save = time.time()
 
-def encrypt_music_directory():
-    """Encrypts all MP3 files in the music directory."""
-    if not os.path.exists(MUSIC_DIR):
-        print(f"Error: Directory '{MUSIC_DIR}' not found.")
-        return
+    save_manifest(music_dir, manifest)
 
-    for filename in os.listdir(MUSIC_DIR):
-        if filename.endswith('.mp3'):
-            file_path = os.path.join(MUSIC_DIR, filename)
-            encrypt_file(file_path)
+    elapsed = time.time() - started
+    print(f"Encrypted {counts['encrypted']} files ({encrypted_bytes / 1e6:.1f} MB) in {elapsed:.1f}s, "
+          f"{encrypted_bytes / 1e6 / max(elapsed, 1e-9):.1f} MB/s")
+    print(f"Skipped {skipped + counts['unchanged']} unchanged files, {counts['failed']} failed")
+    for filename in failures:
+        print(f"  failed: {filename}")
+    return {'skipped': skipped + counts['unchanged'], 'failures': failures, **counts}
 
 if __name__ == '__main__':
-    encrypt_music_directory()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Encrypt new or changed MP3 files in the music directory.")
+    parser.add_argument('music_dir', nargs='?', default=MUSIC_DIR)
+    parser.add_argument('--workers', type=int, default=None, help="encryption processes (default: CPU count)")
+    parser.add_argument('--force', action='store_true', help="re-encrypt every file, ignoring the manifest")
+    args = parser.parse_args()
+    encrypt_music_directory(args.music_dir, args.workers, args.force)
@@ -0,0 +1,377 @@
+"""
+Seekable encrypted audio format.
+
+The whole-file AES-CBC of encrypt.py has to be decrypted from the start to
+reach any byte. This format splits the audio into fixed-size segments, each
+encrypted on its own with AES-256-GCM, so the segments covering any byte
+range (and so any playback offset) can be located, fetched with an HTTP range
+request and decrypted independently.
+
+Layout:
+    header   32 bytes: magic, segment size, per-file nonce prefix (8 bytes), reserved
+    segment  ciphertext (segment size bytes, the last one shorter) + 16-byte GCM tag
+    ...
+
+Segment i uses the nonce (nonce prefix || i) and authenticates the header and
+whether it is the last segment, so segments cannot be reordered, swapped
+between files or truncated away unnoticed. An empty file still has one empty
+final segment.
+
+Every song has its own 32-byte key: the one the file server's /encrypt
+generated and the API stored in songs.encryption_key (hex). The key is not
+in the file; a '.senc' file is decrypted with the same key as the song's
+'.encrypted' file, so clients keep using the key they already get. The file
+server's /encrypt writes both files for new uploads; 'migrate' converts the
+older ones. Its /public/seekable/ endpoint answers ordinary HTTP range
+requests on the encrypted file and sends the layout in headers, so a client
+maps a plaintext offset to segments with ciphertext_range() and fetches them.
+
+    python seekable.py encrypt song.mp3 ... [--key-hex HEX]
+    python seekable.py migrate [music_dir] (--keys keys.json | --db) [--remove-old]
+"""
+import argparse
+import hashlib
+import json
+import os
+import struct
+import time
+
+from Cryptodome.Cipher import AES
+from Cryptodome.Random import get_random_bytes
+from Cryptodome.Util.Padding import unpad
+
+from encrypt import IV, CHUNK_SIZE, MUSIC_DIR
+
+# === Format ===
+MAGIC = b'HQSEG001'
+HEADER = struct.Struct('>8sI8s12x')   # magic, segment size, nonce prefix, reserved
+TAG_SIZE = 16
+SEGMENT_SIZE = 64 * 1024
+EXTENSION = '.senc'
+KEY_SIZE = 32
+# Environment of the API's database, read for 'migrate --db'
+DOTENV_PATH = os.path.join(os.path.dirname(__file__), '..', '..', '..', 'src', '.env')
+
+
+def _nonce(prefix, index):
+    return prefix + struct.pack('>I', index)
+
+def _aad(header, last):
+    return header + (b'\x01' if last else b'\x00')
+
+def _segments(stream, segment_size):
+    """(plaintext, is_last) for each segment of a readable stream; at least one, possibly empty."""
+    current = stream.read(segment_size)
+    while True:
+        following = stream.read(segment_size) if len(current) == segment_size else b''
+        if not following:
+            yield current, True
+            return
+        yield current, False
+        current = following
+
+def parse_key(key_hex):
+    """A song key from its hex form in songs.encryption_key."""
+    key = bytes.fromhex(key_hex.strip())
+    if len(key) != KEY_SIZE:
+        raise ValueError(f"key must be {KEY_SIZE} bytes, got {len(key)}")
+    return key
+
+def song_id(filename):
+    """Song ID of a file in the songs folder, named '<song id>.<ext>[.encrypted|.senc]' by the upload flow."""
+    return os.path.basename(filename).split('.')[0]
+
+def _write(stream, output_path, key, segment_size=SEGMENT_SIZE):
+    """Encrypt a plaintext stream to output_path, atomically; returns the plaintext size."""
+    header = HEADER.pack(MAGIC, segment_size, get_random_bytes(8))
+    prefix = header[12:20]
+    tmp_path = f"{output_path}.{os.getpid()}.tmp"
+    plain_size = segments = 0
+    try:
+        with open(tmp_path, 'wb') as f_out:
+            f_out.write(header)
+            for index, (data, last) in enumerate(_segments(stream, segment_size)):
+                cipher = AES.new(key, AES.MODE_GCM, nonce=_nonce(prefix, index))
+                cipher.update(_aad(header, last))
+                ciphertext, tag = cipher.encrypt_and_digest(data)
+                f_out.write(ciphertext)
+                f_out.write(tag)
+                plain_size += len(data)
+                segments += 1
+            f_out.flush()
+            os.fsync(f_out.fileno())
+
+        expected = HEADER.size + plain_size + segments * TAG_SIZE
+        if os.path.getsize(tmp_path) != expected:
+            raise IOError(f"wrote {os.path.getsize(tmp_path)} bytes, expected {expected}")
+        os.replace(tmp_path, output_path)
+        return plain_size
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def encrypt_file_seekable(file_path, key, output_path=None, segment_size=SEGMENT_SIZE):
+    """Encrypts a plain audio file to the seekable format; returns the output path, or None on failure."""
+    output_path = output_path or file_path + EXTENSION
+    try:
+        with open(file_path, 'rb') as f_in:
+            plain_size = _write(f_in, output_path, key, segment_size)
+        if plain_size != os.path.getsize(file_path):
+            raise IOError("file changed while encrypting")
+        print(f"Encrypted '{file_path}' to '{output_path}'")
+        return output_path
+    except Exception as e:
+        print(f"Error encrypting file {file_path}: {e}")
+        return None
+
+
+class SeekableReader:
+    """
+    Random access to the plaintext of a seekable encrypted file. Only the
+    segments overlapping a requested range are read and decrypted.
+    """
+
+    def __init__(self, path, key):
+        self.path = path
+        self._key = key
+        self._file = open(path, 'rb')
+        self.header = self._file.read(HEADER.size)
+        if len(self.header) != HEADER.size:
+            raise ValueError(f"{path}: too short for a header")
+        magic, self.segment_size, self._prefix = HEADER.unpack(self.header)
+        if magic != MAGIC:
+            raise ValueError(f"{path}: not a seekable encrypted file")
+
+        body = os.fstat(self._file.fileno()).st_size - HEADER.size
+        stride = self.segment_size + TAG_SIZE
+        self.segment_count = max(1, -(-body // stride))
+        last = body - (self.segment_count - 1) * stride - TAG_SIZE
+        if last < 0 or (last == 0 and self.segment_count > 1):
+            raise ValueError(f"{path}: truncated")
+        self.size = (self.segment_count - 1) * self.segment_size + last
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._file.close()
+
+    def segment_range(self, start, end):
+        """Indices (first, last) of the segments covering plaintext bytes [start, end)."""
+        return start // self.segment_size, max(start, end - 1) // self.segment_size
+
+    def ciphertext_range(self, start, end):
+        """File byte range [first, stop) to fetch for plaintext bytes [start, end), e.g. for an HTTP Range header."""
+        first, last = self.segment_range(start, end)
+        stride = self.segment_size + TAG_SIZE
+        stop = min(HEADER.size + (last + 1) * stride, HEADER.size + self.size + self.segment_count * TAG_SIZE)
+        return HEADER.size + first * stride, stop
+
+    def decrypt_segment(self, index, data):
+        """Plaintext of segment `index` from its ciphertext and tag; raises ValueError if tampered with."""
+        cipher = AES.new(self._key, AES.MODE_GCM, nonce=_nonce(self._prefix, index))
+        cipher.update(_aad(self.header, index == self.segment_count - 1))
+        return cipher.decrypt_and_verify(data[:-TAG_SIZE], data[-TAG_SIZE:])
+
+    def read_range(self, start, end=None):
+        """Decrypted plaintext bytes [start, end), clipped to the file size."""
+        end = self.size if end is None else min(end, self.size)
+        if start >= end:
+            return b''
+
+        first, last = self.segment_range(start, end)
+        offset, stop = self.ciphertext_range(start, end)
+        self._file.seek(offset)
+        data = self._file.read(stop - offset)
+
+        stride = self.segment_size + TAG_SIZE
+        plain = b''.join(
+            self.decrypt_segment(index, data[i * stride:(i + 1) * stride])
+            for i, index in enumerate(range(first, last + 1))
+        )
+        skip = start - first * self.segment_size
+        return plain[skip:skip + end - start]
+
+
+# === Migration from whole-file AES-CBC ===
+# Leading bytes of the audio formats uploads come in; a wrong key decrypts to none of them
+AUDIO_SIGNATURES = (b'ID3', b'fLaC', b'RIFF', b'OggS')
+
+def looks_like_audio(head):
+    """Whether decrypted bytes start like an audio file: a known container or an MPEG frame sync."""
+    if head.startswith(AUDIO_SIGNATURES) or head[4:8] == b'ftyp':
+        return True
+    return len(head) >= 2 and head[0] == 0xFF and head[1] & 0xE0 == 0xE0
+
+class _CBCDecryptingReader:
+    """
+    Readable stream of the plaintext of a '.encrypted' file, decrypted chunk
+    by chunk, hashing what it returns.
+    """
+
+    def __init__(self, path, key, iv=IV):
+        self._file = open(path, 'rb')
+        self._cipher = AES.new(key, AES.MODE_CBC, iv)
+        self._buffer = bytearray()
+        self._held = b''   # last decrypted block, kept back until EOF to strip its padding
+        self._done = False
+        self.digest = hashlib.sha256()
+        self.size = 0
+
+    def _fill(self, n):
+        while len(self._buffer) < n and not self._done:
+            chunk = self._file.read(CHUNK_SIZE)
+            if len(chunk) % AES.block_size:
+                raise ValueError("ciphertext is not a whole number of AES blocks")
+            if chunk:
+                plain = self._held + self._cipher.decrypt(chunk)
+                self._buffer += plain[:-AES.block_size]
+                self._held = plain[-AES.block_size:]
+            else:
+                self._buffer += unpad(self._held, AES.block_size)
+                self._done = True
+
+    def peek(self, n):
+        """Up to n bytes from the current position, without consuming them."""
+        self._fill(n)
+        return bytes(self._buffer[:n])
+
+    def read(self, n):
+        self._fill(n)
+        data = bytes(self._buffer[:n])
+        del self._buffer[:n]
+        self.digest.update(data)
+        self.size += len(data)
+        return data
+
+    def close(self):
+        self._file.close()
+
+
+def verify_file(path, key, expected_sha256, expected_size):
+    """Decrypt a whole '.senc' file with SeekableReader and check it against the plaintext it should hold."""
+    digest = hashlib.sha256()
+    with SeekableReader(path, key) as reader:
+        if reader.size != expected_size:
+            raise ValueError(f"holds {reader.size} bytes, expected {expected_size}")
+        for start in range(0, reader.size, reader.segment_size):
+            digest.update(reader.read_range(start, start + reader.segment_size))
+    if digest.hexdigest() != expected_sha256:
+        raise ValueError("decrypted content differs from the original")
+
+
+def migrate_file(encrypted_path, key, remove_old=False):
+    """
+    Re-encrypt a '.encrypted' file to the seekable format with the song's own
+    key, without writing plaintext to disk. The new file is read back in full
+    and compared with the original's plaintext; only then is the original
+    removed (with remove_old), and a file that fails any check is discarded.
+    """
+    output_path = encrypted_path[:-len('.encrypted')] + EXTENSION
+    reader = _CBCDecryptingReader(encrypted_path, key)
+    try:
+        if not looks_like_audio(reader.peek(16)):
+            raise ValueError("decrypted data is not audio; wrong key?")
+        _write(reader, output_path, key)
+        verify_file(output_path, key, reader.digest.hexdigest(), reader.size)
+    except Exception as e:
+        print(f"Error migrating {encrypted_path}: {e}")
+        if os.path.exists(output_path):
+            os.remove(output_path)
+        return None
+    finally:
+        reader.close()
+
+    if remove_old:
+        os.remove(encrypted_path)
+    print(f"Migrated '{encrypted_path}' to '{output_path}'")
+    return output_path
+
+
+def load_key_map(path):
+    """Song keys from a JSON file mapping song IDs (or file names) to hex keys."""
+    with open(path) as f:
+        return {song_id(name): parse_key(key_hex) for name, key_hex in json.load(f).items()}
+
+
+def load_db_keys():
+    """Song keys from songs.encryption_key, using the API's database settings."""
+    import psycopg2
+    from dotenv import load_dotenv
+
+    load_dotenv(DOTENV_PATH)
+    conn = psycopg2.connect(
+        dbname=os.getenv("PGDATABASE"),
+        user=os.getenv("PGUSER"),
+        password=os.getenv("PGPASSWORD"),
+        host=os.getenv("PGHOST"),
+        port=os.getenv("PGPORT"),
+    )
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT id::text, encryption_key FROM songs WHERE encryption_key IS NOT NULL")
+            rows = cur.fetchall()
+    finally:
+        conn.close()
+
+    keys = {}
+    for song, key_hex in rows:
+        try:
+            keys[song] = parse_key(key_hex)
+        except ValueError as e:
+            print(f"Ignoring the key of song {song}: {e}")
+    return keys
+
+
+def migrate_directory(keys, music_dir=MUSIC_DIR, remove_old=False):
+    """
+    Migrate every '.encrypted' file that has no seekable counterpart yet,
+    each with its song's key from `keys` (song ID to key); safe to re-run.
+    """
+    started = time.time()
+    migrated, failed = 0, []
+    for filename in sorted(os.listdir(music_dir)):
+        if not filename.endswith('.encrypted'):
+            continue
+        path = os.path.join(music_dir, filename)
+        if os.path.exists(path[:-len('.encrypted')] + EXTENSION):
+            continue
+        key = keys.get(song_id(filename))
+        if key is None:
+            print(f"No key for song {song_id(filename)}, '{filename}' not migrated")
+            failed.append(filename)
+        elif migrate_file(path, key, remove_old):
+            migrated += 1
+        else:
+            failed.append(filename)
+    print(f"Migrated {migrated} files in {time.time() - started:.1f}s, {len(failed)} failed")
+    return migrated, failed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Seekable encrypted audio files.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    encrypt_parser = commands.add_parser('encrypt', help="encrypt audio files to the seekable format")
+    encrypt_parser.add_argument('files', nargs='+')
+    encrypt_parser.add_argument('--key-hex', help="song key; by default a new random key per file, printed")
+    migrate_parser = commands.add_parser('migrate', help="convert '.encrypted' files to the seekable format")
+    migrate_parser.add_argument('music_dir', nargs='?', default=MUSIC_DIR)
+    key_source = migrate_parser.add_mutually_exclusive_group(required=True)
+    key_source.add_argument('--keys', help="JSON file mapping song IDs to hex keys")
+    key_source.add_argument('--db', action='store_true', help="read the keys from songs.encryption_key")
+    migrate_parser.add_argument('--remove-old', action='store_true',
+                                help="delete each '.encrypted' file once its migration is verified")
+    args = parser.parse_args()
+
+    if args.command == 'encrypt':
+        for file_path in args.files:
+            key = parse_key(args.key_hex) if args.key_hex else get_random_bytes(KEY_SIZE)
+            if encrypt_file_seekable(file_path, key) and not args.key_hex:
+                print(f"Key of '{file_path}': {key.hex()}")
+    else:
+        keys = load_key_map(args.keys) if args.keys else load_db_keys()
+        migrate_directory(keys, args.music_dir, args.remove_old)
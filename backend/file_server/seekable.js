@@ -0,0 +1,112 @@
+// Seekable '.senc' format of public/songs/seekable.py (SeekableReader there):
+// a 32-byte header, then segments of `segmentSize` plaintext bytes, each
+// AES-256-GCM encrypted on its own and followed by its 16-byte tag. Segment i
+// starts at file offset HEADER_SIZE + i * (segmentSize + TAG_SIZE), so clients
+// fetch the segments covering a plaintext offset with an ordinary byte range
+// and decrypt them with the song's key.
+const fs = require('fs');
+const crypto = require('crypto');
+
+const MAGIC = Buffer.from('HQSEG001');
+const HEADER_SIZE = 32;
+const TAG_SIZE = 16;
+const SEGMENT_SIZE = 64 * 1024;
+
+class SeekableFile {
+    constructor(filePath) {
+        const fd = fs.openSync(filePath, 'r');
+        try {
+            this.header = Buffer.alloc(HEADER_SIZE);
+            const fileSize = fs.fstatSync(fd).size;
+            if (fs.readSync(fd, this.header, 0, HEADER_SIZE, 0) !== HEADER_SIZE) {
+                throw new Error(`${filePath}: too short for a header`);
+            }
+            if (!this.header.subarray(0, 8).equals(MAGIC)) {
+                throw new Error(`${filePath}: not a seekable encrypted file`);
+            }
+            this.segmentSize = this.header.readUInt32BE(8);
+            this.fileSize = fileSize;
+
+            const body = fileSize - HEADER_SIZE;
+            const stride = this.segmentSize + TAG_SIZE;
+            this.segmentCount = Math.max(1, Math.ceil(body / stride));
+            const last = body - (this.segmentCount - 1) * stride - TAG_SIZE;
+            if (last < 0 || (last === 0 && this.segmentCount > 1)) {
+                throw new Error(`${filePath}: truncated`);
+            }
+            this.size = (this.segmentCount - 1) * this.segmentSize + last;
+        } finally {
+            fs.closeSync(fd);
+        }
+    }
+}
+
+// Segment i is authenticated with the header and whether it is the last one
+function segmentCipher(key, header, index, last) {
+    const nonce = Buffer.alloc(12);
+    header.copy(nonce, 0, 12, 20);
+    nonce.writeUInt32BE(index, 8);
+    const cipher = crypto.createCipheriv('aes-256-gcm', key, nonce);
+    cipher.setAAD(Buffer.concat([header, Buffer.from([last ? 1 : 0])]));
+    return cipher;
+}
+
+// Encrypt a plain file to the seekable format with the song's key, reading one
+// segment at a time; written to a temp file and renamed into place
+function encryptFileSeekable(filePath, outputPath, key, segmentSize = SEGMENT_SIZE) {
+    const header = Buffer.alloc(HEADER_SIZE);
+    MAGIC.copy(header, 0);
+    header.writeUInt32BE(segmentSize, 8);
+    crypto.randomBytes(8).copy(header, 12);
+
+    const plainSize = fs.statSync(filePath).size;
+    const segmentCount = Math.max(1, Math.ceil(plainSize / segmentSize));
+    const tmpPath = `${outputPath}.${process.pid}.tmp`;
+    const input = fs.openSync(filePath, 'r');
+    try {
+        const output = fs.openSync(tmpPath, 'w');
+        try {
+            fs.writeSync(output, header);
+            const buffer = Buffer.alloc(segmentSize);
+            for (let index = 0; index < segmentCount; index++) {
+                const n = fs.readSync(input, buffer, 0, segmentSize, index * segmentSize);
+                const cipher = segmentCipher(key, header, index, index === segmentCount - 1);
+                fs.writeSync(output, Buffer.concat([cipher.update(buffer.subarray(0, n)), cipher.final()]));
+                fs.writeSync(output, cipher.getAuthTag());
+            }
+            fs.fsyncSync(output);
+        } finally {
+            fs.closeSync(output);
+        }
+
+        const expected = HEADER_SIZE + plainSize + segmentCount * TAG_SIZE;
+        if (fs.statSync(tmpPath).size !== expected) {
+            throw new Error(`${outputPath}: wrote ${fs.statSync(tmpPath).size} bytes, expected ${expected}`);
+        }
+        fs.renameSync(tmpPath, outputPath);
+    } finally {
+        fs.closeSync(input);
+        if (fs.existsSync(tmpPath)) fs.unlinkSync(tmpPath);
+    }
+    return outputPath;
+}
+
+// Single "bytes=a-b", "bytes=a-" or "bytes=-n" range as [start, end), null without
+// a Range header, or false if it cannot be satisfied
+function parseRange(header, size) {
+    if (!header) return null;
+    const match = /^bytes=(\d*)-(\d*)$/.exec(header.trim());
+    if (!match || (match[1] === '' && match[2] === '')) return false;
+
+    let start, end;
+    if (match[1] === '') {
+        start = Math.max(0, size - Number(match[2]));
+        end = size;
+    } else {
+        start = Number(match[1]);
+        end = match[2] === '' ? size : Math.min(Number(match[2]) + 1, size);
+    }
+    return start < end ? [start, end] : false;
+}
+
+module.exports = { SeekableFile, encryptFileSeekable, parseRange, HEADER_SIZE, TAG_SIZE, SEGMENT_SIZE };
@@ -4,6 +4,7 @@ const path = require('path');
 const fs = require('fs');
 const cors = require('cors');
 const crypto = require('crypto');
+const { SeekableFile, encryptFileSeekable, parseRange, HEADER_SIZE, TAG_SIZE } = require('./seekable');
 
 // --- Public Server (Read-only) ---
 // This server will only serve static files (GET requests)
@@ -16,6 +17,59 @@ publicApp.use(cors({
     allowedHeaders: ["*"]
 }));
 
+// Seekable encrypted songs ('.senc', see seekable.js and public/songs/seekable.py). Range
+// requests are plain HTTP ranges over the encrypted file; the layout headers let the client
+// turn a plaintext offset into the byte range of the segments covering it and decrypt them
+// with the song key.
+const SEEKABLE_HEADERS = [
+    'X-Seekable-Header', 'X-Seekable-Header-Size', 'X-Seekable-Tag-Size',
+    'X-Seekable-Segment-Size', 'X-Seekable-Segment-Count', 'X-Seekable-Plain-Size'
+];
+
+publicApp.get('/public/seekable/:filename', (req, res) => {
+    const filename = path.basename(req.params.filename);
+    const filePath = path.join(__dirname, 'public/songs', filename.endsWith('.senc') ? filename : filename + '.senc');
+    if (!fs.existsSync(filePath)) {
+        return res.status(404).send('File not found');
+    }
+
+    let file;
+    try {
+        file = new SeekableFile(filePath);
+    } catch (err) {
+        console.error(err);
+        return res.status(500).send('Unreadable seekable file');
+    }
+
+    res.set({
+        'Accept-Ranges': 'bytes',
+        'Content-Type': 'application/octet-stream',
+        'Access-Control-Expose-Headers': [...SEEKABLE_HEADERS, 'Accept-Ranges', 'Content-Range'].join(', '),
+        'X-Seekable-Header': file.header.toString('base64'),
+        'X-Seekable-Header-Size': HEADER_SIZE,
+        'X-Seekable-Tag-Size': TAG_SIZE,
+        'X-Seekable-Segment-Size': file.segmentSize,
+        'X-Seekable-Segment-Count': file.segmentCount,
+        'X-Seekable-Plain-Size': file.size
+    });
+
+    const range = parseRange(req.headers.range, file.fileSize);
+    if (range === false) {
+        return res.status(416).set('Content-Range', `bytes */${file.fileSize}`).end();
+    }
+    if (range === null) {
+        res.set('Content-Length', file.fileSize);
+        return fs.createReadStream(filePath).pipe(res);
+    }
+
+    const [start, end] = range;
+    res.status(206).set({
+        'Content-Range': `bytes ${start}-${end - 1}/${file.fileSize}`,
+        'Content-Length': end - start
+    });
+    fs.createReadStream(filePath, { start, end: end - 1 }).pipe(res);
+});
+
 // Middleware to serve files without extension
 publicApp.get('/public/:type/:filename', (req, res, next) => {
     const { type, filename } = req.params;
@@ -133,7 +187,10 @@ internalApp.post('/encrypt/:filename', (req, res) => {
         const encryptedPath = filePath + '.encrypted';
         fs.writeFileSync(encryptedPath, encrypted);
 
-        console.log(`Encrypted ${filename} -> ${path.basename(encryptedPath)}`);
+        // Seekable copy under the same key, served by /public/seekable
+        const seekablePath = encryptFileSeekable(filePath, filePath + '.senc', key);
+
+        console.log(`Encrypted ${filename} -> ${path.basename(encryptedPath)}, ${path.basename(seekablePath)}`);
 
         fs.unlink(filePath, (err) => {
         if (err) console.error('Error deleting original file:', err);
@@ -144,6 +201,7 @@ internalApp.post('/encrypt/:filename', (req, res) => {
             message: 'File encrypted successfully',
             original: filename,
             encrypted: path.basename(encryptedPath),
+            seekable: path.basename(seekablePath),
             key_hex: key.toString('hex'),
             iv_hex: iv.toString('hex'),
             key_base64: key.toString('base64'),
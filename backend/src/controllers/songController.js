@@ -1,6 +1,6 @@
 import { ModelSetSong,ModelSetUserSong, ModelUpdateSong,ModelDeleteSong } from "../models/Song.js";
 import { uploadFileToServer,deleteFileOnServer, encryptFile } from "../services/fileService.js";
-import axios from "axios";
+import { predictSongFeatures, isAiBusy } from "../services/aiService.js";
 
 import { ModelListSongs, ModelCountSongs, ModelGetSongById, ModelInsertLikedSongs,ModelRemoveLikedSongs } from "../models/Song.js";
 import { updateSongHistory, getDuration } from '../models/SongHistory.js'
@@ -78,17 +78,7 @@ export const setSong = async (req, res) => {
       console.log("Calling AI model...");
       console.log("Sending to AI service:", file_url);
 
-      const aiResponse = await axios.get("http://localhost:8000/predict", {
-        params: { file_url },
-        paramsSerializer: (params) =>
-          Object.keys(params)
-            .map(
-              (key) => `${key}=${encodeURIComponent(params[key])}`
-            ) 
-            .join("&"),
-      });
-
-      const data = aiResponse.data;
+      const data = await predictSongFeatures({ file_url, song_id: file_id, album_id: albumId });
       console.log("AI response:", data);
 
       features = {
@@ -102,6 +92,12 @@ export const setSong = async (req, res) => {
       console.log("Extracted features:", features);
     } catch (aiError) {
       console.error("AI feature extraction failed:", aiError.message);
+      if (isAiBusy(aiError)) {
+        return res
+          .status(503)
+          .set("Retry-After", aiError.response.headers["retry-after"] || "10")
+          .json({ message: "AI analysis is busy, please try again shortly." });
+      }
       return res.status(500).json({ message: "AI feature extraction failed." });
     }
 
@@ -171,15 +167,7 @@ export const setUserSong = async (req, res) => {
       console.log("Calling AI model...");
       console.log("Sending to AI service:", file_url);
 
-      const aiResponse = await axios.get("http://localhost:8000/predict", {
-        params: { file_url },
-        paramsSerializer: (params) =>
-          Object.keys(params)
-            .map((key) => `${key}=${encodeURIComponent(params[key])}`)
-            .join("&"),
-      });
-
-      const data = aiResponse.data;
+      const data = await predictSongFeatures({ file_url, song_id: file_id, album_id: albumId });
       console.log("AI response:", data);
 
       features = {
@@ -193,6 +181,12 @@ export const setUserSong = async (req, res) => {
       console.log("Extracted features:", features);
     } catch (aiError) {
       console.error("AI feature extraction failed:", aiError.message);
+      if (isAiBusy(aiError)) {
+        return res
+          .status(503)
+          .set("Retry-After", aiError.response.headers["retry-after"] || "10")
+          .json({ message: "AI analysis is busy, please try again shortly." });
+      }
       return res.status(500).json({ message: "AI feature extraction failed." });
     }
 
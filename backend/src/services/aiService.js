@@ -0,0 +1,45 @@
+import axios from "axios";
+import dotenv from "dotenv";
+dotenv.config();
+
+const AI_MODULE_URL = process.env.AI_MODULE_URL || "http://localhost:8000";
+// The AI module answers 503 + Retry-After while its analysis pool is full;
+// uploads wait that long and try again, a bounded number of times
+const PREDICT_MAX_RETRIES = Number(process.env.AI_PREDICT_MAX_RETRIES || 5);
+const PREDICT_MAX_WAIT_SECONDS = 60;
+
+const sleep = (ms) => new Promise((resolve) => setTimeout(resolve, ms));
+
+const retryAfterSeconds = (error) => {
+  const seconds = Number(error.response?.headers?.["retry-after"]);
+  return Number.isFinite(seconds) && seconds > 0 ? Math.min(seconds, PREDICT_MAX_WAIT_SECONDS) : 5;
+};
+
+/**
+ * Analyse an uploaded song with the AI module's /predict, retrying while the
+ * analysis pool is busy. Throws the last error once retries run out; a 503
+ * there keeps its response, so callers can tell "busy" from "failed".
+ */
+export const predictSongFeatures = async (params) => {
+  for (let attempt = 0; ; attempt++) {
+    try {
+      const response = await axios.get(`${AI_MODULE_URL}/predict`, {
+        params,
+        paramsSerializer: (params) =>
+          Object.keys(params)
+            .map((key) => `${key}=${encodeURIComponent(params[key])}`)
+            .join("&"),
+      });
+      return response.data;
+    } catch (error) {
+      if (error.response?.status !== 503 || attempt >= PREDICT_MAX_RETRIES) {
+        throw error;
+      }
+      const wait = retryAfterSeconds(error);
+      console.log(`AI module busy, retrying in ${wait}s (${attempt + 1}/${PREDICT_MAX_RETRIES})`);
+      await sleep(wait * 1000);
+    }
+  }
+};
+
+export const isAiBusy = (error) => error.response?.status === 503;